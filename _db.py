@@ -1,80 +1,152 @@
+import contextlib
 import sys
+import threading
+import time
 
 import mysql.connector
+from mysql.connector import errors, pooling
 
+from cache import TTLCache
 from settings import CONFIG
+from sql_recorder import recorder
 
 
 class Database:
+    def __init__(
+        self, pool_size: int = 0, connection: dict = None, table_prefix: str = None
+    ):
+        # With a pool, conn.close() hands the connection back instead of
+        # closing it, so the per-call connect/close pattern in cursor() stays.
+        self.pool_size = pool_size
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.connection = connection or {
+            "user": CONFIG.user,
+            "password": CONFIG.password,
+            "host": CONFIG.host,
+            "port": CONFIG.port,
+            "database": CONFIG.database,
+        }
+        self.table_prefix = (
+            CONFIG.TABLE_PREFIX if table_prefix is None else table_prefix
+        )
+        # Write-through cache of crawler keys (slug -> post/term id) and of
+        # the meta values read through get_meta_value (thumbnail ids,
+        # counters, checkpoints), so revisits of known films hardly read.
+        self.cache = TTLCache(
+            max_size=getattr(CONFIG, "DB_CACHE_SIZE", 100000),
+            ttl=getattr(CONFIG, "DB_CACHE_TTL", 3600),
+        )
+        self.cached_meta_keys = set()
+
+    def get_pool(self):
+        with self.pool_lock:
+            if not self.pool:
+                self.pool = pooling.MySQLConnectionPool(
+                    pool_name=f"crawler_{id(self)}",
+                    pool_size=self.pool_size,
+                    **self.connection,
+                )
+        return self.pool
+
+    def get_pooled_conn(self):
+        deadline = time.monotonic() + getattr(CONFIG, "DB_POOL_TIMEOUT", 30)
+        while True:
+            try:
+                return self.get_pool().get_connection()
+            except errors.PoolError:
+                # Every connection is checked out, wait for one to come back
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
     def get_conn(self):
         try:
-            return mysql.connector.connect(
-                user=CONFIG.user,
-                password=CONFIG.password,
-                host=CONFIG.host,
-                port=CONFIG.port,
-                database=CONFIG.database,
-            )
+            if self.pool_size:
+                conn = self.get_pooled_conn()
+            else:
+                conn = mysql.connector.connect(**self.connection)
+        except errors.PoolError:
+            raise
         except Exception as e:
             print(f"Error connecting to MariaDB Platform: {e}")
             sys.exit(1)
 
-    def select_with(self, query: str) -> list:
+        return recorder.wrap_connection(conn)
+
+    @contextlib.contextmanager
+    def cursor(self, commit: bool = False):
+        # Cursor and connection are closed even when the statement fails,
+        # otherwise a caught error (e.g. a duplicate key) would keep its
+        # pooled connection checked out for good
         conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(query)
-        res = cur.fetchall()
-        cur.close()
-        conn.close()
+        try:
+            cur = conn.cursor()
+            try:
+                yield cur
+                if commit:
+                    conn.commit()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
 
-        return res
+    def select_with(self, query: str) -> list:
+        with self.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchall()
+
+    def select_with_data(self, query: str, data: tuple = ()) -> list:
+        with self.cursor() as cur:
+            cur.execute(query, data)
+            return cur.fetchall()
 
     def select_all_from(self, table: str, condition: str = "1=1", cols: str = "*"):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(f"SELECT {cols} FROM {table} WHERE {condition}")
-        res = cur.fetchall()
-        cur.close()
-        conn.close()
+        with self.cursor() as cur:
+            cur.execute(f"SELECT {cols} FROM {table} WHERE {condition}")
+            return cur.fetchall()
 
-        return res
+    def get_insert_columns(self, table: str) -> list:
+        # CONFIG.INSERT is keyed by the default prefix's table names
+        if table.startswith(self.table_prefix):
+            table = CONFIG.TABLE_PREFIX + table[len(self.table_prefix) :]
+        return CONFIG.INSERT[table]
 
     def insert_into(self, table: str, data: tuple = None, is_bulk: bool = False):
-        conn = self.get_conn()
-        cur = conn.cursor()
         id = 0
 
-        columns = f"({', '.join(CONFIG.INSERT[table])})"
-        values = f"({', '.join(['%s'] * len(CONFIG.INSERT[table]))})"
+        insert_columns = self.get_insert_columns(table)
+        columns = f"({', '.join(insert_columns)})"
+        values = f"({', '.join(['%s'] * len(insert_columns))})"
         query = f"INSERT INTO {table} {columns} VALUES {values}"
-        if is_bulk:
-            cur.executemany(query, data)
-        else:
-            cur.execute(query, data)
-            id = cur.lastrowid
+        with self.cursor(commit=True) as cur:
+            if is_bulk:
+                cur.executemany(query, data)
+            else:
+                cur.execute(query, data)
+                id = cur.lastrowid
+
+        if table.endswith("meta") and self.cached_meta_keys:
+            for row in data if is_bulk else [data]:
+                if row[1] in self.cached_meta_keys:
+                    self.cache.set(("meta", table, int(row[0]), row[1]), str(row[2]))
 
-        conn.commit()
-        cur.close()
-        conn.close()
         return id
 
     def update_table(
         self, table: str, set_cond: str, where_cond: str, data: tuple = ()
     ):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(f"UPDATE {table} set {set_cond} WHERE {where_cond}", data)
-        conn.commit()
-        cur.close()
-        conn.close()
+        with self.cursor(commit=True) as cur:
+            cur.execute(f"UPDATE {table} set {set_cond} WHERE {where_cond}", data)
 
     def delete_from(self, table: str = "", condition: str = "1=1"):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(f"DELETE FROM {table} WHERE {condition}")
-        conn.commit()
-        cur.close()
-        conn.close()
+        with self.cursor(commit=True) as cur:
+            cur.execute(f"DELETE FROM {table} WHERE {condition}")
+
+    def execute(self, query: str, data: tuple = ()) -> int:
+        with self.cursor(commit=True) as cur:
+            cur.execute(query, data)
+            return cur.rowcount
 
     def select_or_insert(self, table: str, condition: str, data: tuple):
         res = self.select_all_from(table=table, condition=condition)
@@ -83,8 +155,238 @@ class Database:
             res = self.select_all_from(table, condition=condition)
         return res
 
+    def get_meta_value(self, table: str, id_col: str, object_id: int, meta_key: str):
+        self.cached_meta_keys.add(meta_key)
+        cache_key = ("meta", table, int(object_id), meta_key)
+        meta_value = self.cache.get(cache_key)
+        if meta_value is not None:
+            return meta_value
 
-database = Database()
+        res = self.select_with_data(
+            f"SELECT meta_value FROM {table} WHERE {id_col}=%s AND meta_key=%s",
+            (object_id, meta_key),
+        )
+        if not res:
+            return None
+
+        self.cache.set(cache_key, res[0][0])
+        return res[0][0]
+
+    def get_meta_values(
+        self,
+        table: str,
+        id_col: str,
+        object_ids: list,
+        meta_key: str,
+        chunk_size: int = 1000,
+    ) -> dict:
+        # {object_id: meta_value} of the ones carrying meta_key, like
+        # get_meta_value but one query per chunk of uncached IDs
+        self.cached_meta_keys.add(meta_key)
+        res = {}
+        missing = []
+        for object_id in object_ids:
+            meta_value = self.cache.get(("meta", table, int(object_id), meta_key))
+            if meta_value is None:
+                missing.append(int(object_id))
+            else:
+                res[int(object_id)] = meta_value
+
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i : i + chunk_size]
+            for object_id, meta_value in self.select_with_data(
+                f"SELECT {id_col}, meta_value FROM {table} WHERE meta_key=%s "
+                f"AND {id_col} IN ({', '.join(['%s'] * len(chunk))})",
+                tuple([meta_key] + chunk),
+            ):
+                if int(object_id) not in res:
+                    self.cache.set(
+                        ("meta", table, int(object_id), meta_key), meta_value
+                    )
+                    res[int(object_id)] = meta_value
+        return res
+
+    def update_meta_value(
+        self,
+        table: str,
+        id_col: str,
+        object_id: int,
+        meta_key: str,
+        meta_value,
+        adding: bool = False,
+    ):
+        # Single statement so concurrent writers can't lose each other's updates
+        if adding:
+            set_cond = "meta_value = CAST(meta_value AS UNSIGNED) + %s"
+        else:
+            set_cond = "meta_value = GREATEST(CAST(meta_value AS UNSIGNED), %s)"
+
+        self.update_table(
+            table=table,
+            set_cond=set_cond,
+            where_cond=f"{id_col}=%s AND meta_key=%s",
+            data=(int(meta_value), object_id, meta_key),
+        )
+        self.update_cached_meta_value(table, object_id, meta_key, meta_value, adding)
+
+    def update_meta_values(self, table: str, id_col: str, updates: list):
+        # updates: [(object_id, meta_key, meta_value, adding)], all applied
+        # by a single UPDATE
+        cases = []
+        data = []
+        for object_id, meta_key, meta_value, adding in updates:
+            if adding:
+                cases.append(
+                    f"WHEN {id_col}=%s AND meta_key=%s "
+                    "THEN CAST(meta_value AS UNSIGNED) + %s"
+                )
+            else:
+                cases.append(
+                    f"WHEN {id_col}=%s AND meta_key=%s "
+                    "THEN GREATEST(CAST(meta_value AS UNSIGNED), %s)"
+                )
+            data.extend([object_id, meta_key, int(meta_value)])
+
+        pairs = ", ".join(["(%s, %s)"] * len(updates))
+        for object_id, meta_key, _, _ in updates:
+            data.extend([object_id, meta_key])
+
+        self.update_table(
+            table=table,
+            set_cond=f"meta_value = CASE {' '.join(cases)} ELSE meta_value END",
+            where_cond=f"({id_col}, meta_key) IN ({pairs})",
+            data=tuple(data),
+        )
+
+        for object_id, meta_key, meta_value, adding in updates:
+            self.update_cached_meta_value(
+                table, object_id, meta_key, meta_value, adding
+            )
+
+    def update_cached_meta_value(
+        self, table: str, object_id: int, meta_key: str, meta_value, adding: bool
+    ):
+        # Same arithmetic on the cached value; other processes' updates are
+        # only seen once the entry expires
+        cache_key = ("meta", table, int(object_id), meta_key)
+        cached_value = self.cache.get(cache_key)
+        if cached_value is not None:
+            if adding:
+                cached_value = int(cached_value) + int(meta_value)
+            else:
+                cached_value = max(int(cached_value), int(meta_value))
+            self.cache.set(cache_key, str(cached_value))
+
+    def get_post_by_meta(self, meta_key: str, meta_value, post_type: str):
+        # (ID, post_name) of the first post of post_type carrying the meta
+        cache_key = ("post_by_meta", meta_key, str(meta_value), post_type)
+        post = self.cache.get(cache_key)
+        if post:
+            return post
+
+        res = self.select_with_data(
+            f"SELECT p.ID, p.post_name FROM {self.table_prefix}postmeta pm "
+            f"JOIN {self.table_prefix}posts p ON p.ID = pm.post_id "
+            "WHERE pm.meta_key=%s AND pm.meta_value=%s AND p.post_type=%s "
+            "ORDER BY p.ID LIMIT 1",
+            (meta_key, str(meta_value), post_type),
+        )
+        if not res:
+            return None
+
+        post = (res[0][0], res[0][1])
+        self.cache.set(cache_key, post)
+        return post
+
+    def set_post_by_meta(
+        self, post_id: int, post_name: str, meta_key: str, meta_value, post_type: str
+    ):
+        self.insert_into(
+            table=f"{self.table_prefix}postmeta",
+            data=(post_id, meta_key, str(meta_value)),
+        )
+        self.cache.set(
+            ("post_by_meta", meta_key, str(meta_value), post_type),
+            (post_id, post_name),
+        )
+
+    def get_key(self, key_type: str, key_name: str, exists=None):
+        # Only IDs that `exists` confirmed are cached, so a post or term
+        # deleted from wp-admin is noticed once its cache entry expires
+        object_id = self.cache.get(("key", key_type, key_name))
+        if object_id:
+            return object_id
+
+        res = self.select_with_data(
+            f"SELECT object_id FROM {self.table_prefix}crawler_keys "
+            "WHERE key_type=%s AND key_name=%s",
+            (key_type, key_name),
+        )
+        if not res:
+            return None
+
+        object_id = res[0][0]
+        if object_id and exists and not exists(object_id):
+            # The key outlived its object, it gets looked up or created again
+            self.release_key(key_type, key_name, object_id)
+            return None
+
+        # Claims in progress (object_id 0) are not cached
+        if object_id:
+            self.cache.set(("key", key_type, key_name), object_id)
+        return object_id
+
+    def claim_key(self, key_type: str, key_name: str, stale_after: int = 120) -> bool:
+        table = f"{self.table_prefix}crawler_keys"
+        claimed = self.execute(
+            f"INSERT IGNORE INTO {table} (key_type, key_name, object_id) "
+            "VALUES (%s, %s, 0)",
+            (key_type, key_name),
+        )
+        if claimed:
+            return True
+
+        # Take over claims left behind by a worker that died mid-insert
+        return bool(
+            self.execute(
+                f"UPDATE {table} SET updated_at=CURRENT_TIMESTAMP "
+                "WHERE key_type=%s AND key_name=%s AND object_id=0 "
+                "AND updated_at < NOW() - INTERVAL %s SECOND",
+                (key_type, key_name, stale_after),
+            )
+        )
+
+    def set_key(self, key_type: str, key_name: str, object_id: int):
+        self.execute(
+            f"INSERT INTO {self.table_prefix}crawler_keys "
+            "(key_type, key_name, object_id) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE object_id=VALUES(object_id)",
+            (key_type, key_name, object_id),
+        )
+        self.cache.set(("key", key_type, key_name), object_id)
+
+    def release_key(self, key_type: str, key_name: str, object_id: int = 0):
+        # Only drops the row while it still holds object_id, a claim by
+        # default, never an ID another worker published meanwhile
+        self.execute(
+            f"DELETE FROM {self.table_prefix}crawler_keys "
+            "WHERE key_type=%s AND key_name=%s AND object_id=%s",
+            (key_type, key_name, object_id),
+        )
+        self.cache.delete(("key", key_type, key_name))
+
+
+database = Database(pool_size=getattr(CONFIG, "DB_POOL_SIZE", 0))
+
+
+def get_target_database(target: dict, pool_size: int = 0) -> Database:
+    # A WRITER_TARGETS entry: its own connection settings and table prefix,
+    # anything left out falls back to the default site's
+    return Database(
+        pool_size=pool_size,
+        connection={**database.connection, **target.get("database", {})},
+        table_prefix=target.get("table_prefix"),
+    )
 
 
 if __name__ == "__main__":
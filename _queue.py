@@ -0,0 +1,369 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from _db import database
+from settings import CONFIG
+
+JOB_PENDING = "pending"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    # Raised by job handlers for failures retrying can't fix; the job is
+    # failed right away instead of using up its attempts
+    pass
+
+
+class Job:
+    def __init__(self, id, kind, job_key, payload, attempts, owner):
+        self.id = id
+        self.kind = kind
+        self.job_key = job_key
+        self.payload = json.loads(payload) if payload else {}
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.job_key}, attempts={self.attempts})"
+
+
+class JobQueue:
+    # Backends only differ in how they connect, their placeholder style and
+    # how a single row is claimed atomically; everything else is shared SQL.
+    placeholder = "%s"
+    table = "crawler_jobs"
+
+    def __init__(
+        self,
+        lease_seconds: int = 300,
+        max_attempts: int = 5,
+        retry_backoff: int = 60,
+    ):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    def get_conn(self):
+        raise NotImplementedError
+
+    def create_table_query(self) -> str:
+        raise NotImplementedError
+
+    def insert_ignore_query(self) -> str:
+        raise NotImplementedError
+
+    def claim_query(self) -> str:
+        raise NotImplementedError
+
+    def q(self, query: str) -> str:
+        return query.replace("%s", self.placeholder)
+
+    def execute(self, query: str, data: tuple = (), fetch: bool = False):
+        conn = self.get_conn()
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.q(query), data)
+                res = cur.fetchall() if fetch else cur.rowcount
+                conn.commit()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+
+        return res
+
+    def create_table(self):
+        conn = self.get_conn()
+        try:
+            cur = conn.cursor()
+            try:
+                for query in self.create_table_query().split(";"):
+                    if query.strip():
+                        cur.execute(query)
+                conn.commit()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+
+    def enqueue(
+        self,
+        kind: str,
+        job_key: str,
+        payload: dict = None,
+        priority: int = 0,
+        refresh: bool = False,
+    ) -> bool:
+        now = time.time()
+        inserted = self.execute(
+            self.insert_ignore_query(),
+            (
+                kind,
+                job_key,
+                json.dumps(payload or {}, ensure_ascii=False),
+                JOB_PENDING,
+                priority,
+                now,
+                now,
+            ),
+        )
+        if not inserted and refresh:
+            # Finished jobs come back for the next sweep; jobs that are
+            # pending or leased right now are left alone so nothing runs twice.
+            inserted = self.execute(
+                f"UPDATE {self.table} SET status=%s, attempts=0, priority=%s, "
+                "available_at=%s, payload=%s, updated_at=%s "
+                "WHERE job_key=%s AND status IN (%s, %s)",
+                (
+                    JOB_PENDING,
+                    priority,
+                    now,
+                    json.dumps(payload or {}, ensure_ascii=False),
+                    now,
+                    job_key,
+                    JOB_DONE,
+                    JOB_FAILED,
+                ),
+            )
+
+        return bool(inserted)
+
+    def fail_expired(self, now: float) -> int:
+        # A job whose worker died on its last attempt isn't reclaimed
+        return self.execute(
+            f"UPDATE {self.table} SET status=%s, "
+            "last_error='Lease expired on the last attempt', updated_at=%s "
+            "WHERE status=%s AND lease_until<%s AND attempts>=%s",
+            (JOB_FAILED, now, JOB_LEASED, now, self.max_attempts),
+        )
+
+    def lease(self, worker_id: str) -> Job:
+        now = time.time()
+        owner = f"{worker_id}:{uuid.uuid4().hex[:12]}"
+        self.fail_expired(now)
+        claimed = self.execute(
+            self.claim_query(),
+            (
+                JOB_LEASED,
+                owner,
+                now + self.lease_seconds,
+                now,
+                JOB_PENDING,
+                now,
+                JOB_LEASED,
+                now,
+                self.max_attempts,
+            ),
+        )
+        if not claimed:
+            return None
+
+        res = self.execute(
+            f"SELECT id, kind, job_key, payload, attempts, owner FROM {self.table} "
+            "WHERE owner=%s AND status=%s",
+            (owner, JOB_LEASED),
+            fetch=True,
+        )
+        if not res:
+            return None
+
+        return Job(*res[0])
+
+    def heartbeat(self, job: Job) -> bool:
+        now = time.time()
+        return bool(
+            self.execute(
+                f"UPDATE {self.table} SET lease_until=%s, updated_at=%s "
+                "WHERE id=%s AND owner=%s AND status=%s",
+                (now + self.lease_seconds, now, job.id, job.owner, JOB_LEASED),
+            )
+        )
+
+    def complete(self, job: Job) -> bool:
+        return bool(
+            self.execute(
+                f"UPDATE {self.table} SET status=%s, last_error='', updated_at=%s "
+                "WHERE id=%s AND owner=%s",
+                (JOB_DONE, time.time(), job.id, job.owner),
+            )
+        )
+
+    def fail(self, job: Job, error: str = "", retry: bool = True) -> bool:
+        now = time.time()
+        status = (
+            JOB_PENDING if retry and job.attempts < self.max_attempts else JOB_FAILED
+        )
+        return bool(
+            self.execute(
+                f"UPDATE {self.table} SET status=%s, available_at=%s, last_error=%s, "
+                "updated_at=%s WHERE id=%s AND owner=%s",
+                (
+                    status,
+                    now + self.retry_backoff * job.attempts,
+                    str(error)[:2000],
+                    now,
+                    job.id,
+                    job.owner,
+                ),
+            )
+        )
+
+    def stats(self) -> dict:
+        res = self.execute(
+            f"SELECT kind, status, COUNT(*) FROM {self.table} GROUP BY kind, status",
+            fetch=True,
+        )
+        return {f"{kind}.{status}": count for kind, status, count in res}
+
+
+class MariaDBQueue(JobQueue):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table = f"{CONFIG.TABLE_PREFIX}crawler_jobs"
+
+    def get_conn(self):
+        return database.get_conn()
+
+    def create_table_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                kind VARCHAR(16) NOT NULL,
+                job_key VARCHAR(191) NOT NULL,
+                payload LONGTEXT NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                priority INT NOT NULL DEFAULT 0,
+                attempts INT NOT NULL DEFAULT 0,
+                owner VARCHAR(96) NOT NULL DEFAULT '',
+                lease_until DOUBLE NOT NULL DEFAULT 0,
+                available_at DOUBLE NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at DOUBLE NOT NULL DEFAULT 0,
+                UNIQUE KEY job_key (job_key),
+                KEY status_available (status, available_at, priority)
+            ) DEFAULT CHARSET=utf8mb4
+        """
+
+    def insert_ignore_query(self) -> str:
+        return (
+            f"INSERT IGNORE INTO {self.table} "
+            "(kind, job_key, payload, status, priority, available_at, updated_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+        )
+
+    def claim_query(self) -> str:
+        # Single-statement claim: InnoDB row locks make sure only one worker
+        # flips a given row, the loser simply matches nothing.
+        return (
+            f"UPDATE {self.table} SET status=%s, owner=%s, lease_until=%s, "
+            "attempts=attempts+1, updated_at=%s "
+            "WHERE (status=%s AND available_at<=%s) "
+            "OR (status=%s AND lease_until<%s AND attempts<%s) "
+            "ORDER BY priority DESC, id LIMIT 1"
+        )
+
+
+class SQLiteQueue(JobQueue):
+    placeholder = "?"
+
+    def __init__(self, path: str = "crawler_jobs.sqlite3", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+
+    def get_conn(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level="IMMEDIATE")
+
+    def create_table_query(self) -> str:
+        return f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                job_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT NOT NULL DEFAULT '',
+                lease_until REAL NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS {self.table}_status_available
+                ON {self.table} (status, available_at, priority)
+        """
+
+    def insert_ignore_query(self) -> str:
+        return (
+            f"INSERT OR IGNORE INTO {self.table} "
+            "(kind, job_key, payload, status, priority, available_at, updated_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+        )
+
+    def claim_query(self) -> str:
+        return (
+            f"UPDATE {self.table} SET status=%s, owner=%s, lease_until=%s, "
+            "attempts=attempts+1, updated_at=%s "
+            f"WHERE id = (SELECT id FROM {self.table} "
+            "WHERE (status=%s AND available_at<=%s) "
+            "OR (status=%s AND lease_until<%s AND attempts<%s) "
+            "ORDER BY priority DESC, id LIMIT 1)"
+        )
+
+
+def get_queue() -> JobQueue:
+    backend = getattr(CONFIG, "QUEUE_BACKEND", "mariadb")
+    kwargs = {
+        "lease_seconds": getattr(CONFIG, "QUEUE_LEASE_SECONDS", 300),
+        "max_attempts": getattr(CONFIG, "QUEUE_MAX_ATTEMPTS", 5),
+        "retry_backoff": getattr(CONFIG, "QUEUE_RETRY_BACKOFF", 60),
+    }
+    if backend == "sqlite":
+        return SQLiteQueue(
+            getattr(CONFIG, "QUEUE_SQLITE_PATH", "crawler_jobs.sqlite3"), **kwargs
+        )
+    if backend == "mariadb":
+        return MariaDBQueue(**kwargs)
+
+    # Anything else is treated as a dotted path to a JobQueue subclass
+    module_name, class_name = backend.rsplit(".", 1)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)(**kwargs)
+
+
+class Heartbeat:
+    def __init__(self, queue: JobQueue, job: Job, interval: float):
+        self.queue = queue
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.job):
+                    self.lost = True
+                    return
+            except Exception:
+                pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
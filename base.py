@@ -1,8 +1,12 @@
-import json
 import logging
 
 from bs4 import BeautifulSoup
 
+from circuit_breaker import breakers
+from crawl_store import CrawlStore, get_crawl_store
+from detail_page import DetailPage
+from film_record import LazyRecord
+from fingerprints import FingerprintStore
 from helper import helper
 from settings import CONFIG
 from toronites import Toronites
@@ -11,6 +15,19 @@ logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=loggin
 
 
 class Crawler:
+    def __init__(
+        self,
+        writer=None,
+        store: CrawlStore = None,
+        fingerprints: FingerprintStore = None,
+        wait_for_writer: bool = False,
+    ):
+        self.writer = writer
+        # Callers that need the new episode count wait for the writer
+        self.wait_for_writer = wait_for_writer
+        self.store = store if store else get_crawl_store()
+        self.fingerprints = fingerprints
+
     def crawl_soup(self, url):
         logging.info(f"Crawling {url}")
 
@@ -19,31 +36,37 @@ class Crawler:
 
         return soup
 
-    def get_episodes_data(
-        self, href: str, soup: BeautifulSoup, post_type: str = CONFIG.TYPE_TV_SHOWS
-    ) -> dict:
+    @breakers.extractor("get_tmdb_id", is_failure=lambda res: res in ("0", None))
+    def get_tmdb_id(self, href: str, page: DetailPage) -> str:
+        try:
+            return page.player_area.get("data-tmdb-id")
+        except Exception as e:
+            helper.error_log(
+                f"Failed to get_tmdb_id. Href: {href}",
+                log_file="base.episodes.log",
+            )
+            return "0"
+
+    @breakers.extractor("get_seasons_data")
+    def get_seasons_data(self, href: str, page: DetailPage) -> dict:
         res = {}
 
         try:
-            watching_player_area = soup.find("div", class_="watching_player-area")
-            res["tmdb_id"] = watching_player_area.get("data-tmdb-id")
-            if post_type == CONFIG.TYPE_TV_SHOWS:
-                seasons_list = soup.find("div", class_="seasons-list")
-                slc_seasons = seasons_list.find("div", class_="slc-seasons")
-                lis = slc_seasons.find_all("li")
-                for li in lis:
-                    a_element = li.find("a")
-
-                    season_title = a_element.get("title")
-                    res.setdefault(season_title, {})
-
-                    season_href = a_element.get("href")
-                    season_id = season_href.replace("#", "")
-                    season_episodes = soup.find("div", {"id": season_id})
-                    for episode in season_episodes.find_all("a", class_="episode-item"):
-                        episode_number = episode.get("data-number")
-                        episode_title = episode.get("title")
-                        res[season_title][episode_number] = episode_title
+            if page.slc_seasons is None:
+                raise ValueError("No slc-seasons")
+
+            for li in page.season_items:
+                a_element = li.find("a")
+
+                season_title = a_element.get("title")
+                res.setdefault(season_title, {})
+
+                season_href = a_element.get("href")
+                season_id = season_href.replace("#", "")
+                for episode in page.episode_items[season_id]:
+                    episode_number = episode.get("data-number")
+                    episode_title = episode.get("title")
+                    res[season_title][episode_number] = episode_title
 
         except Exception as e:
             helper.error_log(
@@ -53,6 +76,21 @@ class Crawler:
 
         return res
 
+    def get_episodes_data(
+        self, href: str, page: DetailPage, post_type: str = CONFIG.TYPE_TV_SHOWS
+    ) -> dict:
+        res = {"tmdb_id": self.get_tmdb_id(href=href, page=page)}
+        if post_type == CONFIG.TYPE_TV_SHOWS:
+            res.update(self.get_seasons_data(href=href, page=page))
+
+        return res
+
+    def get_extra_info(self, page: DetailPage, quality: str = "HD") -> dict:
+        extra_info = helper.get_extra_info(page=page)
+        extra_info["quality"] = quality
+
+        return extra_info
+
     def crawl_film(
         self,
         title: str,
@@ -63,27 +101,20 @@ class Crawler:
         href: str,
         post_type: str = CONFIG.TYPE_TV_SHOWS,
     ):
-        soup = self.crawl_soup(href)
-        detail_page_infor = soup.find("div", class_="detail_page-infor")
-
-        title = (
-            title
-            if title
-            else helper.get_title(href=href, detail_page_infor=detail_page_infor)
-        )
-        description = helper.get_description(
-            href=href, detail_page_infor=detail_page_infor
-        )
+        # Detail pages are not fetched while an extractor this fetch is sure
+        # to call can't parse the markup, its breaker lets a probe through
+        # every now and then. get_cover_url only runs for new posts without
+        # a listing cover, so it's not waited for.
+        extractors = ["get_tmdb_id"]
+        if not title:
+            extractors.append("get_title")
+        if post_type == CONFIG.TYPE_TV_SHOWS:
+            extractors.append("get_seasons_data")
+        breakers.wait_for([f"extractor:{name}" for name in extractors])
 
-        cover_src = (
-            cover_src
-            if cover_src
-            else helper.get_cover_url(href=href, detail_page_infor=detail_page_infor)
-        )
+        page = DetailPage(self.crawl_soup(href))
 
-        trailer_id = helper.get_trailer_id(soup)
-        extra_info = helper.get_extra_info(detail_page_infor=detail_page_infor)
-        extra_info["quality"] = quality
+        title = title if title else helper.get_title(href=href, page=page)
 
         if not title:
             helper.error_log(
@@ -91,85 +122,136 @@ class Crawler:
             )
             return
 
-        film_data = {
+        # Everything else is only extracted if the writer ends up needing it,
+        # e.g. revisits of known shows only read the seasons/episodes.
+        film_data = LazyRecord(
+            {
+                "title": title,
+                "slug": slug,
+                "post_type": post_type,
+                "quality": quality,
+            },
+            extractors={
+                "description": lambda: helper.get_description(href=href, page=page),
+                "trailer_id": lambda: helper.get_trailer_id(page),
+                "cover_src": lambda: cover_src
+                or helper.get_cover_url(href=href, page=page),
+                "extra_info": lambda: self.get_extra_info(page=page, quality=quality),
+            },
+        )
+
+        episodes_data = LazyRecord(
+            extractors={"tmdb_id": lambda: self.get_tmdb_id(href=href, page=page)},
+            loader=(
+                (lambda: self.get_seasons_data(href=href, page=page))
+                if post_type == CONFIG.TYPE_TV_SHOWS
+                else None
+            ),
+        )
+
+        return film_data, episodes_data
+
+    def parse_flw_item(
+        self, flw_item: BeautifulSoup, post_type: str = CONFIG.TYPE_TV_SHOWS
+    ) -> dict:
+        title, quality, cover_src, href, fd_infor = "", "HD", "", "", []
+
+        film_poster = flw_item.find("div", class_="film-poster")
+        if film_poster:
+            film_poster_quality = film_poster.find("div", class_="film-poster-quality")
+            quality = film_poster_quality.text if film_poster_quality else "HD"
+
+            img = film_poster.find("img")
+            cover_src = img.get("data-src") if img else ""
+
+            a_element = film_poster.find("a")
+            href = a_element.get("href") if a_element else ""
+
+        film_detail = flw_item.find("div", class_="film-detail")
+        if film_detail:
+            film_name = film_detail.find("h3", class_="film-name")
+            if film_name:
+                if film_name.find("a") and not href:
+                    href = film_name.find("a").get("href")
+                title = film_name.text.strip("\n")
+
+            fd_infor = film_detail.find("div", class_="fd-infor")
+            fd_infor = fd_infor.text if fd_infor else ""
+            fd_infor = [x for x in fd_infor.split("\n") if x]
+
+        if "http" not in href:
+            href = CONFIG.TINYZONETV_HOMEPAGE + href
+
+        slug = href.split("/")[-1]
+
+        return {
             "title": title,
             "slug": slug,
-            "description": description,
-            "post_type": post_type,
-            "trailer_id": trailer_id,
+            "fd_infor": fd_infor,
+            "quality": quality,
             "cover_src": cover_src,
-            "extra_info": extra_info,
+            "href": href,
+            "post_type": post_type,
         }
 
-        episodes_data = self.get_episodes_data(
-            href=href, soup=soup, post_type=post_type
-        )
+    def get_post_type(self, href: str) -> str:
+        return CONFIG.TYPE_MOVIE if "/movie/" in href else CONFIG.TYPE_TV_SHOWS
+
+    def get_href_item(self, href: str, quality: str = "HD") -> dict:
+        return {
+            "title": "",
+            "slug": href.split("/")[-1],
+            "fd_infor": [],
+            "quality": quality,
+            "cover_src": "",
+            "href": href,
+            "post_type": self.get_post_type(href),
+        }
 
-        return film_data, episodes_data
+    def crawl_href(self, href: str, quality: str = "HD"):
+        return self.crawl_film(**self.get_href_item(href, quality))
 
     def crawl_flw_item(
         self, flw_item: BeautifulSoup, post_type: str = CONFIG.TYPE_TV_SHOWS
     ):
         try:
-            film_poster = flw_item.find("div", class_="film-poster")
-            if film_poster:
-                film_poster_quality = film_poster.find(
-                    "div", class_="film-poster-quality"
-                )
-                quality = film_poster_quality.text if film_poster_quality else "HD"
-
-                img = film_poster.find("img")
-                cover_src = img.get("data-src") if img else ""
-
-                a_element = film_poster.find("a")
-                href = a_element.get("href") if a_element else ""
-
-            film_detail = flw_item.find("div", class_="film-detail")
-            if film_detail:
-                film_name = film_detail.find("h3", class_="film-name")
-                if film_name:
-                    if film_name.find("a") and not href:
-                        href = film_name.find("a").get("href")
-                    title = film_name.text.strip("\n")
-
-                fd_infor = film_detail.find("div", class_="fd-infor")
-                fd_infor = fd_infor.text if fd_infor else ""
-                fd_infor = [x for x in fd_infor.split("\n") if x]
-
-            if "http" not in href:
-                href = CONFIG.TINYZONETV_HOMEPAGE + href
-
-            slug = href.split("/")[-1]
-
-            film_data, episodes_data = self.crawl_film(
-                title=title,
-                slug=slug,
-                fd_infor=fd_infor,
-                quality=quality,
-                cover_src=cover_src,
-                href=href,
-                post_type=post_type,
-            )
-
-            # film_data["episodes_data"] = episodes_data
-
-            # with open("json/crawled.json", "w") as f:
-            #     f.write(json.dumps(film_data, indent=4, ensure_ascii=False))
-
-            Toronites(film=film_data, episodes=episodes_data).insert_film()
+            self.crawl_item(self.parse_flw_item(flw_item=flw_item, post_type=post_type))
         except Exception as e:
             helper.error_log(
                 msg=f"Error crawl_flw_item\n{e}", log_file="base.crawl_flw_item.log"
             )
 
-    def crawl_page(self, url, post_type: str = CONFIG.TYPE_TV_SHOWS):
+    def crawl_item(self, item: dict):
+        film_data, episodes_data = self.crawl_film(**item)
+        return self.save_film(film_data, episodes_data)
+
+    def save_film(self, film_data: dict, episodes_data: dict):
+        if self.store:
+            self.store.append(film_data, episodes_data)
+
+        return self.write_film(film_data, episodes_data)
+
+    def write_film(self, film_data: dict, episodes_data: dict):
+        if self.writer:
+            if self.wait_for_writer:
+                return self.writer.write_and_wait(film_data, episodes_data)
+
+            self.writer.submit(film_data, episodes_data)
+            return
+
+        return Toronites(film=film_data, episodes=episodes_data).insert_film()
+
+    def get_flw_items(self, url) -> list:
         soup = self.crawl_soup(url)
 
         film_list_wrap = soup.find("div", class_="film_list-wrap")
         if not film_list_wrap:
-            return 0
+            return []
+
+        return film_list_wrap.find_all("div", class_="flw-item")
 
-        flw_items = film_list_wrap.find_all("div", class_="flw-item")
+    def crawl_page(self, url, post_type: str = CONFIG.TYPE_TV_SHOWS):
+        flw_items = self.get_flw_items(url)
         if not flw_items:
             return 0
 
@@ -178,25 +260,83 @@ class Crawler:
 
         return 1
 
+    def get_homepage_blocks(self, url: str = CONFIG.TINYZONETV_HOMEPAGE) -> list:
+        soup = self.crawl_soup(url)
+
+        block_area_homes = soup.find_all("section", class_="block_area_home")
+        if len(block_area_homes) != 4:
+            helper.error_log(
+                msg=f"Expected 4 block_area_home, found {len(block_area_homes)}",
+                log_file="base.update.log",
+            )
+        if len(block_area_homes) < 2:
+            return []
+
+        return [
+            (CONFIG.TYPE_TV_SHOWS, block_area_homes[-1]),
+            (CONFIG.TYPE_MOVIE, block_area_homes[-2]),
+        ]
+
+    def get_homepage_items(self, url: str = CONFIG.TINYZONETV_HOMEPAGE) -> list:
+        res = []
+        for post_type, block_area_home in self.get_homepage_blocks(url):
+            items = []
+            for flw_item in block_area_home.find_all("div", class_="flw-item"):
+                try:
+                    items.append(
+                        self.parse_flw_item(flw_item=flw_item, post_type=post_type)
+                    )
+                except Exception as e:
+                    helper.error_log(
+                        msg=f"Error parse_flw_item\n{e}",
+                        log_file="base.crawl_flw_item.log",
+                    )
+            res.append((post_type, items))
+
+        return res
+
     def update(
         self,
         url: str = CONFIG.TINYZONETV_HOMEPAGE,
+        scheduler=None,
     ):
         try:
-            soup = self.crawl_soup(url)
-
-            block_area_homes = soup.find_all("section", class_="block_area_home")
-            if len(block_area_homes) != 4:
-                print("len(block_area_homes) != 4", len(block_area_homes))
-                return
-
-            tv_show_flw_items = block_area_homes[-1].find_all("div", class_="flw-item")
-            for flw_item in tv_show_flw_items:
-                self.crawl_flw_item(flw_item=flw_item, post_type=CONFIG.TYPE_TV_SHOWS)
-
-            tv_show_flw_items = block_area_homes[-2].find_all("div", class_="flw-item")
-            for flw_item in tv_show_flw_items:
-                self.crawl_flw_item(flw_item=flw_item, post_type=CONFIG.TYPE_MOVIE)
+            homepage_items = self.get_homepage_items(url)
+            for post_type, items in homepage_items:
+                changed_items = items
+                if self.fingerprints:
+                    changed_items = self.fingerprints.get_changed_items(
+                        post_type, items
+                    )
+
+                if scheduler:
+                    # Only refresh the scheduler's view, it decides what to crawl
+                    # and retries on its own.
+                    scheduler.observe(
+                        post_type,
+                        items,
+                        changed_slugs=[item["slug"] for item in changed_items],
+                    )
+                    if self.fingerprints:
+                        for item in changed_items:
+                            self.fingerprints.commit_item(post_type, item)
+                else:
+                    for item in changed_items:
+                        try:
+                            self.crawl_item(item)
+                            if self.fingerprints:
+                                self.fingerprints.commit_item(post_type, item)
+                        except Exception as e:
+                            helper.error_log(
+                                msg=f"Error crawl_flw_item\n{e}",
+                                log_file="base.crawl_flw_item.log",
+                            )
+
+                if self.fingerprints:
+                    self.fingerprints.commit_block(post_type, items)
+
+            if self.fingerprints:
+                self.fingerprints.save()
 
             return
         except Exception as e:
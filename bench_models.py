@@ -0,0 +1,139 @@
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from base import Crawler
+from models import Film
+
+
+def generate_detail_page(seasons: int, episodes: int) -> str:
+    season_links = "".join(
+        f'<li><a href="#ss-{s}" title="Season {s}">Season {s}</a></li>'
+        for s in range(1, seasons + 1)
+    )
+    season_blocks = "".join(
+        f'<div id="ss-{s}" class="ss-list">'
+        + "".join(
+            f'<a class="episode-item" data-number="{e}" '
+            f'title="Eps {e}: Episode title number {e} of season {s}"></a>'
+            for e in range(1, episodes + 1)
+        )
+        + "</div>"
+        for s in range(1, seasons + 1)
+    )
+    return f"""
+    <html><body>
+    <div class="watching_player-area" data-tmdb-id="12345"></div>
+    <div class="detail_page-infor">
+        <img class="film-poster-img" src="https://img.example/poster.jpg">
+        <h2 class="heading-name"><a href="/tv/show">Benchmark Show</a></h2>
+        <div class="dp-i-stats"><button class="btn-imdb">IMDB: 7.9</button></div>
+        <div class="description">{"A long description. " * 30}</div>
+        <div class="elements">
+            <div class="row-line"><strong>Released: </strong> 2019-05-01</div>
+            <div class="row-line"><strong>Genre: </strong>
+                <a>Action</a>, <a>Adventure</a>, <a>Animation</a></div>
+            <div class="row-line"><strong>Casts: </strong>
+                <a>Actor One</a>, <a>Actor Two</a>, <a>Actor Three</a></div>
+            <div class="row-line"><strong>Country: </strong> <a>Japan</a></div>
+            <div class="row-line"><strong>Production: </strong> <a>Studio</a></div>
+        </div>
+    </div>
+    <div id="modaltrailer"><iframe data-src="https://www.youtube.com/embed/xyz"></iframe></div>
+    <div class="seasons-list"><div class="slc-seasons"><ul>{season_links}</ul></div></div>
+    {season_blocks}
+    </body></html>
+    """
+
+
+class PageCrawler(Crawler):
+    def __init__(self, html: str):
+        super().__init__()
+        self.html = html
+
+    def crawl_soup(self, url):
+        return BeautifulSoup(self.html, "html.parser")
+
+
+def crawl(crawler: PageCrawler, i: int) -> tuple:
+    return crawler.crawl_film(
+        title=f"Benchmark Show {i}",
+        slug=f"benchmark-show-{i}",
+        fd_infor=[],
+        quality="HD",
+        cover_src="",
+        href=f"https://example.com/tv/benchmark-show-{i}",
+    )
+
+
+def measure(build, films: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(films)]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / films
+
+
+def measure_extraction(crawler: PageCrawler, films: int) -> tuple:
+    # Median ms per film to parse the page, and to extract what a known show
+    # needs (TMDB ID, seasons) and what Film.from_data() extracts
+    parse, known, full = [], [], []
+    for i in range(films):
+        start = time.perf_counter()
+        film_data, episodes_data = crawl(crawler, i)
+        parsed = time.perf_counter()
+        episodes_data["tmdb_id"]
+        dict(episodes_data.items())
+        extracted = time.perf_counter()
+        Film.from_data(film_data, episodes_data)
+        converted = time.perf_counter()
+        parse.append(parsed - start)
+        known.append(extracted - parsed)
+        full.append(converted - parsed)
+    return tuple(statistics.median(times) * 1000 for times in (parse, known, full))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--films", type=int, default=50)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=20)
+    args = parser.parse_args()
+
+    crawler = PageCrawler(generate_detail_page(args.seasons, args.episodes))
+
+    def lazy_record(i):
+        return crawl(crawler, i)
+
+    def plain_dicts(i):
+        film_data, episodes_data = crawl(crawler, i)
+        return dict(film_data.items()), dict(episodes_data.items())
+
+    def compact_film(i):
+        return Film.from_data(*crawl(crawler, i))
+
+    print(f"Memory per queued film ({args.seasons} seasons x {args.episodes} episodes)")
+    for name, build in [
+        ("lazy record + parsed page", lazy_record),
+        ("plain dicts", plain_dicts),
+        ("slot records", compact_film),
+    ]:
+        print(f"  {name:28} {measure(build, args.films) / 1024:10.1f} KiB")
+
+    parse, known, full = measure_extraction(crawler, args.films)
+    print("Time per film")
+    print(f"  {'parse':28} {parse:10.3f} ms")
+    print(f"  {'extract for a known show':28} {known:10.3f} ms")
+    print(f"  {'extract for slot record':28} {full:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
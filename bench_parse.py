@@ -0,0 +1,95 @@
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+from base import Crawler
+from bench_models import generate_detail_page
+from detail_page import DetailPage
+
+
+def extract_with_finds(soup: BeautifulSoup) -> dict:
+    # What the extractors did before DetailPage: one find() from the root or
+    # from detail_page-infor per field, plus one root find() per season
+    detail_page_infor = soup.find("div", class_="detail_page-infor")
+    res = {
+        "title": detail_page_infor.find("h2", class_="heading-name").text,
+        "description": detail_page_infor.find("div", class_="description").text,
+        "cover_src": detail_page_infor.find("img", class_="film-poster-img").get("src"),
+        "imdb": detail_page_infor.find("div", class_="dp-i-stats")
+        .find("button", class_="btn-imdb")
+        .text,
+        "row_lines": len(
+            detail_page_infor.find("div", class_="elements").find_all(
+                "div", class_="row-line"
+            )
+        ),
+        "trailer": soup.find("div", {"id": "modaltrailer"}).find("iframe"),
+        "tmdb_id": soup.find("div", class_="watching_player-area").get("data-tmdb-id"),
+    }
+    seasons = {}
+    seasons_list = soup.find("div", class_="seasons-list")
+    for li in seasons_list.find("div", class_="slc-seasons").find_all("li"):
+        a_element = li.find("a")
+        season_episodes = soup.find("div", {"id": a_element.get("href")[1:]})
+        seasons[a_element.get("title")] = len(
+            season_episodes.find_all("a", class_="episode-item")
+        )
+    res["seasons"] = seasons
+    return res
+
+
+def extract_with_detail_page(soup: BeautifulSoup) -> dict:
+    crawler = Crawler()
+    page = DetailPage(soup)
+    return {
+        "title": page.heading.text,
+        "description": page.description.text,
+        "cover_src": page.poster.get("src"),
+        "imdb": page.imdb_button.text,
+        "row_lines": len(page.row_lines),
+        "trailer": page.trailer_iframe,
+        "tmdb_id": crawler.get_tmdb_id(href="", page=page),
+        "seasons": {
+            title: len(episodes)
+            for title, episodes in crawler.get_seasons_data(href="", page=page).items()
+        },
+    }
+
+
+def timed(func, soup: BeautifulSoup, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(soup)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seasons", type=int, nargs="+", default=[1, 5, 20, 50])
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Detail extraction per page ({args.episodes} episodes per season)")
+    print(f"  {'seasons':>8} {'parse':>10} {'find()':>10} {'one walk':>10}")
+    for seasons in args.seasons:
+        html = generate_detail_page(seasons, args.episodes)
+
+        start = time.perf_counter()
+        soup = BeautifulSoup(html, "html.parser")
+        parse_time = time.perf_counter() - start
+
+        assert extract_with_finds(soup)["seasons"] == (
+            extract_with_detail_page(soup)["seasons"]
+        )
+        finds_time = timed(extract_with_finds, soup, args.runs)
+        walk_time = timed(extract_with_detail_page, soup, args.runs)
+        print(
+            f"  {seasons:>8} {parse_time * 1000:8.1f}ms {finds_time * 1000:8.1f}ms "
+            f"{walk_time * 1000:8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
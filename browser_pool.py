@@ -0,0 +1,152 @@
+import logging
+import queue
+import threading
+import time
+
+from settings import CONFIG
+
+CHALLENGE_MARKERS = (
+    "cf-browser-verification",
+    "challenge-platform",
+    "cf_chl_opt",
+    "<title>Just a moment...</title>",
+    "Checking your browser before accessing",
+)
+
+
+def is_challenge_page(status_code: int, html: str) -> bool:
+    if status_code not in (200, 403, 429, 503):
+        return False
+
+    head = html[:20000]
+    return any(marker in head for marker in CHALLENGE_MARKERS)
+
+
+class BrowserPool:
+    # Headless Chrome instances kept open between fetches. Starting Chrome
+    # and solving the first challenge is the slow part, so instances are
+    # warmed on the homepage up front and handed out one fetch at a time.
+    def __init__(
+        self,
+        size: int = 1,
+        warm_url: str = "",
+        challenge_timeout: int = 30,
+        driver_factory=None,
+    ):
+        self.size = size
+        self.warm_url = warm_url
+        self.challenge_timeout = challenge_timeout
+        self.driver_factory = driver_factory or self.create_driver
+        self.drivers = queue.Queue()
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def create_driver(self):
+        import undetected_chromedriver as uc
+
+        options = uc.ChromeOptions()
+        options.add_argument("--headless=new")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        return uc.Chrome(options=options)
+
+    def start_driver(self):
+        driver = self.driver_factory()
+        if self.warm_url:
+            try:
+                self.load(driver, self.warm_url)
+            except Exception as e:
+                logging.info(f"Failed to warm browser on {self.warm_url}: {e}")
+        return driver
+
+    def warm_up(self):
+        while self.started < self.size:
+            with self.lock:
+                if self.started >= self.size:
+                    break
+                self.started += 1
+            try:
+                self.drivers.put(self.start_driver())
+            except Exception:
+                with self.lock:
+                    self.started -= 1
+                raise
+
+    def acquire(self):
+        try:
+            return self.drivers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            can_start = self.started < self.size
+            if can_start:
+                self.started += 1
+
+        if can_start:
+            try:
+                return self.start_driver()
+            except Exception:
+                with self.lock:
+                    self.started -= 1
+                raise
+
+        return self.drivers.get()
+
+    def release(self, driver):
+        self.drivers.put(driver)
+
+    def discard(self, driver):
+        with self.lock:
+            self.started -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def load(self, driver, url: str) -> str:
+        driver.get(url)
+
+        deadline = time.time() + self.challenge_timeout
+        html = driver.page_source
+        while is_challenge_page(200, html):
+            if time.time() > deadline:
+                raise TimeoutError(f"Challenge not solved in time: {url}")
+            time.sleep(0.5)
+            html = driver.page_source
+
+        return html
+
+    def fetch(self, url: str) -> list:
+        driver = self.acquire()
+        try:
+            html = self.load(driver, url)
+            cookies = driver.get_cookies()
+            user_agent = driver.execute_script("return navigator.userAgent")
+        except Exception:
+            # A wedged browser is replaced instead of going back to the pool
+            self.discard(driver)
+            raise
+
+        self.release(driver)
+        return [html, cookies, user_agent]
+
+    def close(self):
+        while True:
+            try:
+                driver = self.drivers.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+
+def get_browser_pool() -> BrowserPool:
+    size = getattr(CONFIG, "BROWSER_POOL_SIZE", 1)
+    if not size:
+        return None
+
+    return BrowserPool(
+        size=size,
+        warm_url=getattr(CONFIG, "TINYZONETV_HOMEPAGE", ""),
+        challenge_timeout=getattr(CONFIG, "BROWSER_CHALLENGE_TIMEOUT", 30),
+    )
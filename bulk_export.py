@@ -0,0 +1,606 @@
+import argparse
+import copy
+import logging
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+
+from _db import Database, database
+from base import Crawler
+from helper import helper
+from settings import CONFIG
+from toronites import EPISODES_CHECKPOINT_KEY, Toronites, ToronitesHelper
+
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+
+PREFIX = CONFIG.TABLE_PREFIX
+
+# Tables whose primary key is handed out by us instead of AUTO_INCREMENT,
+# because other exported rows need to reference the new IDs.
+ID_TABLES = {
+    "posts": "ID",
+    "terms": "term_id",
+    "term_taxonomy": "term_taxonomy_id",
+}
+
+EXPORT_TABLES = [
+    "posts",
+    "postmeta",
+    "terms",
+    "term_taxonomy",
+    "term_relationships",
+    "termmeta",
+]
+
+# Meta rows that Toronites reads back or updates in place; they are kept in
+# memory and written out on close with their final values.
+TRACKED_META_KEYS = [
+    "_thumbnail_id",
+    "number_of_seasons",
+    "number_of_episodes",
+    EPISODES_CHECKPOINT_KEY,
+]
+
+# Meta values holding a post ID, normalised when comparing runs
+ID_META_KEYS = ["_thumbnail_id", "tr_id_post", "still_path"]
+
+
+def tsv_escape(value) -> str:
+    if value is None:
+        return "\\N"
+
+    if isinstance(value, datetime):
+        value = value.strftime("%Y-%m-%d %H:%M:%S")
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\0", "\\0")
+    )
+
+
+def get_short_table(table: str) -> str:
+    return table[len(PREFIX) :] if table.startswith(PREFIX) else table
+
+
+class ExportDatabase:
+    def __init__(
+        self,
+        out_dir: str,
+        start_ids: dict = None,
+        reserve: int = 0,
+        live: Database = None,
+    ):
+        self.out_dir = out_dir
+        self.table_prefix = PREFIX
+        os.makedirs(out_dir, exist_ok=True)
+        # The site load.sql goes into. Objects this run didn't create are
+        # looked up there, so its servers, languages, qualities, genres...
+        # are referenced instead of exported again. Without it the export
+        # is for an empty site.
+        self.live = live
+
+        start_ids = start_ids or {}
+        self.next_ids = {table: start_ids.get(table, 1) for table in ID_TABLES}
+        self.start_ids = dict(self.next_ids)
+        # IDs per table reserved on the live database, 0 when not reserved
+        self.reserve = reserve
+        self.files = {}
+        self.keys = {}
+        self.posts_by_meta = {}
+        self.meta = {}
+        self.relationships = set()
+
+    def get_file(self, table: str):
+        if table not in self.files:
+            self.files[table] = open(
+                os.path.join(self.out_dir, f"{table}.tsv"), "w", encoding="utf-8"
+            )
+        return self.files[table]
+
+    def write_row(self, table: str, row: tuple):
+        self.get_file(table).write("\t".join(tsv_escape(x) for x in row) + "\n")
+
+    def insert_into(self, table: str, data: tuple = None, is_bulk: bool = False):
+        table = get_short_table(table)
+        rows = data if is_bulk else [data]
+        id = 0
+
+        for row in rows:
+            if table in ID_TABLES:
+                id = self.next_ids[table]
+                self.next_ids[table] += 1
+                row = (id, *row)
+            elif table in ("postmeta", "termmeta") and row[1] in TRACKED_META_KEYS:
+                self.meta[(table, row[0], row[1])] = row[2]
+                continue
+            elif table == "term_relationships":
+                if (row[0], row[1]) in self.relationships:
+                    continue
+                self.relationships.add((row[0], row[1]))
+
+            self.write_row(table, row)
+
+        return id if not is_bulk else 0
+
+    def select_with(self, query: str) -> list:
+        # Everything written by this run is found through keys/meta instead
+        return self.live.select_with(query) if self.live else []
+
+    def select_with_data(self, query: str, data: tuple = ()) -> list:
+        return self.live.select_with_data(query, data) if self.live else []
+
+    def select_all_from(self, table: str, condition: str = "1=1", cols: str = "*"):
+        if not self.live:
+            return []
+        return self.live.select_all_from(table, condition, cols)
+
+    def get_meta_value(self, table: str, id_col: str, object_id: int, meta_key: str):
+        return self.meta.get((get_short_table(table), object_id, meta_key))
+
+    def get_meta_values(
+        self, table: str, id_col: str, object_ids: list, meta_key: str
+    ) -> dict:
+        res = {}
+        for object_id in object_ids:
+            meta_value = self.get_meta_value(table, id_col, object_id, meta_key)
+            if meta_value is not None:
+                res[int(object_id)] = meta_value
+        return res
+
+    def update_meta_value(
+        self,
+        table: str,
+        id_col: str,
+        object_id: int,
+        meta_key: str,
+        meta_value,
+        adding: bool = False,
+    ):
+        key = (get_short_table(table), object_id, meta_key)
+        if key not in self.meta:
+            return
+
+        be_meta_value = int(self.meta[key] or 0)
+        if adding:
+            self.meta[key] = str(be_meta_value + int(meta_value))
+        else:
+            self.meta[key] = str(max(be_meta_value, int(meta_value)))
+
+    def update_meta_values(self, table: str, id_col: str, updates: list):
+        for object_id, meta_key, meta_value, adding in updates:
+            self.update_meta_value(
+                table, id_col, object_id, meta_key, meta_value, adding
+            )
+
+    def get_post_by_meta(self, meta_key: str, meta_value, post_type: str):
+        return self.posts_by_meta.get((meta_key, str(meta_value), post_type))
+
+    def set_post_by_meta(
+        self, post_id: int, post_name: str, meta_key: str, meta_value, post_type: str
+    ):
+        self.insert_into(f"{PREFIX}postmeta", (post_id, meta_key, str(meta_value)))
+        self.posts_by_meta[(meta_key, str(meta_value), post_type)] = (
+            post_id,
+            post_name,
+        )
+
+    def get_key(self, key_type: str, key_name: str, exists=None):
+        object_id = self.keys.get((key_type, key_name))
+        if object_id is None and self.live:
+            # `exists` reads through select_* above, i.e. from the live site
+            object_id = self.live.get_key(key_type, key_name, exists)
+        return object_id
+
+    def claim_key(self, key_type: str, key_name: str, stale_after: int = 120) -> bool:
+        if self.keys.get((key_type, key_name)):
+            return False
+        self.keys[(key_type, key_name)] = 0
+        return True
+
+    def set_key(self, key_type: str, key_name: str, object_id: int):
+        self.keys[(key_type, key_name)] = object_id
+
+    def release_key(self, key_type: str, key_name: str, object_id: int = 0):
+        if self.keys.get((key_type, key_name), 0) == object_id:
+            self.keys.pop((key_type, key_name), None)
+
+    def get_columns(self, table: str) -> list:
+        if table == "crawler_keys":
+            return ["key_type", "key_name", "object_id"]
+
+        columns = list(CONFIG.INSERT[f"{PREFIX}{table}"])
+        if table in ID_TABLES:
+            columns.insert(0, ID_TABLES[table])
+        return columns
+
+    def write_load_sql(self):
+        queries = []
+        for table in EXPORT_TABLES + ["crawler_keys"]:
+            if table not in self.files:
+                continue
+
+            ignore = (
+                "IGNORE " if table in ("term_relationships", "crawler_keys") else ""
+            )
+            queries.append(
+                f"LOAD DATA LOCAL INFILE '{table}.tsv' {ignore}"
+                f"INTO TABLE {PREFIX}{table} CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+                "LINES TERMINATED BY '\\n' "
+                f"({', '.join(self.get_columns(table))});"
+            )
+
+        for table, id_col in ID_TABLES.items():
+            queries.append(
+                f"ALTER TABLE {PREFIX}{table} AUTO_INCREMENT = {self.next_ids[table]};"
+            )
+
+        with open(os.path.join(self.out_dir, "load.sql"), "w") as f:
+            f.write("\n".join(queries) + "\n")
+
+    def close(self):
+        for (table, object_id, meta_key), meta_value in self.meta.items():
+            self.write_row(table, (object_id, meta_key, meta_value))
+
+        for (key_type, key_name), object_id in self.keys.items():
+            if object_id:
+                self.write_row("crawler_keys", (key_type, key_name, object_id))
+
+        for f in self.files.values():
+            f.close()
+
+        if self.reserve:
+            overflows = [
+                f"{table} used {self.next_ids[table] - self.start_ids[table]}"
+                for table in ID_TABLES
+                if self.next_ids[table] > self.start_ids[table] + self.reserve
+            ]
+            if overflows:
+                # Live crawlers may already have taken the IDs past the range
+                raise ValueError(
+                    f"Export ran past the {self.reserve} reserved IDs "
+                    f"({', '.join(overflows)}), no load.sql written to {self.out_dir}"
+                )
+
+        self.write_load_sql()
+        logging.info(
+            f"Exported to {self.out_dir}. ID ranges: "
+            + ", ".join(
+                f"{table} {self.start_ids[table]}..{self.next_ids[table] - 1}"
+                for table in ID_TABLES
+            )
+        )
+
+
+class ExportWriter:
+    # Films the live site already has are left to the live crawlers: their
+    # revisits update rows in place, which load.sql can't, so only new
+    # posts are exported
+    def __init__(self, export_database: ExportDatabase, live: Database = None):
+        self.toronites_helper = ToronitesHelper(db=export_database)
+        self.live_helper = ToronitesHelper(db=live) if live else None
+        self.skipped = 0
+
+    def is_on_live_site(self, film: dict, episodes: dict) -> bool:
+        if not self.live_helper:
+            return False
+
+        toronites = Toronites(
+            film=dict(film), episodes=episodes, toronites_helper=self.live_helper
+        )
+        tmdb_id = toronites.get_tmdb_id()
+        return bool(
+            (tmdb_id and toronites.find_root_film_by_tmdb_id(tmdb_id))
+            or self.live_helper.db.get_key(
+                f'post:{film["post_type"]}', film["slug"], self.live_helper.post_exists
+            )
+            or toronites.find_root_film()
+        )
+
+    def submit(self, film: dict, episodes: dict):
+        if self.is_on_live_site(film, episodes):
+            logging.info(f'Already on the live site: {film["slug"]}')
+            self.skipped += 1
+            return
+
+        Toronites(
+            film=film, episodes=episodes, toronites_helper=self.toronites_helper
+        ).insert_film(throttle=False)
+
+
+def get_next_id(cur, table: str, id_col: str) -> int:
+    # information_schema may lag behind on MySQL 8, MAX() + 1 can't
+    cur.execute(
+        f"SELECT GREATEST(COALESCE(MAX({id_col}), 0) + 1, "
+        "COALESCE((SELECT AUTO_INCREMENT FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s), 1)) "
+        f"FROM {PREFIX}{table}",
+        (f"{PREFIX}{table}",),
+    )
+    return int(cur.fetchall()[0][0])
+
+
+def get_id_ranges(size: int = 0) -> dict:
+    # Exported IDs start at the live AUTO_INCREMENT. With a size, it's moved
+    # past the exported range so live crawlers can keep inserting while the
+    # export is being produced and loaded; the table is locked in between.
+    start_ids = {}
+    with database.cursor(commit=True) as cur:
+        for table, id_col in ID_TABLES.items():
+            if not size:
+                start_ids[table] = get_next_id(cur, table, id_col)
+                continue
+
+            cur.execute(f"LOCK TABLES {PREFIX}{table} WRITE")
+            try:
+                start_ids[table] = get_next_id(cur, table, id_col)
+                cur.execute(
+                    f"ALTER TABLE {PREFIX}{table} "
+                    f"AUTO_INCREMENT = {start_ids[table] + size}"
+                )
+            finally:
+                cur.execute("UNLOCK TABLES")
+
+    return start_ids
+
+
+class CaptureDatabase:
+    def __init__(self, db):
+        self.db = db
+        self.inserts = []
+        self.meta_updates = []
+        self.keys = {}
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def insert_into(self, table: str, data: tuple = None, is_bulk: bool = False):
+        id = self.db.insert_into(table, data, is_bulk)
+        rows = data if is_bulk else [data]
+        for row in rows:
+            self.inserts.append((get_short_table(table), tuple(row), id))
+        return id
+
+    def update_meta_value(
+        self, table, id_col, object_id, meta_key, meta_value, adding=False
+    ):
+        self.meta_updates.append(
+            (get_short_table(table), object_id, meta_key, int(meta_value), adding)
+        )
+        self.db.update_meta_value(
+            table, id_col, object_id, meta_key, meta_value, adding
+        )
+
+    def update_meta_values(self, table: str, id_col: str, updates: list):
+        for object_id, meta_key, meta_value, adding in updates:
+            self.meta_updates.append(
+                (get_short_table(table), object_id, meta_key, int(meta_value), adding)
+            )
+        self.db.update_meta_values(table, id_col, updates)
+
+    def set_post_by_meta(
+        self, post_id: int, post_name: str, meta_key: str, meta_value, post_type: str
+    ):
+        self.inserts.append(("postmeta", (post_id, meta_key, str(meta_value)), 0))
+        self.db.set_post_by_meta(post_id, post_name, meta_key, meta_value, post_type)
+
+    def get_key(self, key_type: str, key_name: str, exists=None):
+        object_id = self.db.get_key(key_type, key_name, exists)
+        if object_id:
+            self.keys[(key_type, key_name)] = object_id
+        return object_id
+
+    def set_key(self, key_type: str, key_name: str, object_id: int):
+        self.keys[(key_type, key_name)] = object_id
+        self.db.set_key(key_type, key_name, object_id)
+
+    def get_tokens(self) -> dict:
+        tokens = {}
+        for (key_type, key_name), object_id in self.keys.items():
+            table = "posts" if key_type.startswith("post:") else "term_taxonomy"
+            tokens[(table, str(object_id))] = f"<{key_type}:{key_name}>"
+
+        counters = {}
+        for table, row, id in self.inserts:
+            if table in ID_TABLES and (table, str(id)) not in tokens:
+                counters[table] = counters.get(table, 0) + 1
+                tokens[(table, str(id))] = f"<{table}#{counters[table]}>"
+
+        return tokens
+
+    def get_normalized_rows(self) -> dict:
+        tokens = self.get_tokens()
+
+        def replace_id(match):
+            id = match.group(2)
+            return match.group(1) + tokens.get(("term_taxonomy", id), id)
+
+        def normalize(value, id_table: str = ""):
+            value = tsv_escape(value)
+            if id_table:
+                return tokens.get((id_table, value), value)
+            # Serialized trglinks carry server/lang/quality term IDs
+            value = re.sub(r'(i:|s:\d+:")(\d+)', replace_id, value)
+            value = re.sub(r"s:\d+:", "s:N:", value)
+            value = re.sub(
+                r"\d{4}[/-]\d{2}[/-]\d{2} \d{2}:\d{2}:\d{2}", "<time>", value
+            )
+            value = re.sub(r"^\d{10}:1$", "<lock>", value)
+            return value
+
+        res = {}
+        for table, row, id in self.inserts:
+            if table in ("postmeta", "termmeta"):
+                row = (
+                    normalize(
+                        row[0], "posts" if table == "postmeta" else "term_taxonomy"
+                    ),
+                    row[1],
+                    normalize(row[2], "posts" if row[1] in ID_META_KEYS else ""),
+                )
+            elif table == "term_relationships":
+                row = (
+                    normalize(row[0], "posts"),
+                    normalize(row[1], "term_taxonomy"),
+                    normalize(row[2]),
+                )
+            elif table == "term_taxonomy":
+                row = (normalize(row[0], "terms"), *(normalize(x) for x in row[1:]))
+            else:
+                row = tuple(normalize(x) for x in row)
+            res.setdefault(table, []).append(row)
+
+        res["meta_updates"] = [
+            (
+                table,
+                normalize(
+                    object_id, "posts" if table == "postmeta" else "term_taxonomy"
+                ),
+                meta_key,
+                str(meta_value),
+                str(adding),
+            )
+            for table, object_id, meta_key, meta_value, adding in self.meta_updates
+        ]
+
+        return {table: sorted(rows) for table, rows in res.items()}
+
+
+def get_scratch_database(schema: str) -> Database:
+    # verify never writes to the live site: its "live" run goes to a scratch
+    # schema with empty copies of the tables, like the site an export is
+    # loaded into
+    live_schema = database.connection["database"]
+    if not schema or schema == live_schema:
+        raise ValueError("verify needs a scratch schema other than the live one")
+
+    scratch_database = Database(connection={**database.connection, "database": schema})
+    for table in EXPORT_TABLES + ["crawler_keys"]:
+        scratch_database.execute(
+            f"CREATE TABLE IF NOT EXISTS {PREFIX}{table} "
+            f"LIKE {live_schema}.{PREFIX}{table}"
+        )
+    return scratch_database
+
+
+def verify(hrefs: list, scratch_schema: str) -> int:
+    get_scratch_database(scratch_schema)
+    crawler = Crawler()
+    mismatches = 0
+    for href in hrefs:
+        film_data, episodes_data = crawler.crawl_href(href)
+
+        # A fresh Database per film, so its key cache is emptied with the tables
+        scratch_database = get_scratch_database(scratch_schema)
+        for table in EXPORT_TABLES + ["crawler_keys"]:
+            scratch_database.execute(f"TRUNCATE TABLE {PREFIX}{table}")
+
+        export_database = CaptureDatabase(ExportDatabase(tempfile.mkdtemp()))
+        Toronites(
+            film=copy.deepcopy(film_data),
+            episodes=copy.deepcopy(episodes_data),
+            toronites_helper=ToronitesHelper(db=export_database),
+        ).insert_film(throttle=False)
+        export_database.close()
+
+        live_database = CaptureDatabase(scratch_database)
+        Toronites(
+            film=copy.deepcopy(film_data),
+            episodes=copy.deepcopy(episodes_data),
+            toronites_helper=ToronitesHelper(db=live_database),
+        ).insert_film(throttle=False)
+
+        export_rows = export_database.get_normalized_rows()
+        live_rows = live_database.get_normalized_rows()
+        for table in sorted(set(export_rows) | set(live_rows)):
+            only_export = set(export_rows.get(table, [])) - set(
+                live_rows.get(table, [])
+            )
+            only_live = set(live_rows.get(table, [])) - set(export_rows.get(table, []))
+            if not only_export and not only_live:
+                continue
+
+            mismatches += 1
+            logging.info(f"{href} {table}: rows differ")
+            for row in sorted(only_export):
+                logging.info(f"  export only: {row}")
+            for row in sorted(only_live):
+                logging.info(f"  live only:   {row}")
+
+    logging.info(f"Verified {len(hrefs)} films, {mismatches} table mismatches")
+    return mismatches
+
+
+def export(out_dir: str, post_type: str, first_page: int, last_page: int, reserve: int):
+    start_ids = get_id_ranges(reserve)
+    if not reserve:
+        logging.info(
+            "No IDs reserved, the live site must not insert until load.sql is loaded"
+        )
+    export_database = ExportDatabase(out_dir, start_ids, reserve, live=database)
+    export_writer = ExportWriter(export_database, live=database)
+    crawler = Crawler(writer=export_writer)
+
+    listing_url = (
+        CONFIG.TINYZONETV_TVSHOWS_PAGE
+        if post_type == CONFIG.TYPE_TV_SHOWS
+        else CONFIG.TINYZONETV_MOVIES_PAGE
+    )
+    helper.start_browsers()
+    try:
+        for page in range(first_page, last_page + 1):
+            if not crawler.crawl_page(
+                f"{listing_url}?page={page}", post_type=post_type
+            ):
+                break
+    finally:
+        helper.close_browsers()
+        export_database.close()
+        logging.info(f"{export_writer.skipped} films already on the live site skipped")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("out_dir")
+    export_parser.add_argument(
+        "--post-type",
+        choices=[CONFIG.TYPE_TV_SHOWS, CONFIG.TYPE_MOVIE],
+        default=CONFIG.TYPE_TV_SHOWS,
+    )
+    export_parser.add_argument("--first-page", type=int, default=1)
+    export_parser.add_argument("--last-page", type=int, default=1)
+    export_parser.add_argument(
+        "--reserve",
+        type=int,
+        default=0,
+        help="Reserve this many IDs per table on the live database",
+    )
+
+    verify_parser = subparsers.add_parser("verify")
+    verify_parser.add_argument("hrefs", nargs="+")
+    verify_parser.add_argument(
+        "--scratch-schema",
+        default=getattr(CONFIG, "BULK_EXPORT_SCRATCH_SCHEMA", ""),
+        help="Schema the live writes go to; its tables are emptied per film",
+    )
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(
+            args.out_dir, args.post_type, args.first_page, args.last_page, args.reserve
+        )
+    elif args.command == "verify":
+        sys.exit(1 if verify(args.hrefs, args.scratch_schema) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from base import Crawler
+from circuit_breaker import breakers
+from detail_page import DetailPage
+from helper import helper
+from settings import CONFIG
+
+FIXTURES_FOLDER = os.path.join(os.path.dirname(__file__), "fixtures", "parsers")
+
+
+class FixtureCrawler(Crawler):
+    def __init__(self, html: str):
+        super().__init__()
+        self.html = html
+
+    def crawl_soup(self, url):
+        return BeautifulSoup(self.html, "html.parser")
+
+
+def get_detail_parsers(crawler: Crawler, post_type: str) -> dict:
+    return {
+        "parse": lambda html: DetailPage(BeautifulSoup(html, "html.parser")),
+        "get_title": lambda page: helper.get_title(href="", page=page),
+        "get_description": lambda page: helper.get_description(href="", page=page),
+        "get_cover_url": lambda page: helper.get_cover_url(href="", page=page),
+        "get_trailer_id": lambda page: helper.get_trailer_id(page),
+        "get_imdb_score": lambda page: helper.get_imdb_score(page=page),
+        "get_extra_info": lambda page: crawler.get_extra_info(page=page),
+        "get_episodes_data": lambda page: crawler.get_episodes_data(
+            href="", page=page, post_type=post_type
+        ),
+    }
+
+
+def get_listing_parsers(crawler: Crawler) -> dict:
+    return {
+        "parse": lambda html: BeautifulSoup(html, "html.parser"),
+        "get_flw_items": lambda url: [
+            crawler.parse_flw_item(flw_item) for flw_item in crawler.get_flw_items(url)
+        ],
+        "get_homepage_items": lambda url: crawler.get_homepage_items(url),
+    }
+
+
+def run_fixture(name: str, html: str) -> dict:
+    # Every parser of the page kind: {parser: (input, function)}
+    crawler = FixtureCrawler(html)
+    if name.startswith("detail_"):
+        post_type = CONFIG.TYPE_MOVIE if "movie" in name else CONFIG.TYPE_TV_SHOWS
+        page = DetailPage(BeautifulSoup(html, "html.parser"))
+        return {
+            parser: (html if parser == "parse" else page, func)
+            for parser, func in get_detail_parsers(crawler, post_type).items()
+        }
+
+    parsers = get_listing_parsers(crawler)
+    if name.startswith("homepage"):
+        parsers.pop("get_flw_items")
+    else:
+        parsers.pop("get_homepage_items")
+    return {
+        parser: (html if parser == "parse" else CONFIG.TINYZONETV_HOMEPAGE, func)
+        for parser, func in parsers.items()
+    }
+
+
+def normalize_config(value):
+    # Site settings become placeholders, so the fixtures hold for whatever
+    # post types and homepage settings.py has
+    if isinstance(value, dict):
+        return {key: normalize_config(x) for key, x in value.items()}
+    if isinstance(value, list):
+        return [normalize_config(x) for x in value]
+    if not isinstance(value, str):
+        return value
+
+    if value == CONFIG.TYPE_TV_SHOWS:
+        return "{TYPE_TV_SHOWS}"
+    if value == CONFIG.TYPE_MOVIE:
+        return "{TYPE_MOVIE}"
+    return value.replace(CONFIG.TINYZONETV_HOMEPAGE, "{TINYZONETV_HOMEPAGE}")
+
+
+def get_fixture_names() -> list:
+    return sorted(
+        file_name[:-5]
+        for file_name in os.listdir(FIXTURES_FOLDER)
+        if file_name.endswith(".html")
+    )
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_FOLDER, f"{name}.html")) as f:
+        return f.read()
+
+
+def get_outputs(parsers: dict) -> dict:
+    with breakers.paused():
+        outputs = {
+            parser: func(arg)
+            for parser, (arg, func) in parsers.items()
+            if parser != "parse"
+        }
+    # Round-trip through JSON so tuples and lists compare the same
+    return normalize_config(json.loads(json.dumps(outputs)))
+
+
+def get_expected(name: str) -> dict:
+    with open(os.path.join(FIXTURES_FOLDER, f"{name}.json")) as f:
+        return json.load(f)
+
+
+def get_mismatches(name: str, outputs: dict) -> list:
+    # [(parser, expected, got)] of the outputs differing from the fixture
+    expected = get_expected(name)
+    return [
+        (parser, expected.get(parser), outputs.get(parser))
+        for parser in sorted(set(expected) | set(outputs))
+        if outputs.get(parser) != expected.get(parser)
+    ]
+
+
+def measure(func, arg, min_seconds: float) -> float:
+    runs = 0
+    start = time.perf_counter()
+    # The broken fixture would otherwise trip the extractors' breakers
+    with breakers.paused():
+        while True:
+            func(arg)
+            runs += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                return runs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check parsers against the golden fixtures and report throughput"
+    )
+    parser.add_argument("names", nargs="*", help="fixture names, default all")
+    parser.add_argument(
+        "--update", action="store_true", help="rewrite the expected outputs"
+    )
+    parser.add_argument("--seconds", type=float, default=0.2)
+    parser.add_argument("--no-throughput", action="store_true")
+    args = parser.parse_args()
+
+    # The broken fixture fails on purpose, keep that out of log/
+    helper.error_log = lambda *args, **kwargs: None
+
+    failed = 0
+    for name in args.names or get_fixture_names():
+        parsers = run_fixture(name, read_fixture(name))
+        outputs = get_outputs(parsers)
+
+        if args.update:
+            with open(os.path.join(FIXTURES_FOLDER, f"{name}.json"), "w") as f:
+                json.dump(outputs, f, indent=2, ensure_ascii=False, sort_keys=True)
+                f.write("\n")
+            print(f"{name}: expected output updated")
+        else:
+            for parser, expected, got in get_mismatches(name, outputs):
+                failed += 1
+                print(f"FAIL {name}.{parser}")
+                print(f"  expected: {json.dumps(expected)[:500]}")
+                print(f"  got:      {json.dumps(got)[:500]}")
+            print(f"{name}: {len(outputs)} parsers checked")
+
+        if not args.no_throughput:
+            for parser, (arg, func) in parsers.items():
+                pages_per_second = measure(func, arg, args.seconds)
+                print(f"  {parser:20} {pages_per_second:12.0f} pages/sec")
+
+    if failed:
+        print(f"{failed} parser outputs differ from the golden fixtures")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
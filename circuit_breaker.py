@@ -0,0 +1,159 @@
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+from settings import CONFIG
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    # Trips once the failure ratio over the last `window` calls reaches
+    # `failure_ratio`. While open, callers wait instead of calling; after
+    # `open_for` seconds one probe call is let through (half-open), which
+    # closes the breaker on success or reopens it for twice as long.
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_ratio: float = 0.8,
+        open_for: int = 60,
+        max_open_for: int = 30 * 60,
+    ):
+        self.name = name
+        self.window = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.base_open_for = open_for
+        self.open_for = open_for
+        self.max_open_for = max_open_for
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.lock = threading.Lock()
+
+    def trip(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.window.clear()
+        logging.info(
+            f"Circuit {self.name} open, pausing for {self.open_for}s before probing"
+        )
+
+    def record(self, success: bool):
+        with self.lock:
+            now = time.time()
+            if self.state == OPEN:
+                if now < self.opened_at + self.open_for:
+                    return
+                # Extractors that aren't called on every fetch aren't gated,
+                # so a call made after the pause is taken as the probe
+                self.state = HALF_OPEN
+
+            if self.state == HALF_OPEN:
+                if success:
+                    logging.info(f"Circuit {self.name} closed")
+                    self.state = CLOSED
+                    self.open_for = self.base_open_for
+                else:
+                    self.open_for = min(self.open_for * 2, self.max_open_for)
+                    self.trip(now)
+                return
+
+            self.window.append(success)
+            failures = self.window.count(False)
+            if (
+                len(self.window) >= self.min_calls
+                and failures / len(self.window) >= self.failure_ratio
+            ):
+                self.trip(now)
+
+    def get_wait(self) -> float:
+        # Seconds until a call may go through, 0 to go now
+        with self.lock:
+            now = time.time()
+            if self.state == CLOSED:
+                return 0
+
+            if self.state == OPEN:
+                wait = self.opened_at + self.open_for - now
+                if wait > 0:
+                    return wait
+                self.state = HALF_OPEN
+                self.probe_started = now
+                return 0
+
+            # Half-open: one probe at a time, unless it never reported back
+            if now - self.probe_started > self.open_for:
+                self.probe_started = now
+                return 0
+            return 1
+
+    def wait(self):
+        while True:
+            wait = self.get_wait()
+            if not wait:
+                return
+            time.sleep(min(wait, 5))
+
+
+class CircuitBreakers:
+    def __init__(self, **breaker_kwargs):
+        self.breaker_kwargs = breaker_kwargs
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self.lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(name, **self.breaker_kwargs)
+            return self.breakers[name]
+
+    def wait_for(self, names: list):
+        # Pause while any of these breakers is open, breakers that never
+        # recorded a call don't exist yet
+        for name in names:
+            breaker = self.breakers.get(name)
+            if breaker:
+                breaker.wait()
+
+    def extractor(self, name: str, is_failure=lambda res: not res):
+        # The extractors swallow their own exceptions and return an empty
+        # value, so failures are told apart by the result.
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                res = func(*args, **kwargs)
+                if not getattr(self.local, "paused", False):
+                    self.get(f"extractor:{name}").record(not is_failure(res))
+                return res
+
+            return wrapper
+
+        return decorator
+
+    @contextlib.contextmanager
+    def paused(self):
+        # Extractor calls made on this thread meanwhile aren't recorded, e.g.
+        # parser checks that run them on a purposely broken page
+        self.local.paused = True
+        try:
+            yield
+        finally:
+            self.local.paused = False
+
+
+breakers = CircuitBreakers(
+    window=getattr(CONFIG, "BREAKER_WINDOW", 20),
+    min_calls=getattr(CONFIG, "BREAKER_MIN_CALLS", 10),
+    failure_ratio=getattr(CONFIG, "BREAKER_FAILURE_RATIO", 0.8),
+    open_for=getattr(CONFIG, "BREAKER_OPEN_SECONDS", 60),
+    max_open_for=getattr(CONFIG, "BREAKER_MAX_OPEN_SECONDS", 30 * 60),
+)
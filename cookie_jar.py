@@ -0,0 +1,109 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from settings import CONFIG
+
+
+class SharedCookieJar:
+    # Clearance cookies per host, kept in one JSON file so every crawler
+    # process reuses the challenge another one already solved. Each host is
+    # pinned to the user agent that solved it, since clearance cookies are
+    # rejected when sent with a different one.
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.hosts = {}
+        self.mtime = 0.0
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return
+
+        with open(self.path) as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                self.hosts = json.load(f)
+            except ValueError:
+                self.hosts = {}
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.mtime = mtime
+
+    def get(self, host: str) -> dict:
+        self.load()
+        entry = self.hosts.get(host)
+        if not entry:
+            return None
+
+        now = time.time()
+        cookies = {
+            cookie["name"]: cookie["value"]
+            for cookie in entry["cookies"]
+            if not cookie.get("expiry") or cookie["expiry"] > now
+        }
+        if len(cookies) < len(entry["cookies"]) and "cf_clearance" not in cookies:
+            # Clearance expired, the next challenge has to be solved again
+            return None
+
+        return {
+            "cookies": cookies,
+            "user_agent": entry["user_agent"],
+            "updated_at": entry["updated_at"],
+        }
+
+    def put(self, host: str, cookies: list, user_agent: str):
+        entry = {
+            "cookies": [
+                {
+                    "name": cookie["name"],
+                    "value": cookie["value"],
+                    "expiry": cookie.get("expiry"),
+                }
+                for cookie in cookies
+            ],
+            "user_agent": user_agent,
+            "updated_at": time.time(),
+        }
+
+        if not self.path:
+            self.hosts[host] = entry
+            return
+
+        with open(f"{self.path}.lock", "a") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                self.mtime = 0.0
+                self.load()
+                self.hosts[host] = entry
+
+                tmp_file = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(self.hosts, f)
+                os.replace(tmp_file, self.path)
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def solving(self, host: str):
+        # Only one process solves a host's challenge at a time; the others
+        # wait here and then pick up its cookies instead of solving again
+        if not self.path:
+            yield
+            return
+
+        with open(f"{self.path}.{host}.solve.lock", "a") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+
+def get_cookie_jar() -> SharedCookieJar:
+    return SharedCookieJar(getattr(CONFIG, "COOKIE_JAR_FILE", "cookies.json"))
@@ -1,34 +1,192 @@
+import argparse
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _db import Database, database, get_target_database
 from base import Crawler
+from helper import helper
 from settings import CONFIG
-from toronites import Toronites
+from writer_pool import exit_on_sigterm, get_writer_pool
 
-crawler = Crawler()
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
 
-links = [
-    "https://tinyzonetv.xyz/tv/demon-slayer-kimetsu-no-yaiba-42177",
-    "https://tinyzonetv.xyz/tv/barracuda-queens-97345",
-]
 
+def read_links(f) -> list:
+    # One href per line, blank lines and "#" comments ignored, duplicates
+    # dropped keeping the first occurrence
+    links = []
+    seen = set()
+    for line in f:
+        href = line.strip()
+        if not href or href.startswith("#") or href in seen:
+            continue
+        seen.add(href)
+        links.append(href)
+    return links
 
-def crawl_film_via_link(href: str):
-    slug = href.split("/")[-1]
 
-    film_data, episodes_data = crawler.crawl_film(
-        title="",
-        slug=slug,
-        fd_infor="",
-        quality="HD",  # Edit if needed
-        cover_src="",
-        href=href,
-        post_type=CONFIG.TYPE_TV_SHOWS,  # or CONFIG.TYPE_MOVIE
-    )
+def read_done(done_file: str) -> set:
+    try:
+        with open(done_file) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def get_existing_slugs(
+    items: list, db: Database = database, chunk_size: int = 1000
+) -> set:
+    # (post_type, slug) of every item already in db, one query per chunk
+    existing = set()
+    post_types = list({item["post_type"] for item in items})
+    slugs = list({item["slug"] for item in items})
+    for i in range(0, len(slugs), chunk_size):
+        chunk = slugs[i : i + chunk_size]
+        existing.update(
+            (post_type, post_name)
+            for post_type, post_name in db.select_with_data(
+                f"SELECT post_type, post_name FROM {db.table_prefix}posts "
+                f"WHERE post_type IN ({', '.join(['%s'] * len(post_types))}) "
+                f"AND post_name IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(post_types + chunk),
+            )
+        )
+    return existing
+
+
+def get_imported_slugs(items: list) -> set:
+    # Only titles every writer target already has are skipped
+    targets = getattr(CONFIG, "WRITER_TARGETS", [])
+    if not targets:
+        return get_existing_slugs(items)
+
+    if any(target.get("theme", "toronites") == "dooplay" for target in targets):
+        # DooPlay posts are named after the title, which is only known once
+        # the page is fetched; DooPlay skips the posts it already has
+        return set()
+
+    existing = None
+    for target in targets:
+        target_existing = get_existing_slugs(items, get_target_database(target))
+        existing = target_existing if existing is None else existing & target_existing
+    return existing
+
+
+class LinkImport:
+    def __init__(self, crawler: Crawler, items: list, done_file: str, workers: int = 4):
+        self.crawler = crawler
+        self.items = items
+        self.done_file = done_file
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = []
+        self.started = time.time()
+
+    def report(self):
+        elapsed = time.time() - self.started
+        logging.info(
+            f"Imported {self.done}/{len(self.items)}, {len(self.failed)} failed, "
+            f"{self.done / elapsed if elapsed else 0:.2f} links/s"
+        )
+
+    def import_item(self, item: dict):
+        try:
+            self.crawler.crawl_item(item)
+        except Exception as e:
+            helper.error_log(
+                msg=f"Error importing {item['href']}\n{e}",
+                log_file="crawl_links.import_item.log",
+            )
+            with self.lock:
+                self.failed.append(item["href"])
+            return
+
+        with self.lock:
+            self.done += 1
+            # Flushed per link, a rerun skips everything listed here
+            with open(self.done_file, "a") as f:
+                f.write(item["href"] + "\n")
+            if self.done % 10 == 0:
+                self.report()
 
-    Toronites(film=film_data, episodes=episodes_data).insert_film()
+    def run(self):
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="crawl-links"
+        ) as executor:
+            list(executor.map(self.import_item, self.items))
+        self.report()
 
 
 def main():
-    for link in links:
-        crawl_film_via_link(href=link)
+    parser = argparse.ArgumentParser(
+        description="Import /tv/ and /movie/ links, one per line"
+    )
+    parser.add_argument("links_file", nargs="?", default="-", help="default stdin")
+    parser.add_argument(
+        "--workers", type=int, default=getattr(CONFIG, "CRAWL_LINKS_WORKERS", 4)
+    )
+    parser.add_argument("--quality", default="HD")
+    parser.add_argument(
+        "--done-file", help="links imported so far, default <links_file>.done"
+    )
+    parser.add_argument(
+        "--failed-file", help="links that failed, default <links_file>.failed"
+    )
+    parser.add_argument(
+        "--include-existing",
+        action="store_true",
+        help="also recrawl titles that are already imported",
+    )
+    args = parser.parse_args()
+
+    name = "crawl_links" if args.links_file == "-" else args.links_file
+    done_file = args.done_file or f"{name}.done"
+    failed_file = args.failed_file or f"{name}.failed"
+
+    if args.links_file == "-":
+        links = read_links(sys.stdin)
+    else:
+        with open(args.links_file) as f:
+            links = read_links(f)
+
+    exit_on_sigterm()
+    # Links are only marked done once their film is written
+    writer = get_writer_pool()
+    crawler = Crawler(writer=writer, wait_for_writer=True)
+
+    done = read_done(done_file)
+    items = [
+        crawler.get_href_item(href, args.quality) for href in links if href not in done
+    ]
+    logging.info(f"{len(links)} links, {len(links) - len(items)} done in earlier runs")
+
+    if not args.include_existing and items:
+        existing = get_imported_slugs(items)
+        items = [
+            item for item in items if (item["post_type"], item["slug"]) not in existing
+        ]
+        logging.info(f"{len(existing)} already imported, {len(items)} to import")
+
+    link_import = LinkImport(crawler, items, done_file, args.workers)
+    helper.start_browsers()
+    try:
+        if writer:
+            with writer:
+                link_import.run()
+        else:
+            link_import.run()
+    finally:
+        helper.close_browsers()
+
+    with open(failed_file, "w") as f:
+        f.writelines(href + "\n" for href in link_import.failed)
+    if link_import.failed:
+        logging.info(f"{len(link_import.failed)} failed links written to {failed_file}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
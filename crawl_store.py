@@ -0,0 +1,101 @@
+import fcntl
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime
+
+from settings import CONFIG
+
+
+class CrawlStore:
+    # Every record is its own gzip member appended to records.jsonl.gz, so the
+    # file stays a valid gzip stream while single records can still be read
+    # straight from their offset. index.tsv maps slugs to those offsets.
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.records_path = os.path.join(folder, "records.jsonl.gz")
+        self.index_path = os.path.join(folder, "index.tsv")
+        self.index = None
+
+    def append(self, film_data: dict, episodes_data: dict):
+        # Replays may create the post, so every lazy field is extracted here
+        record = {
+            "crawled_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "film": dict(film_data.items()),
+            "episodes": dict(episodes_data.items()),
+        }
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        member = gzip.compress(line.encode("utf-8"))
+
+        with open(self.records_path, "ab") as f:
+            # Several crawler processes may share one store
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(member)
+                f.flush()
+                with open(self.index_path, "a") as index_f:
+                    index_f.write(
+                        f"{film_data['post_type']}\t{film_data['slug']}\t{offset}\t{len(member)}\n"
+                    )
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        if self.index is not None:
+            self.index[(film_data["post_type"], film_data["slug"])] = (
+                offset,
+                len(member),
+            )
+
+    def load_index(self) -> dict:
+        if self.index is None:
+            self.index = {}
+            if os.path.isfile(self.index_path):
+                with open(self.index_path) as f:
+                    for line in f:
+                        try:
+                            post_type, slug, offset, length = line.rstrip("\n").split(
+                                "\t"
+                            )
+                            self.index[(post_type, slug)] = (int(offset), int(length))
+                        except ValueError:
+                            # Torn last line from a crash mid-append
+                            continue
+        return self.index
+
+    def read_at(self, f, offset: int, length: int) -> dict:
+        f.seek(offset)
+        line = zlib.decompressobj(wbits=31).decompress(f.read(length))
+        return json.loads(line)
+
+    def get(self, slug: str, post_type: str = CONFIG.TYPE_TV_SHOWS) -> dict:
+        position = self.load_index().get((post_type, slug))
+        if not position:
+            return None
+
+        with open(self.records_path, "rb") as f:
+            return self.read_at(f, *position)
+
+    def iter_records(self, latest_only: bool = True):
+        if not os.path.isfile(self.records_path):
+            return
+
+        if not latest_only:
+            with gzip.open(self.records_path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+            return
+
+        # Sequential read of the latest version of each title, in file order
+        positions = sorted(self.load_index().values())
+        with open(self.records_path, "rb") as f:
+            for offset, length in positions:
+                yield self.read_at(f, offset, length)
+
+
+def get_crawl_store() -> CrawlStore:
+    folder = getattr(CONFIG, "CRAWL_STORE_FOLDER", "")
+    return CrawlStore(folder) if folder else None
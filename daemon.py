@@ -0,0 +1,323 @@
+import logging
+import os
+import time
+
+from base import Crawler
+from fingerprints import get_fingerprint_store
+from helper import helper
+from scheduler import UpdateScheduler, get_scheduler
+from settings import CONFIG
+from sitemap import get_sitemap_discovery
+from writer_pool import exit_on_sigterm, get_writer_pool
+
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+
+
+class DaemonCrawler(Crawler):
+    # Every task's crawler shares one map of recently crawled films, so a
+    # title showing up on the homepage and in a listing sweep at the same
+    # time is only fetched and written once.
+    def __init__(self, recent: dict, recrawl_after: int = 5 * 60, **kwargs):
+        super().__init__(**kwargs)
+        self.recent = recent
+        self.recrawl_after = recrawl_after
+
+    def get_recrawl_wait(self, item: dict) -> float:
+        key = (item["post_type"], item["slug"])
+        return max(0.0, self.recent.get(key, 0) + self.recrawl_after - time.time())
+
+    def crawl_item(self, item: dict):
+        # None when skipped, as opposed to a crawl that found no new episodes
+        key = (item["post_type"], item["slug"])
+        if self.get_recrawl_wait(item):
+            logging.info(
+                f"Skipping {key}, crawled {time.time() - self.recent[key]:.0f}s ago"
+            )
+            return None
+
+        self.recent[key] = time.time()
+        return super().crawl_item(item)
+
+    def prune(self):
+        now = time.time()
+        for key in [
+            key
+            for key, crawled_at in self.recent.items()
+            if now - crawled_at >= self.recrawl_after
+        ]:
+            del self.recent[key]
+
+
+class DaemonTask:
+    # One bounded unit of work per step; steps_per_minute is the task's
+    # budget, 0 means only the interval between steps limits it. A step
+    # returning True has work left and runs again on the next pass.
+    def __init__(self, name: str, interval: float = 0, steps_per_minute: int = 0):
+        self.name = name
+        self.interval = interval
+        self.steps_per_minute = steps_per_minute
+        self.tokens = float(steps_per_minute)
+        self.tokens_updated = time.time()
+        self.next_run = 0.0
+
+    def refill(self, now: float):
+        elapsed = now - self.tokens_updated
+        self.tokens = min(
+            float(self.steps_per_minute),
+            self.tokens + elapsed * self.steps_per_minute / 60,
+        )
+        self.tokens_updated = now
+
+    def is_ready(self, now: float) -> bool:
+        if now < self.next_run:
+            return False
+
+        if self.steps_per_minute:
+            self.refill(now)
+            return self.tokens >= 1
+        return True
+
+    def run(self):
+        if self.steps_per_minute:
+            self.tokens -= 1
+
+        has_more = False
+        try:
+            has_more = self.step()
+        except Exception as e:
+            helper.error_log(
+                msg=f"Error in task {self.name}\n{e}", log_file="daemon.task.log"
+            )
+        self.next_run = time.time() + (0 if has_more else self.interval)
+
+    def step(self):
+        raise NotImplementedError
+
+
+class ListingTask(DaemonTask):
+    # Pages through a listing, one page per step, and starts over from
+    # restart_page once it runs past last_page
+    def __init__(
+        self,
+        crawler: Crawler,
+        post_type: str,
+        listing_url: str,
+        last_page: int,
+        restart_page: int = 1,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.crawler = crawler
+        self.post_type = post_type
+        self.listing_url = listing_url
+        self.last_page = last_page
+        self.restart_page = restart_page
+        self.page = 1
+
+    def step(self):
+        page = self.page
+        self.page += 1
+        crawled_page = self.crawler.crawl_page(
+            f"{self.listing_url}?page={page}", post_type=self.post_type
+        )
+        if not crawled_page and page >= self.last_page:
+            self.page = self.restart_page
+
+
+class HomepageTask(DaemonTask):
+    # The update.py loop: the homepage feeds the scheduler, which decides
+    # which known titles are due for a recrawl
+    def __init__(self, crawler: Crawler, scheduler: UpdateScheduler, **kwargs):
+        super().__init__(**kwargs)
+        self.crawler = crawler
+        self.scheduler = scheduler
+        self.next_homepage_crawl = 0
+
+    def step(self):
+        if time.time() >= self.next_homepage_crawl and self.scheduler.spend():
+            self.crawler.update(scheduler=self.scheduler)
+            self.next_homepage_crawl = time.time() + CONFIG.WAIT_BETWEEN_LATEST
+
+        for scheduled in self.scheduler.take():
+            recrawl_wait = self.crawler.get_recrawl_wait(scheduled.item)
+            if recrawl_wait:
+                # Just crawled by another task, which isn't a refresh of its own
+                self.scheduler.defer(scheduled, recrawl_wait)
+                continue
+
+            new_episodes = 0
+            try:
+                new_episodes = self.crawler.crawl_item(scheduled.item)
+            except Exception as e:
+                helper.error_log(
+                    msg=f"Error crawl_item {scheduled.key}\n{e}",
+                    log_file="update.crawl_item.log",
+                )
+            self.scheduler.mark_crawled(scheduled, new_episodes or 0)
+
+        self.scheduler.save()
+
+
+class LinksTask(DaemonTask):
+    # Ad-hoc imports: hrefs appended to links_file, one per line, are
+    # crawled `batch` at a time and removed from the file
+    def __init__(self, crawler: Crawler, links_file: str, batch: int = 20, **kwargs):
+        super().__init__(**kwargs)
+        self.crawler = crawler
+        self.links_file = links_file
+        self.batch = batch
+
+    def step(self) -> bool:
+        if not os.path.isfile(self.links_file):
+            return False
+
+        with open(self.links_file) as f:
+            hrefs = [line.strip() for line in f if line.strip()]
+        has_more = len(hrefs) > self.batch
+        hrefs = hrefs[: self.batch]
+
+        for href in hrefs:
+            try:
+                self.crawler.crawl_item(self.crawler.get_href_item(href))
+            except Exception as e:
+                helper.error_log(
+                    msg=f"Error importing {href}\n{e}", log_file="daemon.links.log"
+                )
+
+        # Links added while these were imported stay for the next step
+        with open(self.links_file) as f:
+            remaining = [line for line in f if line.strip() not in hrefs]
+        tmp_file = f"{self.links_file}.tmp"
+        with open(tmp_file, "w") as f:
+            f.writelines(remaining)
+        os.replace(tmp_file, self.links_file)
+        return has_more
+
+
+class SitemapTask(DaemonTask):
+    # A sweep is spread over steps: one sitemap read or `batch` URLs crawled
+    # per step, `interval` only applies between sweeps
+    def __init__(self, crawler: Crawler, batch: int = 20, **kwargs):
+        super().__init__(**kwargs)
+        self.discovery = get_sitemap_discovery(crawler)
+        self.batch = batch
+
+    def step(self) -> bool:
+        return self.discovery.step(self.batch)
+
+
+class Daemon:
+    # Runs the tasks cooperatively in one process: every pass runs each task
+    # that is due and within budget once, so they share the HTTP session,
+    # the database pool and caches, and the writer pool.
+    def __init__(self, tasks: list, crawlers: list = None, idle_sleep: float = 1):
+        self.tasks = tasks
+        self.crawlers = crawlers or []
+        self.idle_sleep = idle_sleep
+
+    def run_once(self) -> bool:
+        is_busy = False
+        for task in self.tasks:
+            if task.is_ready(time.time()):
+                task.run()
+                is_busy = True
+
+        for crawler in self.crawlers:
+            crawler.prune()
+
+        return is_busy
+
+    def run(self):
+        logging.info(f"Running tasks: {', '.join(task.name for task in self.tasks)}")
+        while True:
+            if not self.run_once():
+                time.sleep(self.idle_sleep)
+
+
+def get_daemon(writer=None, task_names: list = None) -> Daemon:
+    recent = {}
+    recrawl_after = getattr(CONFIG, "DAEMON_RECRAWL_AFTER", 5 * 60)
+    crawler = DaemonCrawler(recent, recrawl_after, writer=writer)
+    # The scheduler needs each crawl's new episode count, so the homepage
+    # task waits for its writes to finish
+    update_crawler = DaemonCrawler(
+        recent,
+        recrawl_after,
+        writer=writer,
+        wait_for_writer=True,
+        fingerprints=get_fingerprint_store(),
+    )
+
+    budgets = getattr(CONFIG, "DAEMON_TASK_BUDGETS", {})
+    tasks = {
+        "homepage": lambda: HomepageTask(
+            update_crawler,
+            get_scheduler(),
+            name="homepage",
+            interval=1,
+            steps_per_minute=budgets.get("homepage", 0),
+        ),
+        "movies": lambda: ListingTask(
+            crawler,
+            CONFIG.TYPE_MOVIE,
+            CONFIG.TINYZONETV_MOVIES_PAGE,
+            CONFIG.TINYZONETV_MOVIES_LAST_PAGE,
+            restart_page=2,
+            name="movies",
+            interval=CONFIG.WAIT_BETWEEN_ALL,
+            steps_per_minute=budgets.get("movies", 0),
+        ),
+        "tvshows": lambda: ListingTask(
+            crawler,
+            CONFIG.TYPE_TV_SHOWS,
+            CONFIG.TINYZONETV_TVSHOWS_PAGE,
+            CONFIG.TINYZONETV_TVSHOWS_LAST_PAGE,
+            name="tvshows",
+            interval=CONFIG.WAIT_BETWEEN_ALL,
+            steps_per_minute=budgets.get("tvshows", 0),
+        ),
+        "links": lambda: LinksTask(
+            crawler,
+            getattr(CONFIG, "DAEMON_LINKS_FILE", "links.txt"),
+            batch=getattr(CONFIG, "DAEMON_LINKS_BATCH", 20),
+            name="links",
+            interval=getattr(CONFIG, "DAEMON_LINKS_INTERVAL", 60),
+            steps_per_minute=budgets.get("links", 0),
+        ),
+        "sitemap": lambda: SitemapTask(
+            crawler,
+            batch=getattr(CONFIG, "SITEMAP_BATCH", 20),
+            name="sitemap",
+            interval=getattr(CONFIG, "SITEMAP_SWEEP_INTERVAL", 60 * 60),
+            steps_per_minute=budgets.get("sitemap", 0),
+        ),
+    }
+
+    return Daemon(
+        [
+            tasks[name]()
+            for name in task_names
+            or getattr(
+                CONFIG, "DAEMON_TASKS", ["homepage", "movies", "tvshows", "links"]
+            )
+        ],
+        crawlers=[crawler, update_crawler],
+    )
+
+
+def main(task_names: list = None):
+    exit_on_sigterm()
+    helper.start_browsers()
+    writer = get_writer_pool()
+    try:
+        if writer:
+            with writer:
+                get_daemon(writer, task_names).run()
+        else:
+            get_daemon(task_names=task_names).run()
+    finally:
+        helper.close_browsers()
+
+
+if __name__ == "__main__":
+    main()
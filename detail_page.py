@@ -0,0 +1,130 @@
+from bs4 import BeautifulSoup, Tag
+
+
+class DetailPage:
+    # Every node the detail extractors read, collected in one walk over the
+    # parsed page instead of one soup.find() from the root per field and per
+    # season. Nodes are the same ones the find() calls used to return: the
+    # first match in document order, inside the first matching parent.
+    def __init__(self, soup: BeautifulSoup):
+        self.player_area = None
+        self.detail_page_infor = None
+        self.heading = None
+        self.description = None
+        self.poster = None
+        self.dp_i_stats = None
+        self.imdb_button = None
+        self.elements = None
+        self.row_lines = []
+        self.modaltrailer = None
+        self.trailer_iframe = None
+        self.seasons_list = None
+        self.slc_seasons = None
+        self.season_items = []
+        self.blocks_by_id = {}
+        self.episode_items = {}
+
+        self.in_detail_page_infor = False
+        self.in_dp_i_stats = False
+        self.in_elements = False
+        self.in_modaltrailer = False
+        self.in_seasons_list = False
+        self.in_slc_seasons = False
+        self.open_blocks = []
+
+        self.visit(soup)
+
+    def enter(self, tag: Tag) -> list:
+        name = tag.name
+        classes = tag.get("class") or ()
+        entered = []
+
+        if name == "div":
+            tag_id = tag.get("id")
+            if tag_id is not None and tag_id not in self.blocks_by_id:
+                self.blocks_by_id[tag_id] = tag
+                self.episode_items[tag_id] = []
+                self.open_blocks.append(tag_id)
+                entered.append("open_blocks")
+
+            if tag_id == "modaltrailer" and self.modaltrailer is None:
+                self.modaltrailer = tag
+                self.in_modaltrailer = True
+                entered.append("in_modaltrailer")
+
+            if not classes:
+                return entered
+
+            if "detail_page-infor" in classes and self.detail_page_infor is None:
+                self.detail_page_infor = tag
+                self.in_detail_page_infor = True
+                entered.append("in_detail_page_infor")
+            elif "watching_player-area" in classes and self.player_area is None:
+                self.player_area = tag
+            elif "seasons-list" in classes and self.seasons_list is None:
+                self.seasons_list = tag
+                self.in_seasons_list = True
+                entered.append("in_seasons_list")
+            elif self.in_seasons_list and "slc-seasons" in classes:
+                if self.slc_seasons is None:
+                    self.slc_seasons = tag
+                    self.in_slc_seasons = True
+                    entered.append("in_slc_seasons")
+            elif self.in_detail_page_infor:
+                if "description" in classes and self.description is None:
+                    self.description = tag
+                elif "dp-i-stats" in classes and self.dp_i_stats is None:
+                    self.dp_i_stats = tag
+                    self.in_dp_i_stats = True
+                    entered.append("in_dp_i_stats")
+                elif "elements" in classes and self.elements is None:
+                    self.elements = tag
+                    self.in_elements = True
+                    entered.append("in_elements")
+                elif self.in_elements and "row-line" in classes:
+                    self.row_lines.append(tag)
+
+        elif name == "a":
+            if self.open_blocks and "episode-item" in classes:
+                for block_id in self.open_blocks:
+                    self.episode_items[block_id].append(tag)
+
+        elif name == "li":
+            if self.in_slc_seasons:
+                self.season_items.append(tag)
+
+        elif name == "iframe":
+            if self.in_modaltrailer and self.trailer_iframe is None:
+                self.trailer_iframe = tag
+
+        elif self.in_detail_page_infor:
+            if name == "h2":
+                if "heading-name" in classes and self.heading is None:
+                    self.heading = tag
+            elif name == "img":
+                if "film-poster-img" in classes and self.poster is None:
+                    self.poster = tag
+            elif name == "button":
+                if (
+                    self.in_dp_i_stats
+                    and "btn-imdb" in classes
+                    and self.imdb_button is None
+                ):
+                    self.imdb_button = tag
+
+        return entered
+
+    def visit(self, tag: Tag):
+        for child in tag.children:
+            if not isinstance(child, Tag):
+                continue
+
+            entered = self.enter(child)
+            if child.contents:
+                self.visit(child)
+
+            for scope in entered:
+                if scope == "open_blocks":
+                    self.open_blocks.pop()
+                else:
+                    setattr(self, scope, False)
@@ -0,0 +1,176 @@
+import logging
+import re
+from time import sleep
+
+from slugify import slugify
+
+from helper import Helper, helper
+from settings import CONFIG
+
+# Detail-page row-line names -> the extra_info keys generate_film_data knows
+EXTRA_INFO_KEYS = {
+    "IMDB": "IMDb",
+    "Duration": "Duration",
+    "Genre": "Genre",
+    "Casts": "Actor",
+    "Country": "Country",
+}
+TAXONOMY_INFO_KEYS = ["Genre", "Actor", "Country"]
+# Crawled post types (the Toronites site's CONFIG.TYPE_*) -> DooPlay's, which
+# the legacy Helper branches on; a WRITER_TARGETS entry's "post_types"
+# overrides them
+POST_TYPES = {CONFIG.TYPE_TV_SHOWS: "tvshows", CONFIG.TYPE_MOVIE: "movies"}
+
+
+class DooPlay:
+    # Writes crawled film_data/episodes_data to a DooPlay-themed site through
+    # the legacy Helper, the same way Toronites does for Toronites sites.
+    def __init__(
+        self,
+        film: dict,
+        episodes: dict,
+        dooplay_helper: Helper = None,
+        post_types: dict = None,
+    ):
+        self.film = film
+        self.episodes = episodes
+        self.helper = dooplay_helper or helper
+        self.post_type = (post_types or POST_TYPES).get(
+            film["post_type"], film["post_type"]
+        )
+        self.new_episodes = 0
+
+    def get_extra_info(self) -> dict:
+        extra_info = {}
+        for info_key, value in self.film.get("extra_info", {}).items():
+            if info_key in EXTRA_INFO_KEYS:
+                extra_info[EXTRA_INFO_KEYS[info_key]] = value
+            elif info_key == "Released":
+                extra_info["Release"] = value[:4]
+
+        if "Duration" in extra_info:
+            extra_info["Duration"] = extra_info["Duration"].replace("min", "").strip()
+        for info_key in TAXONOMY_INFO_KEYS:
+            if info_key in extra_info:
+                extra_info[info_key] = [x for x in extra_info[info_key].split(",") if x]
+
+        return extra_info
+
+    def get_post_data(self) -> dict:
+        post_data = self.helper.generate_film_data(
+            title=self.film["title"],
+            description=self.film["description"],
+            post_type=self.post_type,
+            trailer_id=self.film["trailer_id"],
+            fondo_player=self.film["cover_src"],
+            poster_url=self.film["cover_src"],
+            extra_info=self.get_extra_info(),
+        )
+        post_data.setdefault("serie_vote_average", "")
+        post_data.setdefault("episode_run_time", "")
+
+        return post_data
+
+    def find_post(self, title: str, post_type: str) -> int:
+        be_post = self.helper.db.select_with_data(
+            f"SELECT ID FROM {self.helper.db.table_prefix}posts "
+            "WHERE post_name=%s AND post_type=%s LIMIT 1",
+            (slugify(self.helper.format_slug(title)), post_type),
+        )
+        return be_post[0][0] if be_post else 0
+
+    def find_episode_slugs(self, titles: list) -> set:
+        # Slugs of the film's episodes that already exist, one query per film
+        slugs = [slugify(self.helper.format_slug(title)) for title in titles]
+        if not slugs:
+            return set()
+
+        return {
+            post_name
+            for post_name, in self.helper.db.select_with_data(
+                f"SELECT post_name FROM {self.helper.db.table_prefix}posts "
+                f"WHERE post_type=%s AND post_name IN ({', '.join(['%s'] * len(slugs))})",
+                tuple(["episodes"] + slugs),
+            )
+        }
+
+    def get_season_number(self, season_str: str) -> int:
+        match = re.search(r"season\s+(\d+)", season_str.lower())
+        return int(match.group(1)) if match else 1
+
+    def insert_episodes(self, post_id: int):
+        tmdb_id = self.episodes.get("tmdb_id", "0")
+        episodes = []
+        for key, value in self.episodes.items():
+            if "season" not in key.lower():
+                continue
+
+            season_number = self.get_season_number(key)
+            for episode_number, episode_title in value.items():
+                if not str(episode_number).isdigit():
+                    continue
+
+                title = f"{self.film['title']} {season_number}x{episode_number}"
+                episodes.append((title, season_number, episode_number, episode_title))
+
+        existing = self.find_episode_slugs([title for title, *_ in episodes])
+        for title, season_number, episode_number, episode_title in episodes:
+            slug = slugify(self.helper.format_slug(title))
+            if slug in existing:
+                continue
+
+            existing.add(slug)
+
+            logging.info(f"Inserting DooPlay episode {title}")
+            self.helper.insert_episode(
+                {
+                    **self.helper.generate_episode_data(
+                        post_id=post_id,
+                        episode_name=episode_title or title,
+                        season_number=season_number,
+                        episode_number=int(episode_number) - 1,
+                        post_title=self.film["title"],
+                        fondo_player=self.film["cover_src"],
+                        poster_url=self.film["cover_src"],
+                        quality=self.film.get("quality", "HD"),
+                        episode_links=[
+                            f"https://www.2embed.to/embed/tmdb/tv?id={tmdb_id}&s={season_number}&e={episode_number}"
+                        ],
+                    ),
+                    "title": title,
+                }
+            )
+            self.new_episodes += 1
+
+    def insert_film(self, throttle: bool = True):
+        post_id = self.find_post(self.film["title"], self.post_type)
+        if not post_id:
+            post_id = self.helper.insert_film(self.get_post_data())
+            if not post_id:
+                return
+
+            if self.film["post_type"] != CONFIG.TYPE_TV_SHOWS:
+                self.helper.insert_postmeta(
+                    self.helper.generate_players_postmeta_data(
+                        post_id,
+                        self.helper.get_players_iframes(
+                            [
+                                f"https://www.2embed.to/embed/tmdb/movie?id={self.episodes.get('tmdb_id', '0')}"
+                            ]
+                        ),
+                        self.film.get("quality", "HD"),
+                    )
+                    + [
+                        (post_id, "player", "1"),
+                        (post_id, "_player", "field_5640ccb223222"),
+                    ]
+                )
+
+        if self.film["post_type"] == CONFIG.TYPE_TV_SHOWS:
+            self.insert_episodes(post_id)
+
+            # Paces live crawls like Toronites.insert_film does
+            if throttle:
+                sleep(1)
+
+            return self.new_episodes
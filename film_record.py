@@ -0,0 +1,73 @@
+class LazyRecord(dict):
+    # A dict whose fields are extracted from the parsed page the first time
+    # they are read. `extractors` maps a key to a function computing it;
+    # `loader` computes the rest of the record (keys not known up front,
+    # like season titles) and runs when the record is iterated.
+    def __init__(self, data: dict = None, extractors: dict = None, loader=None):
+        super().__init__(data or {})
+        self.extractors = extractors or {}
+        self.loader = loader
+
+    def __missing__(self, key):
+        if key in self.extractors:
+            value = self.extractors[key]()
+            self[key] = value
+            return value
+
+        if self.loader:
+            self.load_all()
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key) or key in self.extractors:
+            return True
+        if self.loader:
+            self.load_all()
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def load_all(self):
+        for key, extractor in self.extractors.items():
+            if not dict.__contains__(self, key):
+                self[key] = extractor()
+        self.extractors = {}
+
+        if self.loader:
+            loader, self.loader = self.loader, None
+            for key, value in loader().items():
+                if not dict.__contains__(self, key):
+                    self[key] = value
+
+        return self
+
+    def keys(self):
+        self.load_all()
+        return super().keys()
+
+    def values(self):
+        self.load_all()
+        return super().values()
+
+    def items(self):
+        self.load_all()
+        return super().items()
+
+    def __iter__(self):
+        self.load_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self.load_all()
+        return super().__len__()
+
+    def __reduce__(self):
+        # Copies and pickles become plain dicts without the parsed page
+        return (dict, (dict(self.items()),))
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+
+from settings import CONFIG
+
+
+class FingerprintStore:
+    def __init__(self, state_file: str = ""):
+        self.state_file = state_file
+        self.state = {}
+        self.load()
+
+    def get_item_fingerprint(self, item: dict) -> str:
+        fd_infor = "|".join(x.strip() for x in item.get("fd_infor", []))
+        text = f"{item['href']}\t{item['quality'].strip()}\t{fd_infor}"
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get_block_fingerprint(self, items: list) -> str:
+        text = "\n".join(self.get_item_fingerprint(item) for item in items)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get_changed_items(self, block_key: str, items: list) -> list:
+        block_state = self.state.get(block_key, {})
+        if block_state.get("block") == self.get_block_fingerprint(items):
+            return []
+
+        item_fingerprints = block_state.get("items", {})
+        return [
+            item
+            for item in items
+            if item_fingerprints.get(item["slug"]) != self.get_item_fingerprint(item)
+        ]
+
+    def commit_item(self, block_key: str, item: dict):
+        block_state = self.state.setdefault(block_key, {"block": "", "items": {}})
+        block_state["items"][item["slug"]] = self.get_item_fingerprint(item)
+
+    def commit_block(self, block_key: str, items: list):
+        # Only items still listed are kept, and the block fingerprint is only
+        # recorded once every item in it made it through, so failed items
+        # are retried on the next cycle.
+        block_state = self.state.setdefault(block_key, {"block": "", "items": {}})
+        item_fingerprints = {
+            item["slug"]: block_state["items"][item["slug"]]
+            for item in items
+            if item["slug"] in block_state["items"]
+        }
+        block_state["items"] = item_fingerprints
+
+        is_complete = all(
+            item_fingerprints.get(item["slug"]) == self.get_item_fingerprint(item)
+            for item in items
+        )
+        block_state["block"] = self.get_block_fingerprint(items) if is_complete else ""
+
+    def load(self):
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return
+
+        with open(self.state_file) as f:
+            self.state = json.load(f)
+
+    def save(self):
+        if not self.state_file:
+            return
+
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+
+
+def get_fingerprint_store() -> FingerprintStore:
+    return FingerprintStore(
+        getattr(CONFIG, "HOMEPAGE_FINGERPRINT_FILE", "homepage_fingerprints.json")
+    )
@@ -1,25 +1,61 @@
+import logging
 from datetime import datetime, timedelta
 from pathlib import Path
-from time import sleep
+from urllib.parse import urlparse
 
 import requests
 from bs4 import BeautifulSoup
 from slugify import slugify
 
 from _db import database
+from browser_pool import BrowserPool, get_browser_pool, is_challenge_page
+from circuit_breaker import breakers
+from cookie_jar import SharedCookieJar, get_cookie_jar
+from detail_page import DetailPage
 from settings import CONFIG
 
 
 class Helper:
-    def get_header(self):
+    def __init__(
+        self,
+        browser_pool: BrowserPool = None,
+        cookie_jar: SharedCookieJar = None,
+        db=None,
+    ):
+        self.db = db or database
+        self.session = requests.Session()
+        self.browser_pool = browser_pool if browser_pool else get_browser_pool()
+        self.cookie_jar = cookie_jar if cookie_jar else get_cookie_jar()
+        self.user_agent = "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E150"  # noqa: E501
+
+    def start_browsers(self):
+        # Chrome is started and warmed before the first challenge instead of
+        # in the middle of it
+        if not self.browser_pool:
+            return
+
+        try:
+            self.browser_pool.warm_up()
+        except Exception as e:
+            self.error_log(
+                msg=f"Failed to start browsers\n{e}",
+                log_file="helper.start_browsers.log",
+            )
+
+    def close_browsers(self):
+        if self.browser_pool:
+            self.browser_pool.close()
+
+    def get_header(self, clearance: dict = None):
         header = {
-            "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E150",  # noqa: E501
+            "User-Agent": clearance["user_agent"] if clearance else self.user_agent,
             "Accept-Encoding": "gzip, deflate",
-            # "Cookie": CONFIG.COOKIE,
             "Cache-Control": "max-age=0",
             "Accept-Language": "vi-VN",
-            "Referer": "https://mangabuddy.com/",
+            "Referer": CONFIG.TINYZONETV_HOMEPAGE,
         }
+        if not clearance and getattr(CONFIG, "COOKIE", ""):
+            header["Cookie"] = CONFIG.COOKIE
         return header
 
     def error_log(self, msg: str, log_file: str = "failed.log"):
@@ -28,8 +64,79 @@ class Helper:
         with open(f"log/{log_file}", "a") as f:
             print(f"{datetime_msg} LOG:  {msg}\n{'-' * 80}", file=f)
 
-    def download_url(self, url):
-        return requests.get(url, headers=self.get_header())
+    def get_with_clearance(self, url: str, clearance: dict, stream: bool = False):
+        return self.session.get(
+            url,
+            headers=self.get_header(clearance),
+            cookies=clearance["cookies"] if clearance else None,
+            stream=stream,
+        )
+
+    def is_challenge(self, response, stream: bool = False) -> bool:
+        # A streamed body is only read here when it may be a challenge page,
+        # anything else is left for the caller to read from response.raw
+        if stream and "html" not in response.headers.get("Content-Type", ""):
+            return False
+        return is_challenge_page(response.status_code, response.text)
+
+    def download_url(self, url, stream: bool = False):
+        # Cookies are read from the shared jar on every request, so a
+        # challenge solved by any crawler process is picked up here too
+        host = urlparse(url).hostname
+        host_breaker = breakers.get(f"host:{host}")
+        host_breaker.wait()
+
+        try:
+            response = self.download_url_with_clearance(url, host, stream)
+        except Exception:
+            host_breaker.record(False)
+            raise
+
+        host_breaker.record(
+            response.status_code < 500 and not self.is_challenge(response, stream)
+        )
+        return response
+
+    def download_url_with_clearance(self, url, host, stream: bool = False):
+        clearance = self.cookie_jar.get(host)
+        response = self.get_with_clearance(url, clearance, stream)
+        if not self.is_challenge(response, stream):
+            return response
+
+        with self.cookie_jar.solving(host):
+            fresh_clearance = self.cookie_jar.get(host)
+            if fresh_clearance and (
+                not clearance or fresh_clearance["updated_at"] > clearance["updated_at"]
+            ):
+                # Solved by another process while we were waiting
+                response = self.get_with_clearance(url, fresh_clearance, stream)
+                if not self.is_challenge(response, stream):
+                    return response
+
+            if self.browser_pool:
+                logging.info(f"Challenge page, retrying with browser: {url}")
+                response = self.download_url_with_browser(url, host, response)
+
+        return response
+
+    def download_url_with_browser(self, url, host, response):
+        try:
+            html, cookies, user_agent = self.browser_pool.fetch(url)
+        except Exception as e:
+            self.error_log(
+                msg=f"Browser fallback failed: {url}\n{e}",
+                log_file="helper.download_url_with_browser.log",
+            )
+            return response
+
+        self.cookie_jar.put(host, cookies, user_agent)
+
+        browser_response = requests.Response()
+        browser_response.status_code = 200
+        browser_response.url = url
+        browser_response.encoding = "utf-8"
+        browser_response._content = html.encode("utf-8")
+        return browser_response
 
     def format_text(self, text: str) -> str:
         return text.strip("\n").replace('"', "'").strip().replace("’", "'")
@@ -46,11 +153,9 @@ class Helper:
 
         return url
 
-    def get_trailer_id(self, soup: BeautifulSoup) -> str:
+    def get_trailer_id(self, page: DetailPage) -> str:
         try:
-            modaltrailer = soup.find("div", {"id": "modaltrailer"})
-            iframe = modaltrailer.find("iframe")
-            data_src = iframe.get("data-src")
+            data_src = page.trailer_iframe.get("data-src")
             trailer_id = data_src.split("/")[-1]
             return trailer_id
         except:
@@ -107,11 +212,10 @@ class Helper:
             self.get_season_number(self.format_text(season_number)),
         ]
 
-    def get_title(self, href: str, detail_page_infor: BeautifulSoup) -> str:
+    @breakers.extractor("get_title")
+    def get_title(self, href: str, page: DetailPage) -> str:
         try:
-            heading_name = detail_page_infor.find(
-                "h2", class_="heading-name"
-            ).text.strip("\n")
+            heading_name = page.heading.text.strip("\n")
             return heading_name
         except Exception as e:
             self.error_log(
@@ -120,13 +224,9 @@ class Helper:
             )
             return ""
 
-    def get_description(self, href: str, detail_page_infor: BeautifulSoup) -> str:
+    def get_description(self, href: str, page: DetailPage) -> str:
         try:
-            description = (
-                detail_page_infor.find("div", class_="description")
-                .text.strip("\n")
-                .strip()
-            )
+            description = page.description.text.strip("\n").strip()
             return description
         except Exception as e:
             self.error_log(
@@ -152,10 +252,10 @@ class Helper:
             )
             return ["", ""]
 
-    def get_cover_url(self, href: str, detail_page_infor: BeautifulSoup) -> str:
+    @breakers.extractor("get_cover_url")
+    def get_cover_url(self, href: str, page: DetailPage) -> str:
         try:
-            film_poster_img = detail_page_infor.find("img", class_="film-poster-img")
-            return film_poster_img.get("src")
+            return page.poster.get("src")
 
         except Exception as e:
             self.error_log(
@@ -194,23 +294,22 @@ class Helper:
             res["Duration"] = res["Duration"].replace("min", "").strip()
         return res
 
-    def get_imdb_score(self, detail_page_infor: BeautifulSoup) -> str:
+    def get_imdb_score(self, page: DetailPage) -> str:
         try:
-            dp_i_stats = detail_page_infor.find("div", class_="dp-i-stats")
-            btn_imdb = dp_i_stats.find("button", class_="btn-imdb")
             imdb = (
-                btn_imdb.text.strip("\n").lower().replace("IMDB:".lower(), "").strip()
+                page.imdb_button.text.strip("\n")
+                .lower()
+                .replace("IMDB:".lower(), "")
+                .strip()
             )
             return imdb
         except:
             return ""
 
-    def get_extra_info(self, detail_page_infor: BeautifulSoup) -> dict:
-        extra_info = {"IMDB": self.get_imdb_score(detail_page_infor=detail_page_infor)}
+    def get_extra_info(self, page: DetailPage) -> dict:
+        extra_info = {"IMDB": self.get_imdb_score(page=page)}
         try:
-            elements = detail_page_infor.find("div", class_="elements")
-            row_lines = elements.find_all("div", class_="row-line")
-            for row_line in row_lines:
+            for row_line in page.row_lines:
                 key = row_line.find("strong").text
                 value = row_line.text.replace(key, "")
                 value = value.replace("\n", "")
@@ -321,28 +420,28 @@ class Helper:
             term_name = self.format_condition_str(term)
             cols = "tt.term_taxonomy_id"
             table = (
-                f"{CONFIG.TABLE_PREFIX}term_taxonomy tt, {CONFIG.TABLE_PREFIX}terms t"
+                f"{self.db.table_prefix}term_taxonomy tt, {self.db.table_prefix}terms t"
             )
             condition = f't.name = "{term_name}" AND tt.term_id=t.term_id AND tt.taxonomy="{taxonomy}"'
 
-            be_term = database.select_all_from(
+            be_term = self.db.select_all_from(
                 table=table, condition=condition, cols=cols
             )
             if not be_term:
-                term_id = database.insert_into(
-                    table=f"{CONFIG.TABLE_PREFIX}terms",
+                term_id = self.db.insert_into(
+                    table=f"{self.db.table_prefix}terms",
                     data=(term, slugify(term), 0),
                 )
-                term_taxonomy_id = database.insert_into(
-                    table=f"{CONFIG.TABLE_PREFIX}term_taxonomy",
+                term_taxonomy_id = self.db.insert_into(
+                    table=f"{self.db.table_prefix}term_taxonomy",
                     data=(term_id, taxonomy, "", 0, 0),
                 )
             else:
                 term_taxonomy_id = be_term[0][0]
 
             try:
-                database.insert_into(
-                    table=f"{CONFIG.TABLE_PREFIX}term_relationships",
+                self.db.insert_into(
+                    table=f"{self.db.table_prefix}term_relationships",
                     data=(post_id, term_taxonomy_id, 0),
                 )
             except:
@@ -378,7 +477,7 @@ class Helper:
 
     def insert_post(self, post_data: dict) -> int:
         data = self.generate_post(post_data)
-        post_id = database.insert_into(table=f"{CONFIG.TABLE_PREFIX}posts", data=data)
+        post_id = self.db.insert_into(table=f"{self.db.table_prefix}posts", data=data)
         return post_id
 
     def insert_film(self, post_data: dict) -> int:
@@ -453,29 +552,50 @@ class Helper:
         except Exception as e:
             self.error_log(f"Failed to insert film\n{e}")
 
-    def update_meta_key(self, post_id, meta_key, update_value, field) -> list:
-        condition = f'post_id={post_id} AND meta_key="{meta_key}"'
-        post_temporadas_episodios = database.select_all_from(
-            table=f"{CONFIG.TABLE_PREFIX}postmeta", condition=condition
-        )
-        if post_temporadas_episodios:
-            value = int(post_temporadas_episodios[0][-1])
-            if value < update_value:
-                database.update_table(
-                    table=f"{CONFIG.TABLE_PREFIX}postmeta",
-                    set_cond=f"meta_value={update_value}",
-                    where_cond=condition,
+    def update_meta_keys(self, post_id, counters: list) -> list:
+        # counters: [(meta_key, update_value, field)]. All of them are read
+        # with one SELECT and the ones that grew are raised with one UPDATE;
+        # the rows of missing counters are returned to be inserted.
+        table = f"{self.db.table_prefix}postmeta"
+        meta_keys = [meta_key for meta_key, _, _ in counters]
+        keys_placeholder = ", ".join(["%s"] * len(meta_keys))
+
+        be_values = {}
+        for meta_key, meta_value in self.db.select_with_data(
+            f"SELECT meta_key, meta_value FROM {table} "
+            f"WHERE post_id=%s AND meta_key IN ({keys_placeholder})",
+            (post_id, *meta_keys),
+        ):
+            be_values.setdefault(meta_key, meta_value)
+
+        res = []
+        updates = []
+        for meta_key, update_value, field in counters:
+            if meta_key not in be_values:
+                res.extend(
+                    [
+                        (post_id, meta_key, update_value),
+                        (post_id, f"_{meta_key}", field),
+                    ]
                 )
-            return []
-        else:
-            return [
-                (
+            elif int(be_values[meta_key]) < update_value:
+                updates.append((meta_key, update_value))
+
+        if updates:
+            self.db.update_table(
+                table=table,
+                set_cond="meta_value = CASE meta_key "
+                + " ".join(["WHEN %s THEN %s"] * len(updates))
+                + " END",
+                where_cond=f"post_id=%s AND meta_key IN ({', '.join(['%s'] * len(updates))})",
+                data=(
+                    *[value for update in updates for value in update],
                     post_id,
-                    meta_key,
-                    update_value,
+                    *[meta_key for meta_key, _ in updates],
                 ),
-                (post_id, f"_{meta_key}", field),
-            ]
+            )
+
+        return res
 
     def generate_players_postmeta_data(
         self, episode_id, players: list, quality: str
@@ -547,20 +667,16 @@ class Helper:
         ]
 
         postmeta_data.extend(
-            self.update_meta_key(
+            self.update_meta_keys(
                 post_id=episode_data["post_id"],
-                meta_key="temporadas",
-                update_value=season_number,
-                field="field_58718d88c2bf9",
-            )
-        )
-
-        postmeta_data.extend(
-            self.update_meta_key(
-                post_id=episode_data["post_id"],
-                meta_key=f"temporadas_{season_number - 1}_episodios",
-                update_value=episode_number + 1,
-                field="field_58718dabc2bfa",
+                counters=[
+                    ("temporadas", season_number, "field_58718d88c2bf9"),
+                    (
+                        f"temporadas_{season_number - 1}_episodios",
+                        episode_number + 1,
+                        "field_58718dabc2bfa",
+                    ),
+                ],
             )
         )
 
@@ -570,22 +686,18 @@ class Helper:
             )
         )
 
-        for row in postmeta_data:
-            database.insert_into(
-                table=f"{CONFIG.TABLE_PREFIX}postmeta",
-                data=row,
-            )
-            sleep(0.01)
-
-        sleep(0.01)
+        self.insert_postmeta(postmeta_data)
 
     def insert_postmeta(self, postmeta_data):
-        for row in postmeta_data:
-            database.insert_into(
-                table=f"{CONFIG.TABLE_PREFIX}postmeta",
-                data=row,
-            )
-            sleep(0.01)
+        # One multi-row INSERT, rows keep their order and so their meta_ids
+        if not postmeta_data:
+            return
+
+        self.db.insert_into(
+            table=f"{self.db.table_prefix}postmeta",
+            data=postmeta_data,
+            is_bulk=True,
+        )
 
 
 helper = Helper()
@@ -0,0 +1,139 @@
+import logging
+
+from _db import Database, database, get_target_database
+from settings import CONFIG
+from toronites import TMDB_ID_KEY
+
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+
+
+def get_trglinks_tmdb_id(column: str) -> str:
+    # The TMDB ID of a 2embed trglinks value: the link is base64 inside the
+    # PHP-serialized link data, with the ID in its ?id= parameter
+    link = (
+        "CONVERT(FROM_BASE64(SUBSTRING_INDEX(SUBSTRING_INDEX(SUBSTRING_INDEX("
+        f"""{column}, 's:4:"link";s:', -1), '"', 2), '"', -1)) USING utf8mb4)"""
+    )
+    return f"SUBSTRING_INDEX(SUBSTRING_INDEX({link}, '?id=', -1), '&', 1)"
+
+
+def get_migrations(prefix: str) -> list:
+    return [
+        (
+            "0001_crawler_keys",
+            [
+                # One row per crawled post slug / term slug. The primary key is
+                # what makes concurrent get-or-create safe: whoever inserts the
+                # row first creates the WordPress object, everyone else waits
+                # for object_id to be filled in.
+                f"""
+                CREATE TABLE IF NOT EXISTS {prefix}crawler_keys (
+                    key_type VARCHAR(64) NOT NULL,
+                    key_name VARCHAR(200) NOT NULL,
+                    object_id BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                        ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (key_type, key_name)
+                ) DEFAULT CHARSET=utf8mb4
+                """,
+                f"""
+                INSERT IGNORE INTO {prefix}crawler_keys (key_type, key_name, object_id)
+                SELECT CONCAT('post:', post_type), post_name, MIN(ID)
+                FROM {prefix}posts
+                WHERE post_type IN ('{CONFIG.TYPE_TV_SHOWS}', '{CONFIG.TYPE_MOVIE}')
+                GROUP BY post_type, post_name
+                """,
+                f"""
+                INSERT IGNORE INTO {prefix}crawler_keys (key_type, key_name, object_id)
+                SELECT CONCAT('term:', tt.taxonomy), t.slug, MIN(tt.term_taxonomy_id)
+                FROM {prefix}terms t
+                JOIN {prefix}term_taxonomy tt ON tt.term_id = t.term_id
+                GROUP BY tt.taxonomy, t.slug
+                """,
+            ],
+        ),
+        (
+            "0002_tmdb_id_index",
+            [
+                f"""
+                ALTER TABLE {prefix}postmeta
+                ADD INDEX crawler_meta_value (meta_key(32), meta_value(32))
+                """,
+                # Films imported before the TMDB ID was recorded: movies carry
+                # their player links, shows have them on their episodes
+                f"""
+                INSERT INTO {prefix}postmeta (post_id, meta_key, meta_value)
+                SELECT post_id, '{TMDB_ID_KEY}', MIN(tmdb_id) FROM (
+                    SELECT pm.post_id, {get_trglinks_tmdb_id("pm.meta_value")} AS tmdb_id
+                    FROM {prefix}postmeta pm
+                    WHERE pm.meta_key = 'trglinks_0'
+                    AND LOCATE('s:4:"link"', pm.meta_value) > 0
+                ) links
+                WHERE tmdb_id REGEXP '^[1-9][0-9]*$'
+                AND post_id NOT IN (
+                    SELECT post_id FROM {prefix}postmeta
+                    WHERE meta_key = '{TMDB_ID_KEY}'
+                )
+                GROUP BY post_id
+                """,
+                f"""
+                INSERT INTO {prefix}postmeta (post_id, meta_key, meta_value)
+                SELECT post_id, '{TMDB_ID_KEY}', MIN(tmdb_id) FROM (
+                    SELECT CAST(tp.meta_value AS UNSIGNED) AS post_id,
+                        {get_trglinks_tmdb_id("tm.meta_value")} AS tmdb_id
+                    FROM {prefix}termmeta tm
+                    JOIN {prefix}termmeta tp
+                        ON tp.term_id = tm.term_id AND tp.meta_key = 'tr_id_post'
+                    WHERE tm.meta_key = 'trglinks_0'
+                    AND LOCATE('s:4:"link"', tm.meta_value) > 0
+                ) links
+                WHERE tmdb_id REGEXP '^[1-9][0-9]*$'
+                AND post_id NOT IN (
+                    SELECT post_id FROM {prefix}postmeta
+                    WHERE meta_key = '{TMDB_ID_KEY}'
+                )
+                GROUP BY post_id
+                """,
+            ],
+        ),
+    ]
+
+
+def get_applied_migrations(db: Database) -> list:
+    db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {db.table_prefix}crawler_migrations (
+            name VARCHAR(191) NOT NULL PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) DEFAULT CHARSET=utf8mb4
+        """
+    )
+    return [
+        row[0]
+        for row in db.select_with(
+            f"SELECT name FROM {db.table_prefix}crawler_migrations"
+        )
+    ]
+
+
+def migrate(db: Database = None):
+    db = db or database
+    applied_migrations = get_applied_migrations(db)
+    for name, queries in get_migrations(db.table_prefix):
+        if name in applied_migrations:
+            continue
+
+        logging.info(f"Applying migration {name} to {db.table_prefix}")
+        for query in queries:
+            db.execute(query)
+        db.execute(
+            f"INSERT INTO {db.table_prefix}crawler_migrations (name) VALUES (%s)",
+            (name,),
+        )
+
+
+if __name__ == "__main__":
+    migrate()
+    # Every fan-out writer target keeps its own crawler tables
+    for target in getattr(CONFIG, "WRITER_TARGETS", []):
+        migrate(get_target_database(target))
@@ -0,0 +1,90 @@
+import sys
+
+# Compact records for films waiting in memory (writer pool queue, backfills).
+# The crawler and Toronites keep exchanging plain dicts; these are only built
+# at the queue edges with Film.from_data() and turned back with to_data().
+# Building one extracts every lazy field of the crawl result, ~0.25ms a film
+# more than a known show needs next to ~6ms of parsing (bench_models.py),
+# while keeping the fields lazy would keep the parsed page (~165KiB) alive
+# for as long as the film is queued.
+
+FILM_FIELDS = (
+    "title",
+    "slug",
+    "post_type",
+    "quality",
+    "description",
+    "trailer_id",
+    "cover_src",
+)
+
+
+class Season:
+    # Episode numbers and titles are kept as two parallel tuples rather than
+    # one object per episode; episode numbers repeat across every show, so
+    # they share one string each.
+    __slots__ = ("title", "numbers", "titles")
+
+    def __init__(self, title: str, numbers: tuple, titles: tuple):
+        self.title = sys.intern(title) if isinstance(title, str) else title
+        self.numbers = numbers
+        self.titles = titles
+
+    @classmethod
+    def from_data(cls, title: str, episodes_data: dict):
+        return cls(
+            title,
+            tuple(
+                sys.intern(number) if isinstance(number, str) else number
+                for number in episodes_data.keys()
+            ),
+            tuple(episodes_data.values()),
+        )
+
+    def to_data(self) -> dict:
+        return dict(zip(self.numbers, self.titles))
+
+    def __repr__(self):
+        return f"Season({self.title!r}, {len(self.numbers)} episodes)"
+
+
+class Film:
+    __slots__ = FILM_FIELDS + ("extra_info", "tmdb_id", "seasons")
+
+    def __init__(self, **kwargs):
+        for field in self.__slots__:
+            setattr(self, field, kwargs.get(field))
+
+    @classmethod
+    def from_data(cls, film_data: dict, episodes_data: dict):
+        film = cls(**{field: film_data.get(field) for field in FILM_FIELDS})
+        extra_info = film_data.get("extra_info") or {}
+        film.extra_info = tuple(
+            (sys.intern(key), value) for key, value in extra_info.items()
+        )
+        film.tmdb_id = episodes_data.get("tmdb_id")
+        film.seasons = tuple(
+            Season.from_data(key, value)
+            for key, value in episodes_data.items()
+            if key != "tmdb_id"
+        )
+        return film
+
+    def to_data(self) -> tuple:
+        film_data = {
+            field: getattr(self, field)
+            for field in FILM_FIELDS
+            if getattr(self, field) is not None
+        }
+        film_data["extra_info"] = dict(self.extra_info or ())
+
+        episodes_data = {}
+        if self.tmdb_id is not None:
+            episodes_data["tmdb_id"] = self.tmdb_id
+        for season in self.seasons or ():
+            episodes_data[season.title] = season.to_data()
+
+        return film_data, episodes_data
+
+    def __repr__(self):
+        return f"Film({self.post_type!r}, {self.slug!r})"
@@ -0,0 +1,138 @@
+import argparse
+import logging
+import time
+
+from _queue import Heartbeat, PermanentJobError, get_queue, get_worker_id
+from base import Crawler
+from helper import helper
+from settings import CONFIG
+
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+
+JOB_PAGE = "page"
+JOB_FILM = "film"
+
+crawler = Crawler()
+queue = get_queue()
+
+LISTINGS = {
+    CONFIG.TYPE_TV_SHOWS: (
+        CONFIG.TINYZONETV_TVSHOWS_PAGE,
+        CONFIG.TINYZONETV_TVSHOWS_LAST_PAGE,
+    ),
+    CONFIG.TYPE_MOVIE: (
+        CONFIG.TINYZONETV_MOVIES_PAGE,
+        CONFIG.TINYZONETV_MOVIES_LAST_PAGE,
+    ),
+}
+
+
+def seed(post_type: str, first_page: int = 1, last_page: int = 0):
+    listing_url, listing_last_page = LISTINGS[post_type]
+    last_page = last_page or listing_last_page
+    for page in range(first_page, last_page + 1):
+        url = f"{listing_url}?page={page}"
+        queue.enqueue(
+            JOB_PAGE,
+            f"{JOB_PAGE}:{url}",
+            {"url": url, "post_type": post_type},
+            refresh=True,
+        )
+    logging.info(f"Seeded {post_type} pages {first_page}..{last_page}")
+
+
+def process_page(payload: dict):
+    post_type = payload["post_type"]
+    for flw_item in crawler.get_flw_items(payload["url"]):
+        item = crawler.parse_flw_item(flw_item=flw_item, post_type=post_type)
+        # Keyed by slug so a title listed on several pages, or by several
+        # workers at once, is only ever crawled and written by one of them.
+        # Titles finished in an earlier sweep are crawled again for updates.
+        queue.enqueue(
+            JOB_FILM,
+            f"{JOB_FILM}:{post_type}:{item['slug']}",
+            item,
+            priority=1,
+            refresh=True,
+        )
+
+
+def process_film(payload: dict):
+    crawled = crawler.crawl_film(**payload)
+    if not crawled:
+        raise PermanentJobError(f"No title found at {payload['href']}")
+
+    crawler.save_film(*crawled)
+
+
+def process(job):
+    if job.kind == JOB_PAGE:
+        process_page(job.payload)
+    elif job.kind == JOB_FILM:
+        process_film(job.payload)
+    else:
+        raise ValueError(f"Unknown job kind: {job.kind}")
+
+
+def run_job(job):
+    logging.info(f"Leased {job}")
+    try:
+        with Heartbeat(queue, job, queue.lease_seconds / 3) as heartbeat:
+            process(job)
+        if heartbeat.lost:
+            logging.info(f"Lease lost for {job}, another worker took it over")
+            return
+        queue.complete(job)
+    except Exception as e:
+        helper.error_log(
+            msg=f"Job failed: {job}\n{e}", log_file="queue_worker.failed.log"
+        )
+        queue.fail(job, error=str(e), retry=not isinstance(e, PermanentJobError))
+
+
+def work(worker_id: str, idle_sleep: float = 5):
+    logging.info(f"Worker {worker_id} started")
+    while True:
+        job = queue.lease(worker_id)
+        if not job:
+            time.sleep(idle_sleep)
+            continue
+
+        run_job(job)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("init")
+
+    seed_parser = subparsers.add_parser("seed")
+    seed_parser.add_argument(
+        "post_type", choices=[CONFIG.TYPE_TV_SHOWS, CONFIG.TYPE_MOVIE]
+    )
+    seed_parser.add_argument("--first-page", type=int, default=1)
+    seed_parser.add_argument("--last-page", type=int, default=0)
+
+    work_parser = subparsers.add_parser("work")
+    work_parser.add_argument("--worker-id", default=get_worker_id())
+
+    subparsers.add_parser("stats")
+
+    args = parser.parse_args()
+    if args.command == "init":
+        queue.create_table()
+    elif args.command == "seed":
+        seed(args.post_type, args.first_page, args.last_page)
+    elif args.command == "work":
+        helper.start_browsers()
+        try:
+            work(args.worker_id)
+        finally:
+            helper.close_browsers()
+    elif args.command == "stats":
+        print(queue.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import logging
+
+from crawl_store import CrawlStore
+from settings import CONFIG
+from toronites import helper
+from writer_pool import (
+    AsyncFilmWriter,
+    exit_on_sigterm,
+    get_async_writer,
+    get_writer_pool,
+)
+
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+
+
+def log_failed(record: dict, e: Exception):
+    helper.error_log(
+        msg=f"Failed to replay {record['film'].get('slug')}\n{e}",
+        log_file="replay.failed.log",
+    )
+
+
+def iter_replay_records(args):
+    store = CrawlStore(args.folder)
+    if args.slug:
+        for slug in args.slug:
+            record = store.get(slug, post_type=args.post_type)
+            if not record:
+                logging.info(f"Not in store: {slug}")
+                continue
+            yield record
+        return
+
+    for i, record in enumerate(store.iter_records(latest_only=not args.all_versions)):
+        yield record
+        if (i + 1) % 100 == 0:
+            logging.info(f"Replayed {i + 1} records")
+
+
+def replay(args, writer):
+    for record in iter_replay_records(args):
+        try:
+            writer.submit(record["film"], record["episodes"])
+        except Exception as e:
+            log_failed(record, e)
+
+
+async def replay_record_async(record: dict, writer: AsyncFilmWriter):
+    try:
+        await writer.write(record["film"], record["episodes"])
+    except Exception as e:
+        log_failed(record, e)
+
+
+async def replay_async(args, writer: AsyncFilmWriter):
+    # Records are read from the store as write slots free up, so only about
+    # `workers` films are decoded at a time however large the store is
+    async with writer:
+        pending = set()
+        for record in iter_replay_records(args):
+            if len(pending) >= writer.workers:
+                _, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+            pending.add(asyncio.ensure_future(replay_record_async(record, writer)))
+        if pending:
+            await asyncio.wait(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", help="Crawl store folder")
+    parser.add_argument("--slug", action="append", default=[])
+    parser.add_argument(
+        "--post-type",
+        choices=[CONFIG.TYPE_TV_SHOWS, CONFIG.TYPE_MOVIE],
+        default=CONFIG.TYPE_TV_SHOWS,
+    )
+    parser.add_argument(
+        "--all-versions",
+        action="store_true",
+        help="Replay every stored crawl instead of only the latest per title",
+    )
+    args = parser.parse_args()
+
+    exit_on_sigterm()
+    writer = get_writer_pool(throttle=False)
+    if writer:
+        with writer:
+            replay(args, writer)
+    else:
+        # No pool configured: several films at a time on one event loop
+        asyncio.run(replay_async(args, get_async_writer(throttle=False)))
+
+
+if __name__ == "__main__":
+    main()
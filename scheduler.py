@@ -0,0 +1,183 @@
+import json
+import math
+import os
+import time
+
+from settings import CONFIG
+
+
+class ScheduledItem:
+    def __init__(self, post_type: str, item: dict):
+        self.post_type = post_type
+        self.item = item
+        self.position = -1
+        self.position_churn = 0.0
+        self.last_seen = 0.0
+        self.last_crawled = 0.0
+        self.last_new_episodes = 0.0
+        self.next_due = 0.0
+
+    @property
+    def key(self) -> str:
+        return f"{self.post_type}:{self.item['slug']}"
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        scheduled = cls(data["post_type"], data["item"])
+        scheduled.__dict__.update(data)
+        return scheduled
+
+
+class UpdateScheduler:
+    def __init__(
+        self,
+        requests_per_minute: int = 30,
+        min_interval: int = 5 * 60,
+        max_interval: int = 24 * 60 * 60,
+        hot_half_life: int = 2 * 24 * 60 * 60,
+        forget_after: int = 7 * 24 * 60 * 60,
+        state_file: str = "",
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.hot_half_life = hot_half_life
+        self.forget_after = forget_after
+        self.state_file = state_file
+        self.items = {}
+        self.tokens = float(requests_per_minute)
+        self.tokens_updated = time.time()
+        self.load()
+
+    def get_priority(self, scheduled: ScheduledItem, now: float) -> float:
+        # 0..1: shows that gained episodes recently and that keep moving on
+        # the homepage (i.e. are being updated) are the hot ones.
+        recency = 0.0
+        if scheduled.last_new_episodes:
+            age = now - scheduled.last_new_episodes
+            recency = math.pow(0.5, age / self.hot_half_life)
+        churn = min(scheduled.position_churn, 1.0)
+        return max(recency, churn)
+
+    def get_interval(self, scheduled: ScheduledItem, now: float) -> float:
+        # Geometric blend: hot items land near min_interval, cold near max
+        priority = self.get_priority(scheduled, now)
+        return self.max_interval * math.pow(
+            self.min_interval / self.max_interval, priority
+        )
+
+    def observe(self, post_type: str, items: list, changed_slugs: list = None):
+        now = time.time()
+        for position, item in enumerate(items):
+            scheduled = self.items.get(f"{post_type}:{item['slug']}")
+            if not scheduled:
+                scheduled = ScheduledItem(post_type, item)
+                self.items[scheduled.key] = scheduled
+            else:
+                if scheduled.position != position:
+                    scheduled.position_churn = 0.7 * scheduled.position_churn + 0.3
+                else:
+                    scheduled.position_churn *= 0.7
+                if changed_slugs is None:
+                    is_changed = item.get("fd_infor") != scheduled.item.get("fd_infor")
+                else:
+                    is_changed = item["slug"] in changed_slugs
+                if is_changed:
+                    # Listing text such as "EPS 12" changed, no need to wait
+                    scheduled.next_due = now
+                scheduled.item = item
+
+            scheduled.position = position
+            scheduled.last_seen = now
+
+        for key in [
+            key
+            for key, scheduled in self.items.items()
+            if now - scheduled.last_seen > self.forget_after
+        ]:
+            del self.items[key]
+
+    def refill(self, now: float):
+        elapsed = now - self.tokens_updated
+        self.tokens = min(
+            float(self.requests_per_minute),
+            self.tokens + elapsed * self.requests_per_minute / 60,
+        )
+        self.tokens_updated = now
+
+    def spend(self, requests: int = 1) -> bool:
+        self.refill(time.time())
+        if self.tokens < requests:
+            return False
+        self.tokens -= requests
+        return True
+
+    def take(self) -> list:
+        now = time.time()
+        self.refill(now)
+
+        due_items = [
+            scheduled for scheduled in self.items.values() if scheduled.next_due <= now
+        ]
+        due_items.sort(
+            key=lambda scheduled: (
+                -self.get_priority(scheduled, now),
+                scheduled.next_due,
+            )
+        )
+
+        res = []
+        for scheduled in due_items:
+            if self.tokens < 1:
+                break
+            self.tokens -= 1
+            res.append(scheduled)
+
+        return res
+
+    def mark_crawled(self, scheduled: ScheduledItem, new_episodes: int = 0):
+        now = time.time()
+        scheduled.last_crawled = now
+        if new_episodes:
+            scheduled.last_new_episodes = now
+        scheduled.next_due = now + self.get_interval(scheduled, now)
+
+    def defer(self, scheduled: ScheduledItem, seconds: float):
+        # Not crawled after all (e.g. another task just did), the request
+        # taken for it goes back to the budget
+        scheduled.next_due = time.time() + seconds
+        self.tokens = min(float(self.requests_per_minute), self.tokens + 1)
+
+    def load(self):
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return
+
+        with open(self.state_file) as f:
+            for data in json.load(f):
+                scheduled = ScheduledItem.from_dict(data)
+                self.items[scheduled.key] = scheduled
+
+    def save(self):
+        if not self.state_file:
+            return
+
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(
+                [scheduled.to_dict() for scheduled in self.items.values()],
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_file, self.state_file)
+
+
+def get_scheduler() -> UpdateScheduler:
+    return UpdateScheduler(
+        requests_per_minute=getattr(CONFIG, "UPDATE_REQUESTS_PER_MINUTE", 30),
+        min_interval=getattr(CONFIG, "UPDATE_MIN_INTERVAL", 5 * 60),
+        max_interval=getattr(CONFIG, "UPDATE_MAX_INTERVAL", 24 * 60 * 60),
+        state_file=getattr(CONFIG, "UPDATE_SCHEDULER_STATE_FILE", "scheduler.json"),
+    )
@@ -0,0 +1,296 @@
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+from base import Crawler
+from helper import helper
+from settings import CONFIG
+from writer_pool import exit_on_sigterm, get_writer_pool
+
+logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
+
+FILM_PATHS = ("/movie/", "/tv/")
+
+
+def parse_lastmod(text: str) -> float:
+    # W3C datetime: a bare date, or a datetime with an offset or "Z"
+    text = (text or "").strip()
+    if not text:
+        return 0.0
+
+    try:
+        lastmod = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+
+    if not lastmod.tzinfo:
+        lastmod = lastmod.replace(tzinfo=timezone.utc)
+    return lastmod.timestamp()
+
+
+def iter_sitemap_entries(f):
+    # Yields (kind, loc, lastmod) for every <sitemap> of an index or <url> of
+    # a urlset, parsed from a file object as it is read. Entries are dropped
+    # from the tree once read, so memory stays flat however many URLs a
+    # sitemap lists.
+    f = io.BufferedReader(f)
+    if f.peek(2)[:2] == b"\x1f\x8b":
+        # .xml.gz sitemaps, as opposed to gzip-encoded responses
+        f = gzip.GzipFile(fileobj=f)
+
+    root = None
+    for event, element in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+
+        kind = element.tag.rsplit("}", 1)[-1]
+        if kind not in ("sitemap", "url"):
+            continue
+
+        loc, lastmod = "", ""
+        for child in element:
+            child_tag = child.tag.rsplit("}", 1)[-1]
+            if child_tag == "loc":
+                loc = (child.text or "").strip()
+            elif child_tag == "lastmod":
+                lastmod = child.text or ""
+
+        root.clear()
+        if loc:
+            yield kind, loc, parse_lastmod(lastmod)
+
+
+class UrlSpool:
+    # Append-only file of URLs, one per line, read back from a byte offset,
+    # so a sweep's queue costs the same to keep whatever the catalog's size
+    def __init__(self, path: str):
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def append(self, urls: list):
+        with open(self.path, "a") as f:
+            f.writelines(url + "\n" for url in urls)
+
+    def read(self, offset: int, count: int) -> tuple:
+        # (up to count URLs from offset, offset after them)
+        urls = []
+        if not self.exists():
+            return urls, offset
+
+        with open(self.path) as f:
+            f.seek(offset)
+            while len(urls) < count:
+                line = f.readline()
+                if not line:
+                    break
+                if line.strip():
+                    urls.append(line.strip())
+            return urls, f.tell()
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
+
+
+class SitemapDiscovery:
+    # Finds new and changed titles from the sitemap index instead of paging
+    # through the listings. Only URLs whose <lastmod> is newer than the
+    # watermark of the last complete sweep are crawled; URLs without a
+    # <lastmod> are only picked up by the first sweep.
+    def __init__(self, crawler: Crawler, sitemap_url: str, state_file: str = ""):
+        self.crawler = crawler
+        self.sitemap_url = sitemap_url
+        self.state_file = state_file
+        self.state = {"watermark": 0.0}
+        self.last_crawled = 0
+        # A sweep's queued URLs, and the ones that failed to be retried by
+        # the next sweep, are spooled next to the state file
+        spool_base = state_file or os.path.join(tempfile.mkdtemp(), "sitemap")
+        self.pending = UrlSpool(f"{spool_base}.pending")
+        self.retry = UrlSpool(f"{spool_base}.retry")
+        self.load()
+
+    def is_film_url(self, url: str) -> bool:
+        homepage_host = urlparse(CONFIG.TINYZONETV_HOMEPAGE).hostname
+        parsed_url = urlparse(url)
+        return parsed_url.hostname == homepage_host and any(
+            path in parsed_url.path for path in FILM_PATHS
+        )
+
+    def read_sitemap(self, sweep: dict, sitemap_url: str):
+        # Queues the film URLs changed since the watermark; child sitemaps
+        # that didn't change since are not even downloaded. Duplicates are
+        # only dropped within a sitemap (at most 50,000 URLs); one listed by
+        # two sitemaps is crawled twice, or skipped by the daemon's
+        # recent-crawl check.
+        watermark = self.state["watermark"]
+        queued = set()
+        urls = []
+        try:
+            response = helper.download_url(sitemap_url, stream=True)
+            # Parsed while it downloads instead of buffering the whole body;
+            # a page from the browser fallback is already in memory
+            if response.raw is None:
+                f = io.BytesIO(response.content)
+            else:
+                f = response.raw
+                f.decode_content = True
+                # Left open at EOF for the buffered reader wrapping it
+                f.auto_close = False
+            with response:
+                for kind, loc, lastmod in iter_sitemap_entries(f):
+                    if kind == "sitemap":
+                        if not lastmod or lastmod > watermark:
+                            sweep["sitemaps"].append(loc)
+                    elif self.is_film_url(loc):
+                        if lastmod > watermark or (not lastmod and not watermark):
+                            # Lastmods are the site's clock, so the next
+                            # watermark is the newest one seen, not our own time
+                            sweep["next_watermark"] = max(
+                                sweep["next_watermark"], lastmod
+                            )
+                            if loc not in queued:
+                                queued.add(loc)
+                                urls.append(loc)
+                                if len(urls) >= 1000:
+                                    self.pending.append(urls)
+                                    urls = []
+        except Exception as e:
+            sweep["failed_sitemaps"] += 1
+            helper.error_log(
+                msg=f"Error reading sitemap {sitemap_url}\n{e}",
+                log_file="sitemap.read_sitemap.log",
+            )
+        self.pending.append(urls)
+
+    def crawl_url(self, href: str) -> bool:
+        try:
+            self.crawler.crawl_item(self.crawler.get_href_item(href))
+            return True
+        except Exception as e:
+            helper.error_log(
+                msg=f"Error crawl_item {href}\n{e}",
+                log_file="sitemap.crawl_url.log",
+            )
+            return False
+
+    def start_sweep(self) -> dict:
+        # Last sweep's failures are retried first. A pending spool that is
+        # already there belongs to a sweep that never got saved, it's kept.
+        if not self.pending.exists():
+            if self.retry.exists():
+                os.replace(self.retry.path, self.pending.path)
+            else:
+                self.pending.append([])
+        return {
+            "sitemaps": [self.sitemap_url],
+            "offset": 0,
+            "retry": 0,
+            "next_watermark": self.state["watermark"],
+            "failed_sitemaps": 0,
+            "crawled": 0,
+        }
+
+    def finish_sweep(self, sweep: dict):
+        logging.info(
+            f"Sitemap sweep crawled {sweep['crawled']} URLs, "
+            f"{sweep['retry']} to retry"
+        )
+        next_watermark = sweep["next_watermark"]
+        if sweep["failed_sitemaps"]:
+            # URLs of unread sitemaps must still count as changed next time
+            next_watermark = self.state["watermark"]
+        self.state = {"watermark": next_watermark}
+        self.save()
+        self.pending.remove()
+        self.last_crawled = sweep["crawled"]
+
+    def step(self, batch: int = 20) -> bool:
+        # One bounded piece of a sweep: crawls up to `batch` queued URLs, or
+        # else reads the next sitemap. Only the sweep's cursor is kept in the
+        # state file, the URLs stay in the spools, so a restart resumes it
+        # and saving costs the same at every step. False once it's done.
+        sweep = self.state.get("sweep") or self.start_sweep()
+        self.state["sweep"] = sweep
+        hrefs, offset = self.pending.read(sweep["offset"], batch)
+        if hrefs:
+            failed = [href for href in hrefs if not self.crawl_url(href)]
+            if failed:
+                self.retry.append(failed)
+            sweep["retry"] += len(failed)
+            sweep["offset"] = offset
+            sweep["crawled"] += len(hrefs)
+        elif sweep["sitemaps"]:
+            self.read_sitemap(sweep, sweep["sitemaps"].pop())
+        else:
+            self.finish_sweep(sweep)
+            return False
+
+        self.save()
+        return True
+
+    def sweep(self, batch: int = 20) -> int:
+        while self.step(batch):
+            pass
+        return self.last_crawled
+
+    def load(self):
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return
+
+        with open(self.state_file) as f:
+            self.state.update(json.load(f))
+
+    def save(self):
+        if not self.state_file:
+            return
+
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+
+
+def get_sitemap_discovery(crawler: Crawler) -> SitemapDiscovery:
+    return SitemapDiscovery(
+        crawler,
+        getattr(
+            CONFIG, "TINYZONETV_SITEMAP", f"{CONFIG.TINYZONETV_HOMEPAGE}/sitemap.xml"
+        ),
+        getattr(CONFIG, "SITEMAP_STATE_FILE", "sitemap_state.json"),
+    )
+
+
+def main(crawler: Crawler):
+    discovery = get_sitemap_discovery(crawler)
+    while True:
+        try:
+            discovery.sweep(getattr(CONFIG, "SITEMAP_BATCH", 20))
+        except Exception as e:
+            pass
+        time.sleep(getattr(CONFIG, "SITEMAP_SWEEP_INTERVAL", 60 * 60))
+
+
+if __name__ == "__main__":
+    exit_on_sigterm()
+    helper.start_browsers()
+    writer = get_writer_pool()
+    try:
+        if writer:
+            with writer:
+                main(Crawler(writer=writer))
+        else:
+            main(Crawler())
+    finally:
+        helper.close_browsers()
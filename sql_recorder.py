@@ -0,0 +1,213 @@
+import atexit
+import contextlib
+import os
+import re
+import threading
+import time
+import traceback
+from collections import Counter
+
+from settings import CONFIG
+
+# Frames of these files are skipped when looking for a statement's call site
+INTERNAL_FILES = ("_db.py", "sql_recorder.py", "contextlib.py")
+
+
+def normalize(query: str) -> str:
+    # Statement shape: literals and placeholders become ?, IN/VALUES lists of
+    # any length look the same
+    shape = " ".join(query.split())
+    shape = re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", "?", shape)
+    shape = re.sub(r"%s|\b\d+\b", "?", shape)
+    shape = re.sub(r"\(\?(?:, \?)*\)", "(?+)", shape)
+    shape = re.sub(r"\(\?\+\)(?:, \(\?\+\))+", "(?+), ...", shape)
+    return shape
+
+
+def get_call_site() -> str:
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        file_name = os.path.basename(frame.filename)
+        if file_name not in INTERNAL_FILES and "mysql" not in frame.filename:
+            return f"{file_name}:{frame.lineno} {frame.name}"
+    return "?"
+
+
+class QueryStats:
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.call_sites = Counter()
+        self.example = None
+
+    def add(self, duration: float, rows: int, call_site: str, params):
+        self.calls += 1
+        self.rows += rows
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.call_sites[call_site] += 1
+        if self.example is None:
+            self.example = repr(params)[:200]
+
+
+class RecordingCursor:
+    def __init__(self, cursor, recorder):
+        self.cursor = cursor
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, query, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(query, params, *args, **kwargs)
+        finally:
+            self.recorder.record(
+                query, params, time.perf_counter() - start, self.cursor.rowcount
+            )
+
+    def executemany(self, query, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.cursor.executemany(query, seq_params, *args, **kwargs)
+        finally:
+            self.recorder.record(
+                query, seq_params, time.perf_counter() - start, self.cursor.rowcount
+            )
+
+
+class RecordingConnection:
+    def __init__(self, conn, recorder):
+        self.conn = conn
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self.conn.cursor(*args, **kwargs), self.recorder)
+
+
+class SqlRecorder:
+    # Opt-in (SQL_RECORDER): every statement sent through Database
+    # connections is timed and aggregated by shape for the whole run. Inside
+    # film() scopes, SELECT shapes issued more than n_plus_one times and
+    # statements repeated with identical parameters are flagged.
+    def __init__(self, enabled: bool = False, n_plus_one: int = 10):
+        self.enabled = enabled
+        self.n_plus_one = n_plus_one
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {}
+        self.films = 0
+        # shape -> [films flagged, max calls in one film, example film]
+        self.n_plus_one_shapes = {}
+        self.repeated_shapes = {}
+
+    def wrap_connection(self, conn):
+        return RecordingConnection(conn, self) if self.enabled else conn
+
+    def record(self, query: str, params, duration: float, rows: int):
+        shape = normalize(query)
+        call_site = get_call_site()
+        with self.lock:
+            if shape not in self.stats:
+                self.stats[shape] = QueryStats()
+            self.stats[shape].add(duration, max(rows or 0, 0), call_site, params)
+
+        film_queries = getattr(self.local, "film_queries", None)
+        if film_queries is not None:
+            # Literals are part of the statement for the identical check
+            film_queries.append((shape, f"{query}\t{params!r}"))
+
+    @contextlib.contextmanager
+    def film(self, name: str):
+        if not self.enabled or getattr(self.local, "film_queries", None) is not None:
+            yield
+            return
+
+        self.local.film_queries = []
+        try:
+            yield
+        finally:
+            film_queries = self.local.film_queries
+            self.local.film_queries = None
+            self.check_film(name, film_queries)
+
+    def flag(self, flagged: dict, shape: str, calls: int, name: str):
+        films, max_calls, example = flagged.get(shape, (0, 0, name))
+        if calls > max_calls:
+            max_calls, example = calls, name
+        flagged[shape] = (films + 1, max_calls, example)
+
+    def check_film(self, name: str, film_queries: list):
+        shape_calls = Counter(shape for shape, _ in film_queries)
+        repeated_calls = {}
+        for (shape, _), calls in Counter(film_queries).items():
+            if calls > 1:
+                repeated_calls[shape] = max(repeated_calls.get(shape, 0), calls)
+        with self.lock:
+            self.films += 1
+            for shape, calls in shape_calls.items():
+                if calls > self.n_plus_one and shape.startswith("SELECT"):
+                    self.flag(self.n_plus_one_shapes, shape, calls, name)
+            for shape, calls in repeated_calls.items():
+                self.flag(self.repeated_shapes, shape, calls, name)
+
+    def report(self, limit: int = 20) -> str:
+        with self.lock:
+            stats = sorted(
+                self.stats.items(), key=lambda item: item[1].total_time, reverse=True
+            )
+            total_time = sum(query_stats.total_time for _, query_stats in stats)
+            lines = [
+                f"{sum(query_stats.calls for _, query_stats in stats)} statements, "
+                f"{len(stats)} shapes, {total_time:.3f}s, {self.films} films",
+                "",
+                "By total time:",
+            ]
+            for shape, query_stats in stats[:limit]:
+                call_site, _ = query_stats.call_sites.most_common(1)[0]
+                lines.append(
+                    f"  {query_stats.total_time:9.3f}s {query_stats.calls:8} calls "
+                    f"{query_stats.max_time * 1000:8.1f}ms max {query_stats.rows:8} rows"
+                    f"  {call_site}"
+                )
+                lines.append(f"      {shape[:300]}")
+
+            for title, flagged in (
+                (
+                    f"N+1 (same SELECT > {self.n_plus_one} times in a film):",
+                    self.n_plus_one_shapes,
+                ),
+                ("Identical statements repeated in a film:", self.repeated_shapes),
+            ):
+                lines.extend(["", title])
+                for shape, (films, max_calls, example) in sorted(
+                    flagged.items(), key=lambda item: item[1][1], reverse=True
+                )[:limit]:
+                    lines.append(
+                        f"  {films:6} films, up to {max_calls} calls ({example})"
+                    )
+                    lines.append(f"      {shape[:300]}")
+        return "\n".join(lines) + "\n"
+
+    def save_report(self, report_file: str):
+        if not self.stats:
+            return
+
+        with open(report_file, "w") as f:
+            f.write(self.report())
+
+
+recorder = SqlRecorder(
+    enabled=getattr(CONFIG, "SQL_RECORDER", False),
+    n_plus_one=getattr(CONFIG, "SQL_RECORDER_N_PLUS_ONE", 10),
+)
+if recorder.enabled:
+    atexit.register(
+        recorder.save_report,
+        getattr(CONFIG, "SQL_RECORDER_REPORT", "sql_report.txt"),
+    )
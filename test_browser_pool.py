@@ -0,0 +1,166 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from browser_pool import BrowserPool
+from cookie_jar import SharedCookieJar
+from helper import Helper
+
+CHALLENGE_HTML = (
+    "<html><head><title>Just a moment...</title></head>"
+    "<body><div id='challenge-platform'></div></body></html>"
+)
+FILM_HTML = "<html><head><title>Film</title></head><body>solved</body></html>"
+
+
+class ChallengeHandler(BaseHTTPRequestHandler):
+    # Serves the challenge page until the request carries the clearance
+    # cookie, which the challenge page itself sets like the real one does
+    def do_GET(self):
+        if self.path == "/stuck" or "cf_clearance=ok" not in self.headers.get(
+            "Cookie", ""
+        ):
+            body = CHALLENGE_HTML.encode()
+            self.send_response(503)
+            self.send_header("Set-Cookie", "cf_clearance=ok")
+        else:
+            body = FILM_HTML.encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubDriver:
+    # Just enough of a Chrome driver: every page_source read reloads the page
+    # with the cookies collected so far, as the challenge script would
+    user_agent = "StubDriver/1.0"
+
+    def __init__(self):
+        self.url = ""
+        self.cookies = {}
+        self.quit_called = False
+
+    def get(self, url: str):
+        self.url = url
+
+    @property
+    def page_source(self) -> str:
+        request = urllib.request.Request(self.url)
+        if self.cookies:
+            request.add_header(
+                "Cookie",
+                "; ".join(f"{name}={value}" for name, value in self.cookies.items()),
+            )
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            response = e
+        cookie = response.headers.get("Set-Cookie")
+        if cookie:
+            name, value = cookie.split(";")[0].split("=", 1)
+            self.cookies[name] = value
+        return response.read().decode()
+
+    def get_cookies(self) -> list:
+        return [{"name": name, "value": value} for name, value in self.cookies.items()]
+
+    def execute_script(self, script: str) -> str:
+        return self.user_agent
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChallengeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_url(server, path: str) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def get_pool(server, size: int = 2, challenge_timeout: int = 5):
+    drivers = []
+
+    def driver_factory():
+        drivers.append(StubDriver())
+        return drivers[-1]
+
+    pool = BrowserPool(
+        size=size,
+        warm_url=get_url(server, "/"),
+        challenge_timeout=challenge_timeout,
+        driver_factory=driver_factory,
+    )
+    return pool, drivers
+
+
+def test_warm_up_solves_challenge_on_every_driver(server):
+    pool, drivers = get_pool(server)
+    pool.warm_up()
+
+    assert len(drivers) == 2
+    assert pool.drivers.qsize() == 2
+    assert all(driver.cookies == {"cf_clearance": "ok"} for driver in drivers)
+
+
+def test_fetch_reuses_warm_driver(server):
+    pool, drivers = get_pool(server, size=1)
+    pool.warm_up()
+
+    html, cookies, user_agent = pool.fetch(get_url(server, "/tv/film"))
+
+    assert "solved" in html
+    assert cookies == [{"name": "cf_clearance", "value": "ok"}]
+    assert user_agent == StubDriver.user_agent
+    assert len(drivers) == 1
+
+
+def test_unsolved_challenge_discards_driver(server):
+    pool, drivers = get_pool(server, size=1, challenge_timeout=1)
+
+    with pytest.raises(TimeoutError):
+        pool.fetch(get_url(server, "/stuck"))
+
+    assert drivers[0].quit_called
+    assert pool.started == 0
+
+
+def test_close_quits_every_driver(server):
+    pool, drivers = get_pool(server)
+    pool.warm_up()
+    pool.close()
+
+    assert all(driver.quit_called for driver in drivers)
+    assert pool.started == 0
+    assert pool.drivers.empty()
+
+
+def test_helper_falls_back_to_browser_on_challenge(server):
+    pool, drivers = get_pool(server, size=1)
+    cookie_jar = SharedCookieJar()
+    helper = Helper(browser_pool=pool, cookie_jar=cookie_jar, db=object())
+    helper.start_browsers()
+    try:
+        response = helper.download_url(get_url(server, "/tv/film"))
+    finally:
+        helper.close_browsers()
+
+    assert response.status_code == 200
+    assert "solved" in response.text
+    assert cookie_jar.get("127.0.0.1")["user_agent"] == StubDriver.user_agent
+    assert drivers[0].quit_called
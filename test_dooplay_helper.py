@@ -0,0 +1,197 @@
+import contextlib
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from _db import Database
+from dooplay import DooPlay
+from helper import Helper
+from settings import CONFIG
+
+PRIMARY_KEYS = {"posts": "ID", "postmeta": "meta_id"}
+
+
+class SqliteCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, query, data=()):
+        return self.cursor.execute(query.replace("%s", "?"), data)
+
+    def executemany(self, query, seq_data):
+        return self.cursor.executemany(query.replace("%s", "?"), seq_data)
+
+
+class RecordingDatabase(Database):
+    # Runs the real statements on an in-memory SQLite copy of the tables the
+    # DooPlay helper writes, and records every inserted (table, row)
+    def __init__(self):
+        super().__init__(connection={})
+        self.conn = sqlite3.connect(":memory:")
+        self.inserts = []
+        for table, primary_key in PRIMARY_KEYS.items():
+            table = f"{self.table_prefix}{table}"
+            self.conn.execute(
+                f"CREATE TABLE {table} ({primary_key} INTEGER PRIMARY KEY, "
+                f"{', '.join(self.get_insert_columns(table))})"
+            )
+
+    @contextlib.contextmanager
+    def cursor(self, commit: bool = False):
+        cur = SqliteCursor(self.conn.cursor())
+        try:
+            yield cur
+            if commit:
+                self.conn.commit()
+        finally:
+            cur.close()
+
+    def insert_into(self, table: str, data: tuple = None, is_bulk: bool = False):
+        for row in data if is_bulk else [data]:
+            self.inserts.append((table, tuple(row)))
+        return super().insert_into(table, data, is_bulk)
+
+    def get_rows(self, table: str) -> list:
+        return self.conn.execute(
+            f"SELECT * FROM {self.table_prefix}{table} ORDER BY 1"
+        ).fetchall()
+
+
+class FixedTimeHelper(Helper):
+    def get_timeupdate(self) -> datetime:
+        return datetime(2024, 1, 1, 12, 0, 0)
+
+
+class LegacyHelper(FixedTimeHelper):
+    # The writes as they were before they were batched: one SELECT and
+    # UPDATE per counter, one INSERT per postmeta row
+    def update_meta_key(self, post_id, meta_key, update_value, field) -> list:
+        condition = f"post_id={post_id} AND meta_key='{meta_key}'"
+        post_temporadas_episodios = self.db.select_all_from(
+            table=f"{self.db.table_prefix}postmeta", condition=condition
+        )
+        if post_temporadas_episodios:
+            value = int(post_temporadas_episodios[0][-1])
+            if value < update_value:
+                self.db.update_table(
+                    table=f"{self.db.table_prefix}postmeta",
+                    set_cond=f"meta_value={update_value}",
+                    where_cond=condition,
+                )
+            return []
+        else:
+            return [
+                (post_id, meta_key, update_value),
+                (post_id, f"_{meta_key}", field),
+            ]
+
+    def update_meta_keys(self, post_id, counters: list) -> list:
+        res = []
+        for meta_key, update_value, field in counters:
+            res.extend(self.update_meta_key(post_id, meta_key, update_value, field))
+        return res
+
+    def insert_postmeta(self, postmeta_data):
+        for row in postmeta_data:
+            self.db.insert_into(table=f"{self.db.table_prefix}postmeta", data=row)
+
+
+def write_show(helper: Helper, episodes: list):
+    for season_number, episode_number in episodes:
+        title = f"Show {season_number}x{episode_number}"
+        helper.insert_episode(
+            {
+                **helper.generate_episode_data(
+                    post_id=1,
+                    episode_name=title,
+                    season_number=season_number,
+                    episode_number=episode_number - 1,
+                    post_title="Show",
+                    fondo_player="https://img.example/cover.jpg",
+                    poster_url="https://img.example/cover.jpg",
+                    quality="HD",
+                    episode_links=[
+                        f"https://player.example/{season_number}/{episode_number}/{i}"
+                        for i in range(3)
+                    ],
+                ),
+                "title": title,
+            }
+        )
+
+
+@pytest.mark.parametrize(
+    "episodes",
+    [
+        [(1, 1), (1, 2), (1, 3)],
+        # Counters that only grow, and episodes arriving out of order
+        [(1, 2), (2, 1), (1, 1), (2, 3), (1, 3), (2, 2)],
+    ],
+)
+def test_batched_writes_match_legacy_writes(episodes):
+    legacy_db = RecordingDatabase()
+    write_show(
+        LegacyHelper(browser_pool=object(), cookie_jar=object(), db=legacy_db),
+        episodes,
+    )
+
+    db = RecordingDatabase()
+    write_show(
+        FixedTimeHelper(browser_pool=object(), cookie_jar=object(), db=db), episodes
+    )
+
+    assert db.inserts == legacy_db.inserts
+    assert db.get_rows("posts") == legacy_db.get_rows("posts")
+    assert db.get_rows("postmeta") == legacy_db.get_rows("postmeta")
+
+
+def test_counters_are_raised_in_place():
+    db = RecordingDatabase()
+    write_show(
+        FixedTimeHelper(browser_pool=object(), cookie_jar=object(), db=db),
+        [(1, 1), (2, 4), (1, 2)],
+    )
+
+    counters = {
+        meta_key: str(meta_value)
+        for _, post_id, meta_key, meta_value in db.get_rows("postmeta")
+        if post_id == 1
+        and meta_key
+        in ("temporadas", "temporadas_0_episodios", "temporadas_1_episodios")
+    }
+    assert counters == {
+        "temporadas": "2",
+        "temporadas_0_episodios": "2",
+        "temporadas_1_episodios": "4",
+    }
+
+
+def test_dooplay_maps_crawled_post_types(monkeypatch):
+    # A Toronites site's show type, which the legacy Helper doesn't know
+    monkeypatch.setattr(CONFIG, "TYPE_TV_SHOWS", "series")
+    db = RecordingDatabase()
+    film = {
+        "title": "Show",
+        "slug": "show",
+        "post_type": "series",
+        "description": "",
+        "trailer_id": "",
+        "cover_src": "https://img.example/cover.jpg",
+        "extra_info": {},
+    }
+    new_episodes = DooPlay(
+        film={**film},
+        episodes={"Season 1": {"1": "Pilot", "2": "Second"}},
+        dooplay_helper=FixedTimeHelper(
+            browser_pool=object(), cookie_jar=object(), db=db
+        ),
+        post_types={"series": "tvshows"},
+    ).insert_film(throttle=False)
+
+    post_types = [row[-3] for row in db.get_rows("posts")]
+    assert post_types == ["tvshows", "episodes", "episodes"]
+    assert new_episodes == 2
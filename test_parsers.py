@@ -0,0 +1,35 @@
+import pytest
+
+from check_parsers import (
+    get_fixture_names,
+    get_mismatches,
+    get_outputs,
+    read_fixture,
+    run_fixture,
+)
+from circuit_breaker import CLOSED, breakers
+from helper import helper
+
+
+@pytest.mark.parametrize("name", get_fixture_names())
+def test_parsers_match_golden_fixtures(name, monkeypatch):
+    # The broken fixture fails on purpose, keep that out of log/
+    monkeypatch.setattr(helper, "error_log", lambda *args, **kwargs: None)
+
+    outputs = get_outputs(run_fixture(name, read_fixture(name)))
+
+    assert get_mismatches(name, outputs) == []
+
+
+def test_fixtures_leave_the_breakers_alone(monkeypatch):
+    monkeypatch.setattr(helper, "error_log", lambda *args, **kwargs: None)
+    parsers = run_fixture("detail_broken", read_fixture("detail_broken"))
+    names = ["extractor:get_title", "extractor:get_cover_url"]
+    recorded = {name: len(breakers.get(name).window) for name in names}
+
+    for _ in range(50):
+        get_outputs(parsers)
+
+    for name in names:
+        assert breakers.get(name).state == CLOSED
+        assert len(breakers.get(name).window) == recorded[name]
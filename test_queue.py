@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+import queue_worker
+from _queue import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_LEASED,
+    JOB_PENDING,
+    Heartbeat,
+    SQLiteQueue,
+)
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = SQLiteQueue(
+        str(tmp_path / "jobs.sqlite3"),
+        lease_seconds=0.2,
+        max_attempts=2,
+        retry_backoff=0,
+    )
+    job_queue.create_table()
+    return job_queue
+
+
+def get_job_row(job_queue: SQLiteQueue, job_key: str) -> tuple:
+    return job_queue.execute(
+        f"SELECT status, attempts, owner, last_error FROM {job_queue.table} "
+        "WHERE job_key=%s",
+        (job_key,),
+        fetch=True,
+    )[0]
+
+
+def test_expired_lease_is_reclaimed(job_queue):
+    job_queue.enqueue("film", "film:a")
+    job = job_queue.lease("worker-1")
+    assert job_queue.lease("worker-2") is None
+
+    time.sleep(0.3)
+    reclaimed = job_queue.lease("worker-2")
+
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2
+    # The first worker lost the job and can't finish it any more
+    assert not job_queue.complete(job)
+    assert job_queue.complete(reclaimed)
+    assert get_job_row(job_queue, "film:a")[0] == JOB_DONE
+
+
+def test_heartbeat_keeps_the_lease_until_the_worker_stops(job_queue):
+    job_queue.enqueue("film", "film:a")
+    job = job_queue.lease("worker-1")
+
+    with Heartbeat(job_queue, job, 0.05) as heartbeat:
+        time.sleep(0.4)
+        assert job_queue.lease("worker-2") is None
+
+    # No more heartbeats: the lease runs out and another worker takes over
+    time.sleep(0.3)
+    assert job_queue.lease("worker-2").id == job.id
+    assert not heartbeat.lost
+    assert not job_queue.heartbeat(job)
+
+
+def test_max_attempts_fails_the_job(job_queue):
+    job_queue.enqueue("film", "film:a")
+    job_queue.fail(job_queue.lease("worker-1"), error="first")
+    assert get_job_row(job_queue, "film:a")[0] == JOB_PENDING
+
+    job_queue.fail(job_queue.lease("worker-1"), error="second")
+
+    assert get_job_row(job_queue, "film:a")[0] == JOB_FAILED
+    assert job_queue.lease("worker-1") is None
+
+
+def test_lease_expiring_on_the_last_attempt_fails_the_job(job_queue):
+    job_queue.enqueue("film", "film:a")
+    job_queue.fail(job_queue.lease("worker-1"))
+    job_queue.lease("worker-1")
+
+    time.sleep(0.3)
+
+    assert job_queue.lease("worker-2") is None
+    status, attempts, _, last_error = get_job_row(job_queue, "film:a")
+    assert (status, attempts) == (JOB_FAILED, 2)
+    assert "last attempt" in last_error
+
+
+def test_refresh_requeues_done_jobs_only(job_queue):
+    job_queue.enqueue("film", "film:a", {"slug": "a"})
+    job = job_queue.lease("worker-1")
+
+    # Leased right now, left alone
+    assert not job_queue.enqueue("film", "film:a", {"slug": "a"}, refresh=True)
+    assert get_job_row(job_queue, "film:a")[0] == JOB_LEASED
+
+    job_queue.complete(job)
+    assert job_queue.enqueue("film", "film:a", {"slug": "a2"}, refresh=True)
+
+    status, attempts, _, _ = get_job_row(job_queue, "film:a")
+    assert (status, attempts) == (JOB_PENDING, 0)
+    assert job_queue.lease("worker-1").payload == {"slug": "a2"}
+
+
+def test_film_without_title_fails_without_retries(job_queue, monkeypatch):
+    monkeypatch.setattr(queue_worker, "queue", job_queue)
+    monkeypatch.setattr(queue_worker.crawler, "crawl_film", lambda **item: None)
+    job_queue.enqueue("film", "film:a", {"href": "https://example.com/tv/a"})
+
+    queue_worker.run_job(job_queue.lease("worker-1"))
+
+    status, attempts, _, last_error = get_job_row(job_queue, "film:a")
+    assert (status, attempts) == (JOB_FAILED, 1)
+    assert "No title found" in last_error
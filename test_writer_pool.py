@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+from crawl_store import CrawlStore
+from replay import replay_async
+from writer_pool import AsyncFilmWriter, FanOutWriter, FilmWriterPool
+
+
+class RecordingWriter:
+    # Stands in for insert_film: records which films were written and how
+    # many writes ran at the same time
+    def __init__(self, delay: float = 0.02, fail_slugs: tuple = ()):
+        self.delay = delay
+        self.fail_slugs = fail_slugs
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.written = []
+
+    def __call__(self, film: dict, episodes: dict):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if film["slug"] in self.fail_slugs:
+                raise ValueError(f"Cannot write {film['slug']}")
+            with self.lock:
+                self.written.append(film["slug"])
+            return len(episodes.get("Season 1", {}))
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def get_film(slug: str, episodes: int = 1) -> tuple:
+    film = {"title": slug.title(), "slug": slug, "post_type": "tvshows"}
+    return film, {"Season 1": {str(i): f"Episode {i}" for i in range(episodes)}}
+
+
+def test_write_many_bounds_in_flight_writes():
+    write_film = RecordingWriter()
+
+    async def run():
+        async with AsyncFilmWriter(workers=3, write_film=write_film) as writer:
+            return await writer.write_many(
+                [get_film(f"show-{i}", episodes=i) for i in range(12)]
+            )
+
+    results = asyncio.run(run())
+
+    assert results == list(range(12))
+    assert len(write_film.written) == 12
+    assert write_film.max_running == 3
+
+
+def test_write_raises_the_writer_error():
+    write_film = RecordingWriter(fail_slugs=("broken",))
+
+    async def run():
+        async with AsyncFilmWriter(workers=2, write_film=write_film) as writer:
+            with pytest.raises(ValueError):
+                await writer.write(*get_film("broken"))
+            return await writer.write(*get_film("fine", episodes=2))
+
+    assert asyncio.run(run()) == 2
+
+
+def test_replay_writes_every_stored_film(tmp_path):
+    store = CrawlStore(str(tmp_path))
+    for i in range(10):
+        store.append(*get_film(f"show-{i}"))
+    write_film = RecordingWriter(fail_slugs=("show-4",))
+    args = argparse.Namespace(
+        folder=str(tmp_path), slug=[], post_type="tvshows", all_versions=False
+    )
+
+    asyncio.run(replay_async(args, AsyncFilmWriter(workers=4, write_film=write_film)))
+
+    assert sorted(write_film.written) == sorted(
+        f"show-{i}" for i in range(10) if i != 4
+    )
+    assert write_film.max_running <= 4
+
+
+def get_fan_out(*write_films, **kwargs) -> FanOutWriter:
+    return FanOutWriter(
+        [
+            FilmWriterPool(workers=1, max_queued=1, write_film=write_film, name=f"t{i}")
+            for i, write_film in enumerate(write_films)
+        ],
+        **kwargs,
+    )
+
+
+def test_fan_out_waits_for_every_target():
+    writer = get_fan_out(RecordingWriter(), RecordingWriter(delay=0.05))
+    with writer:
+        assert writer.write_and_wait(*get_film("show", episodes=3)) == 3
+
+
+def test_fan_out_raises_when_a_target_skips_the_film():
+    release = threading.Event()
+    writer = get_fan_out(
+        RecordingWriter(), lambda film, episodes: release.wait(), submit_timeout=0.05
+    )
+    with writer:
+        # The second target's only slot is held by this write
+        writer.targets[1].submit(*get_film("first"))
+        try:
+            with pytest.raises(queue.Full):
+                writer.write_and_wait(*get_film("second"))
+        finally:
+            release.set()
+
+
+def test_fan_out_raises_when_a_target_is_still_writing():
+    writer = get_fan_out(
+        RecordingWriter(), RecordingWriter(delay=0.3), result_timeout=0.05
+    )
+    with writer:
+        with pytest.raises(TimeoutError):
+            writer.write_and_wait(*get_film("show"))
+
+
+def test_fan_out_raises_when_a_target_fails():
+    writer = get_fan_out(RecordingWriter(), RecordingWriter(fail_slugs=("show",)))
+    with writer:
+        with pytest.raises(ValueError):
+            writer.write_and_wait(*get_film("show"))
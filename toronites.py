@@ -5,32 +5,45 @@ import re
 from datetime import datetime, timedelta
 from html import escape
 from pathlib import Path
-from time import sleep
+from time import sleep, time
+from urllib.parse import urlparse
 
 import requests
 from phpserialize import serialize
 from slugify import slugify
 
 from _db import database
+from cookie_jar import get_cookie_jar
 from settings import CONFIG
+from sql_recorder import recorder
 
 logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
 
 
 class ToronitesHelper:
-    def get_header(self):
+    def __init__(self, db=None):
+        self.db = db or database
+        self.cookie_jar = get_cookie_jar()
+
+    def get_header(self, clearance: dict = None):
         header = {
-            "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E150",  # noqa: E501
+            "User-Agent": clearance["user_agent"]
+            if clearance
+            else "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E150",  # noqa: E501
             "Accept-Encoding": "gzip, deflate",
-            # "Cookie": CONFIG.COOKIE,
             "Cache-Control": "max-age=0",
             "Accept-Language": "vi-VN",
-            "Referer": "https://french-anime.com/",
+            "Referer": CONFIG.TINYZONETV_HOMEPAGE,
         }
         return header
 
     def download_url(self, url):
-        return requests.get(url, headers=self.get_header())
+        clearance = self.cookie_jar.get(urlparse(url).hostname)
+        return requests.get(
+            url,
+            headers=self.get_header(clearance),
+            cookies=clearance["cookies"] if clearance else None,
+        )
 
     def save_thumb(
         self,
@@ -170,8 +183,8 @@ class ToronitesHelper:
         ]
 
     def insert_postmeta(self, postmeta_data: list, table: str = "postmeta"):
-        database.insert_into(
-            table=f"{CONFIG.TABLE_PREFIX}{table}", data=postmeta_data, is_bulk=True
+        self.db.insert_into(
+            table=f"{self.db.table_prefix}{table}", data=postmeta_data, is_bulk=True
         )
 
     def generate_film_data(
@@ -262,11 +275,11 @@ class ToronitesHelper:
 
     def insert_post(self, post_data: dict) -> int:
         data = self.generate_post(post_data)
-        post_id = database.insert_into(table=f"{CONFIG.TABLE_PREFIX}posts", data=data)
+        post_id = self.db.insert_into(table=f"{self.db.table_prefix}posts", data=data)
         return post_id
 
     def insert_thumb(self, post_data: dict):
-        thumb_insert_data, _ = helper.save_thumb(
+        thumb_insert_data, _ = self.save_thumb(
             post_data.get("poster_url"), post_data.get("title")
         )
 
@@ -298,11 +311,11 @@ class ToronitesHelper:
             # "",
         )
 
-        thumb_id = database.insert_into(
-            table=f"{CONFIG.TABLE_PREFIX}posts", data=thumb_post_data
+        thumb_id = self.db.insert_into(
+            table=f"{self.db.table_prefix}posts", data=thumb_post_data
         )
-        database.insert_into(
-            table=f"{CONFIG.TABLE_PREFIX}postmeta",
+        self.db.insert_into(
+            table=f"{self.db.table_prefix}postmeta",
             data=(thumb_id, "_wp_attached_file", thumb_insert_data),
         )
 
@@ -428,34 +441,18 @@ class ToronitesHelper:
         termIds = []
         for term in terms:
             term_insert_slug = slugify(term_slug) if term_slug else slugify(term)
-            cols = "tt.term_taxonomy_id, tt.term_id"
-            table = (
-                f"{CONFIG.TABLE_PREFIX}term_taxonomy tt, {CONFIG.TABLE_PREFIX}terms t"
+            term_taxonomy_id, is_new_term = self.get_or_create(
+                key_type=f"term:{taxonomy}",
+                key_name=term_insert_slug,
+                lookup=lambda: self.find_term(term_insert_slug, taxonomy),
+                create=lambda: self.create_term(term, term_insert_slug, taxonomy),
+                exists=self.term_exists,
             )
-            condition = f't.slug = "{term_insert_slug}" AND tt.term_id=t.term_id AND tt.taxonomy="{taxonomy}"'
-
-            be_term = database.select_all_from(
-                table=table, condition=condition, cols=cols
-            )
-            if not be_term:
-                term_id = database.insert_into(
-                    table=f"{CONFIG.TABLE_PREFIX}terms",
-                    data=(term, term_insert_slug, 0),
-                )
-                term_taxonomy_count = 1 if taxonomy == "seasons" else 0
-                term_taxonomy_id = database.insert_into(
-                    table=f"{CONFIG.TABLE_PREFIX}term_taxonomy",
-                    data=(term_id, taxonomy, "", 0, term_taxonomy_count),
-                )
-                termIds = [term_taxonomy_id, True]
-            else:
-                term_taxonomy_id = be_term[0][0]
-                term_id = be_term[0][1]
-                termIds = [term_taxonomy_id, False]
+            termIds = [term_taxonomy_id, is_new_term]
 
             try:
-                database.insert_into(
-                    table=f"{CONFIG.TABLE_PREFIX}term_relationships",
+                self.db.insert_into(
+                    table=f"{self.db.table_prefix}term_relationships",
                     data=(post_id, term_taxonomy_id, 0),
                 )
             except:
@@ -463,6 +460,89 @@ class ToronitesHelper:
 
         return termIds
 
+    def find_term(self, term_slug: str, taxonomy: str) -> int:
+        cols = "tt.term_taxonomy_id, tt.term_id"
+        table = f"{self.db.table_prefix}term_taxonomy tt, {self.db.table_prefix}terms t"
+        condition = f't.slug = "{term_slug}" AND tt.term_id=t.term_id AND tt.taxonomy="{taxonomy}"'
+
+        be_term = self.db.select_all_from(table=table, condition=condition, cols=cols)
+        return be_term[0][0] if be_term else 0
+
+    def term_exists(self, term_taxonomy_id: int) -> bool:
+        return bool(
+            self.db.select_with_data(
+                f"SELECT tt.term_taxonomy_id FROM {self.db.table_prefix}term_taxonomy tt "
+                f"JOIN {self.db.table_prefix}terms t ON t.term_id = tt.term_id "
+                "WHERE tt.term_taxonomy_id=%s",
+                (term_taxonomy_id,),
+            )
+        )
+
+    def post_exists(self, post_id: int) -> bool:
+        return bool(
+            self.db.select_with_data(
+                f"SELECT ID FROM {self.db.table_prefix}posts WHERE ID=%s", (post_id,)
+            )
+        )
+
+    def create_term(self, term: str, term_slug: str, taxonomy: str) -> int:
+        term_id = self.db.insert_into(
+            table=f"{self.db.table_prefix}terms",
+            data=(term, term_slug, 0),
+        )
+        term_taxonomy_count = 1 if taxonomy == "seasons" else 0
+        term_taxonomy_id = self.db.insert_into(
+            table=f"{self.db.table_prefix}term_taxonomy",
+            data=(term_id, taxonomy, "", 0, term_taxonomy_count),
+        )
+        return term_taxonomy_id
+
+    def get_or_create(
+        self,
+        key_type: str,
+        key_name: str,
+        lookup,
+        create,
+        exists=None,
+        timeout: int = 60,
+    ) -> list:
+        # `exists` checks that an ID found in crawler_keys still points at a
+        # live object; keys of deleted ones are dropped and the object is
+        # looked up by slug or created again
+        key_name = key_name[:200]
+        object_id = self.db.get_key(key_type, key_name, exists)
+        if object_id:
+            return [object_id, False]
+
+        if object_id is None:
+            # Not tracked yet, e.g. created from wp-admin or before migrating
+            object_id = lookup()
+            if object_id:
+                self.db.set_key(key_type, key_name, object_id)
+                return [object_id, False]
+
+        deadline = time() + timeout
+        while time() < deadline:
+            if self.db.claim_key(key_type, key_name):
+                try:
+                    object_id = lookup()
+                    is_new = not object_id
+                    if is_new:
+                        object_id = create()
+                    self.db.set_key(key_type, key_name, object_id)
+                    return [object_id, is_new]
+                except Exception:
+                    self.db.release_key(key_type, key_name)
+                    raise
+
+            # Another worker owns the claim, wait for it to publish the ID
+            sleep(0.2)
+            object_id = self.db.get_key(key_type, key_name, exists)
+            if object_id:
+                return [object_id, False]
+
+        raise TimeoutError(f"Timed out waiting for {key_type} {key_name}")
+
     def get_server_name_from(self, link: str) -> str:
         server_name = ""
         result = re.search(r"(?<=//)(.*?)(?=/)", link)
@@ -474,15 +554,30 @@ class ToronitesHelper:
 
 helper = ToronitesHelper()
 
+# Season termmeta: number of listed episodes known to be fully written
+EPISODES_CHECKPOINT_KEY = "crawler_episodes_written"
+# Root post postmeta: the TMDB ID the film was crawled with
+TMDB_ID_KEY = "crawler_tmdb_id"
+
 
 class Toronites:
-    def __init__(self, film: dict, episodes: dict, season_str: str = ""):
+    def __init__(
+        self,
+        film: dict,
+        episodes: dict,
+        season_str: str = "",
+        toronites_helper: ToronitesHelper = None,
+    ):
+        self.helper = toronites_helper or helper
         self.film = film
-        self.film["quality"] = self.film["extra_info"].get("quality", "HD")
+        if "quality" not in self.film:
+            self.film["quality"] = self.film["extra_info"].get("quality", "HD")
         self.film["version"] = "English"
         self.episode = {}
         self.episodes = episodes
         self.season_str = season_str
+        self.new_episodes = 0
+        self.counters = {}
 
     def insert_movie_details(self, post_id):
         if not self.episodes:
@@ -503,7 +598,7 @@ class Toronites:
                     (
                         post_id,
                         f"trglinks_{len_episode_links}",
-                        helper.generate_trglinks(
+                        self.helper.generate_trglinks(
                             server=CONFIG.LINK_LANGUAGE,
                             link=link,
                             lang=quality,
@@ -514,44 +609,81 @@ class Toronites:
                 len_episode_links += 1
 
         postmeta_data.append((post_id, "trgrabber_tlinks", len_episode_links))
-        helper.insert_postmeta(postmeta_data)
+        self.helper.insert_postmeta(postmeta_data)
 
     def get_thumb_id_be(self, post_id):
-        condition = f"post_id={post_id} AND meta_key='_thumbnail_id'"
-        thumb_postmeta_thumb_id = database.select_all_from(
-            table=f"{CONFIG.TABLE_PREFIX}postmeta",
-            condition=condition,
-            cols="meta_value",
+        thumb_id = self.helper.db.get_meta_value(
+            table=f"{self.helper.db.table_prefix}postmeta",
+            id_col="post_id",
+            object_id=post_id,
+            meta_key="_thumbnail_id",
         )
-        if thumb_postmeta_thumb_id:
-            thumb_id = thumb_postmeta_thumb_id[0][0]
+        self.film["cover_id"] = thumb_id if thumb_id else "0"
 
-            self.film["cover_id"] = thumb_id
-            return
-
-        self.film["cover_id"] = "0"
-
-    def insert_root_film(self) -> list:
+    def find_root_film(self) -> int:
         condition_post_name = self.film["slug"]
         condition = f"""post_name = '{condition_post_name}' AND post_type='{self.film["post_type"]}'"""
-        be_post = database.select_all_from(
-            table=f"{CONFIG.TABLE_PREFIX}posts", condition=condition
+        be_post = self.helper.db.select_all_from(
+            table=f"{self.helper.db.table_prefix}posts", condition=condition
         )
-        if not be_post:
-            logging.info(f'Inserting root film: {self.film["post_title"]}')
-            post_data = helper.generate_film_data(
-                self.film["post_title"],
-                self.film["slug"],
-                self.film["description"],
-                self.film["post_type"],
-                self.film["trailer_id"],
-                self.film["cover_src"],
-                self.film["extra_info"],
+        return be_post[0][0] if be_post else 0
+
+    def create_root_film(self) -> int:
+        logging.info(f'Inserting root film: {self.film["post_title"]}')
+        post_data = self.helper.generate_film_data(
+            self.film["post_title"],
+            self.film["slug"],
+            self.film["description"],
+            self.film["post_type"],
+            self.film["trailer_id"],
+            self.film["cover_src"],
+            self.film["extra_info"],
+        )
+
+        return self.helper.insert_film(post_data)
+
+    def get_tmdb_id(self) -> str:
+        tmdb_id = str(self.episodes.get("tmdb_id") or "").strip()
+        return tmdb_id if tmdb_id.isdigit() and tmdb_id != "0" else ""
+
+    def find_root_film_by_tmdb_id(self, tmdb_id: str) -> int:
+        post = self.helper.db.get_post_by_meta(
+            TMDB_ID_KEY, tmdb_id, self.film["post_type"]
+        )
+        if not post:
+            return 0
+
+        post_id, post_name = post
+        if post_name != self.film["slug"]:
+            logging.info(
+                f'{self.film["slug"]} is TMDB {tmdb_id}, already imported as {post_name}'
             )
+            # Seasons and episodes are keyed by the slug they were imported with
+            self.film["slug"] = post_name
+        return post_id
 
-            post_id, is_new_post_inserted = [helper.insert_film(post_data), True]
-        else:
-            post_id, is_new_post_inserted = [be_post[0][0], False]
+    def insert_root_film(self) -> list:
+        # Slugs change when tinyzone renumbers a title, the TMDB ID doesn't
+        tmdb_id = self.get_tmdb_id()
+        post_id = self.find_root_film_by_tmdb_id(tmdb_id) if tmdb_id else 0
+        is_new_post_inserted = False
+
+        if not post_id:
+            post_id, is_new_post_inserted = self.helper.get_or_create(
+                key_type=f'post:{self.film["post_type"]}',
+                key_name=self.film["slug"],
+                lookup=self.find_root_film,
+                create=self.create_root_film,
+                exists=self.helper.post_exists,
+            )
+            if post_id and tmdb_id:
+                self.helper.db.set_post_by_meta(
+                    post_id,
+                    self.film["slug"],
+                    TMDB_ID_KEY,
+                    tmdb_id,
+                    self.film["post_type"],
+                )
 
         logging.info(f"Post ID: {post_id}")
 
@@ -559,35 +691,182 @@ class Toronites:
 
         return post_id, is_new_post_inserted
 
-    def update_meta_for_post_or_term(
-        self, table, condition, new_meta_value, adding: bool = False
+    def add_counter(
+        self, table, id_col, object_id, meta_key, new_meta_value, adding: bool = False
     ):
-        try:
-            be_meta_value = database.select_all_from(
-                table=table,
-                condition=condition,
-                cols="meta_value",
-            )[0][0]
-
-            if adding:
-                new_meta_value = str(int(new_meta_value) + int(be_meta_value))
-
-            if int(be_meta_value) < int(new_meta_value):
-                database.update_table(
-                    table=table,
-                    set_cond=f"meta_value={new_meta_value}",
-                    where_cond=condition,
+        # Counter changes are gathered per film and written by apply_counters
+        key = (table, id_col, object_id, meta_key)
+        if key in self.counters:
+            meta_value, adding = self.counters[key]
+            new_meta_value = (
+                meta_value + int(new_meta_value)
+                if adding
+                else max(meta_value, int(new_meta_value))
+            )
+        self.counters[key] = (int(new_meta_value), adding)
+
+    def apply_counters(self):
+        # One set-based UPDATE per table with GREATEST()/increment semantics,
+        # so concurrent writers can't lose each other's updates
+        updates = {}
+        for (table, id_col, object_id, meta_key), (
+            meta_value,
+            adding,
+        ) in self.counters.items():
+            updates.setdefault((table, id_col), []).append(
+                (object_id, meta_key, meta_value, adding)
+            )
+        self.counters = {}
+
+        for (table, id_col), table_updates in updates.items():
+            try:
+                self.helper.db.update_meta_values(
+                    table=table, id_col=id_col, updates=table_updates
                 )
-        except Exception as e:
-            helper.error_log(
-                msg=f"Error while update_season_number_of_episodes\nSeason {condition} - Number of episodes {new_meta_value}\n{e}",
-                log_file="torotheme.update_season_number_of_episodes.log",
+            except Exception as e:
+                self.helper.error_log(
+                    msg=f"Error while apply_counters\n{table} {table_updates}\n{e}",
+                    log_file="torotheme.update_season_number_of_episodes.log",
+                )
+
+    def generate_episode_termmeta(
+        self,
+        post_id: int,
+        episode_term_id: int,
+        episode_number: str,
+        episode_title: str,
+        thumb_id: str = "0",
+    ) -> list:
+        len_episode_links = 0
+
+        termmeta_data = [
+            (episode_term_id, "episode_number", episode_number),
+            (episode_term_id, "name", episode_title),
+            (episode_term_id, "season_number", self.film["season_number"]),
+            (episode_term_id, "tr_id_post", post_id),
+        ]
+
+        if thumb_id != "0":
+            termmeta_data.append(
+                (episode_term_id, "still_path", thumb_id),
+            )
+        else:
+            termmeta_data.append(
+                (episode_term_id, "still_path_hotlink", self.film["cover_src"]),
             )
+        quality = self.film.get("quality", "HD")
 
-    def insert_episode(self, post_id: int, season_term_id: int, thumb_id: str = "0"):
-        len_episodes = 0
+        episode_links = [
+            f"https://www.2embed.to/embed/tmdb/tv?id={self.episodes.get('tmdb_id', '0')}&s={self.film['season_number']}&e={episode_number}"
+        ]
+        for link in episode_links:
+            if link:
+                termmeta_data.append(
+                    (
+                        episode_term_id,
+                        f"trglinks_{len_episode_links}",
+                        self.helper.generate_trglinks(
+                            server=CONFIG.LINK_LANGUAGE,
+                            link=link,
+                            lang=quality,
+                            quality=CONFIG.LINK_LANGUAGE,
+                        ),
+                    )
+                )
+                len_episode_links += 1
+
+        # Always the last row of an episode, used to tell complete episodes
+        termmeta_data.append((episode_term_id, "trgrabber_tlinks", len_episode_links))
+
+        return [termmeta_data, len_episode_links]
 
-        for episode_number, episode_title in self.episode.items():
+    def get_episodes_checkpoint(self, season_term_id: int):
+        checkpoint = self.helper.db.get_meta_value(
+            table=f"{self.helper.db.table_prefix}termmeta",
+            id_col="term_id",
+            object_id=season_term_id,
+            meta_key=EPISODES_CHECKPOINT_KEY,
+        )
+        return int(checkpoint) if checkpoint is not None else None
+
+    def save_episodes_checkpoint(
+        self, season_term_id: int, checkpoint: int, is_saved: bool
+    ):
+        if is_saved:
+            self.add_counter(
+                f"{self.helper.db.table_prefix}termmeta",
+                "term_id",
+                season_term_id,
+                EPISODES_CHECKPOINT_KEY,
+                checkpoint,
+            )
+        else:
+            self.helper.insert_postmeta(
+                [(season_term_id, EPISODES_CHECKPOINT_KEY, checkpoint)], "termmeta"
+            )
+
+    def get_written_episodes(self, episode_term_ids: list) -> set:
+        # Episodes whose termmeta is complete, in one query per chunk
+        # rather than one per episode
+        if not episode_term_ids:
+            return set()
+
+        return set(
+            self.helper.db.get_meta_values(
+                table=f"{self.helper.db.table_prefix}termmeta",
+                id_col="term_id",
+                object_ids=episode_term_ids,
+                meta_key="trgrabber_tlinks",
+            )
+        )
+
+    def flush_episodes(
+        self,
+        post_id: int,
+        season_term_id: int,
+        termmeta_data: list,
+        len_episodes: int,
+        len_new_episodes: int,
+    ):
+        if termmeta_data:
+            self.helper.insert_postmeta(termmeta_data, "termmeta")
+
+        if len_new_episodes:
+            self.add_counter(
+                f"{self.helper.db.table_prefix}termmeta",
+                "term_id",
+                season_term_id,
+                "number_of_episodes",
+                len_episodes,
+            )
+
+            self.add_counter(
+                f"{self.helper.db.table_prefix}postmeta",
+                "post_id",
+                post_id,
+                "number_of_episodes",
+                len_new_episodes,
+                adding=True,
+            )
+
+    def insert_episode(self, post_id: int, season_term_id: int, thumb_id: str = "0"):
+        # Episode termmeta is written in bounded chunks instead of holding a
+        # whole season. After each chunk the season's checkpoint records how
+        # many listed episodes are fully written, so a crash mid-season only
+        # has to re-check the episodes after it.
+        max_rows = getattr(CONFIG, "EPISODE_CHUNK_ROWS", 500)
+        max_bytes = getattr(CONFIG, "EPISODE_CHUNK_BYTES", 512 * 1024)
+
+        checkpoint = self.get_episodes_checkpoint(season_term_id)
+        is_checkpoint_saved = checkpoint is not None
+        checkpoint = checkpoint or 0
+
+        # Episode terms are resolved first, so the ones past the checkpoint
+        # that already existed are checked for complete termmeta at once
+        episode_terms = []
+        for position, (episode_number, episode_title) in enumerate(
+            self.episode.items()
+        ):
             episode_title_self_created = (
                 self.film["post_title"]
                 + f" {self.film['season_number']}x{episode_number}"
@@ -599,78 +878,90 @@ class Toronites:
             episode_term_slug = slugify(
                 self.film["slug"] + f" {self.film['season_number']}x{episode_number}"
             )
-            episode_term_id, is_new_episode = helper.insert_terms(
+            episode_term_id, is_new_episode = self.helper.insert_terms(
                 post_id=post_id,
                 terms=episode_term_name,
                 taxonomy="episodes",
                 is_title=True,
                 term_slug=episode_term_slug,
             )
+            episode_terms.append((episode_term_id, is_new_episode))
 
-            if not is_new_episode:
-                continue
-
-            len_episode_links = 0
-            logging.info(f"Inserting new Episode {episode_number}: {episode_title}")
-
-            termmeta_data = [
-                (episode_term_id, "episode_number", episode_number),
-                (episode_term_id, "name", episode_title),
-                (episode_term_id, "season_number", self.film["season_number"]),
-                (episode_term_id, "tr_id_post", post_id),
+        written_episodes = self.get_written_episodes(
+            [
+                episode_term_id
+                for position, (episode_term_id, is_new_episode) in enumerate(
+                    episode_terms
+                )
+                if not is_new_episode and position >= checkpoint
             ]
+        )
 
-            if thumb_id != "0":
-                termmeta_data.append(
-                    (episode_term_id, "still_path", thumb_id),
-                )
+        # The season's count covers the episodes written by earlier runs too,
+        # e.g. the ones before a crash
+        len_written_episodes = 0
+        len_episodes = 0
+        len_flushed_episodes = 0
+        chunk = []
+        chunk_bytes = 0
+
+        for position, ((episode_number, episode_title), episode_term) in enumerate(
+            zip(self.episode.items(), episode_terms)
+        ):
+            episode_term_id, is_new_episode = episode_term
+            if not is_new_episode:
+                if position < checkpoint or episode_term_id in written_episodes:
+                    len_written_episodes += 1
+                    continue
+                logging.info(f"Resuming half-written Episode {episode_number}")
             else:
-                termmeta_data.append(
-                    (episode_term_id, "still_path_hotlink", self.film["cover_src"]),
-                )
-            quality = self.film.get("quality", "HD")
+                logging.info(f"Inserting new Episode {episode_number}: {episode_title}")
 
-            episode_links = [
-                f"https://www.2embed.to/embed/tmdb/tv?id={self.episodes.get('tmdb_id', '0')}&s={self.film['season_number']}&e={episode_number}"
-            ]
-            for link in episode_links:
-                if link:
-                    termmeta_data.append(
-                        (
-                            episode_term_id,
-                            f"trglinks_{len_episode_links}",
-                            helper.generate_trglinks(
-                                server=CONFIG.LINK_LANGUAGE,
-                                link=link,
-                                lang=quality,
-                                quality=CONFIG.LINK_LANGUAGE,
-                            ),
-                        )
-                    )
-                    len_episode_links += 1
-
-            termmeta_data.append(
-                (episode_term_id, "trgrabber_tlinks", len_episode_links)
+            termmeta_data, len_episode_links = self.generate_episode_termmeta(
+                post_id, episode_term_id, episode_number, episode_title, thumb_id
             )
-
-            helper.insert_postmeta(termmeta_data, "termmeta")
-
+            chunk.extend(termmeta_data)
+            chunk_bytes += sum(len(str(row[2])) + len(row[1]) for row in termmeta_data)
             len_episodes += len_episode_links > 0
 
-        table = f"{CONFIG.TABLE_PREFIX}termmeta"
-        condition = f"term_id={season_term_id} AND meta_key='number_of_episodes'"
-        self.update_meta_for_post_or_term(table, condition, len_episodes)
+            if len(chunk) >= max_rows or chunk_bytes >= max_bytes:
+                self.flush_episodes(
+                    post_id,
+                    season_term_id,
+                    chunk,
+                    len_written_episodes + len_episodes,
+                    len_episodes - len_flushed_episodes,
+                )
+                self.save_episodes_checkpoint(
+                    season_term_id, position + 1, is_checkpoint_saved
+                )
+                # Long seasons write their counters with every checkpoint
+                self.apply_counters()
+                is_checkpoint_saved = True
+                len_flushed_episodes = len_episodes
+                chunk = []
+                chunk_bytes = 0
+
+        self.flush_episodes(
+            post_id,
+            season_term_id,
+            chunk,
+            len_written_episodes + len_episodes,
+            len_episodes - len_flushed_episodes,
+        )
+        if len(self.episode) > checkpoint:
+            self.save_episodes_checkpoint(
+                season_term_id, len(self.episode), is_checkpoint_saved
+            )
 
-        table = f"{CONFIG.TABLE_PREFIX}postmeta"
-        condition = f"post_id={post_id} AND meta_key='number_of_episodes'"
-        self.update_meta_for_post_or_term(table, condition, len_episodes, adding=True)
+        self.new_episodes += len_episodes
 
     def insert_season(self, post_id: int):
         season_term_name = (
             self.film["post_title"] + " - Season " + self.film["season_number"]
         )
         season_term_slug = self.film["slug"] + " - " + self.film["season_number"]
-        season_term_id, isNewSeason = helper.insert_terms(
+        season_term_id, isNewSeason = self.helper.insert_terms(
             post_id=post_id,
             terms=season_term_name,
             taxonomy="seasons",
@@ -678,45 +969,56 @@ class Toronites:
             term_slug=season_term_slug,
         )
 
-        termmeta_data = [
-            (season_term_id, "number_of_episodes", "0"),
-            (season_term_id, "name", "Season " + self.film["season_number"]),
-            (season_term_id, "overview", ""),
-            (season_term_id, "tr_id_post", post_id),
-            (season_term_id, "poster_path_hotlink", self.film["cover_src"]),
-            (season_term_id, "season_number", self.film["season_number"]),
-        ]
-
         if isNewSeason:
+            termmeta_data = [
+                (season_term_id, "number_of_episodes", "0"),
+                (season_term_id, "name", "Season " + self.film["season_number"]),
+                (season_term_id, "overview", ""),
+                (season_term_id, "tr_id_post", post_id),
+                (season_term_id, "poster_path_hotlink", self.film["cover_src"]),
+                (season_term_id, "season_number", self.film["season_number"]),
+                (season_term_id, EPISODES_CHECKPOINT_KEY, "0"),
+            ]
+
             logging.info(f"Inserted new season: {season_term_name}")
-            helper.insert_postmeta(termmeta_data, "termmeta")
+            self.helper.insert_postmeta(termmeta_data, "termmeta")
 
-            table = f"{CONFIG.TABLE_PREFIX}postmeta"
-            condition = f"post_id={post_id} AND meta_key='number_of_seasons'"
-            self.update_meta_for_post_or_term(
-                table, condition, self.film["season_number"]
+            self.add_counter(
+                f"{self.helper.db.table_prefix}postmeta",
+                "post_id",
+                post_id,
+                "number_of_seasons",
+                self.film["season_number"],
             )
 
         return season_term_id
 
-    def insert_film(self):
-        self.film["post_title"] = self.film["title"]
+    def insert_film(self, throttle: bool = True):
+        # One scope per film for the opt-in SQL recorder's N+1 checks
+        with recorder.film(f'{self.film["post_type"]}:{self.film["slug"]}'):
+            self.film["post_title"] = self.film["title"]
 
-        post_id, is_new_post_inserted = self.insert_root_film()
+            post_id, is_new_post_inserted = self.insert_root_film()
 
-        if not post_id:
-            return
+            if not post_id:
+                return
 
-        if self.film["post_type"] != CONFIG.TYPE_TV_SHOWS:
-            if is_new_post_inserted:
-                self.insert_movie_details(post_id)
-            return
+            if self.film["post_type"] != CONFIG.TYPE_TV_SHOWS:
+                if is_new_post_inserted:
+                    self.insert_movie_details(post_id)
+                return
+
+            for key, value in self.episodes.items():
+                if "season" in key.lower():
+                    self.film["season_number"] = self.helper.get_season_number(key)
+                    self.episode = value
+                    season_term_id = self.insert_season(post_id)
+                    self.insert_episode(post_id, season_term_id, self.film["cover_id"])
+
+            self.apply_counters()
 
-        for key, value in self.episodes.items():
-            if "season" in key.lower():
-                self.film["season_number"] = helper.get_season_number(key)
-                self.episode = value
-                season_term_id = self.insert_season(post_id)
-                self.insert_episode(post_id, season_term_id, self.film["cover_id"])
+            # Paces live crawls; replays and exports have nothing to pace
+            if throttle:
+                sleep(1)
 
-        sleep(1)
+            return self.new_episodes
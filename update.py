@@ -1,18 +1,5 @@
-import logging
-import time
-
-from base import Crawler
-from settings import CONFIG
-
-logging.basicConfig(format="%(asctime)s %(levelname)s:%(message)s", level=logging.INFO)
-
-
-crawler = Crawler()
+import daemon
 
+# Kept for existing deployments, daemon.py runs this alongside the others
 if __name__ == "__main__":
-    while True:
-        try:
-            crawler.update()
-        except Exception as e:
-            pass
-        time.sleep(CONFIG.WAIT_BETWEEN_LATEST)
+    daemon.main(["homepage"])
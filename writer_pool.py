@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import queue
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from _db import get_target_database
+from dooplay import POST_TYPES, DooPlay
+from helper import Helper
+from models import Film
+from settings import CONFIG
+from toronites import Toronites, ToronitesHelper, helper
+
+
+def write_toronites(film: dict, episodes: dict, throttle: bool = True):
+    return Toronites(film=film, episodes=episodes).insert_film(throttle=throttle)
+
+
+class FilmWriterPool:
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queued: int = 0,
+        write_film=None,
+        name: str = "film-writer",
+    ):
+        self.name = name
+        self.write_film = write_film or write_toronites
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        # Bounds how many crawled films may wait in memory for a writer, so a
+        # fast crawl can't run arbitrarily far ahead of the database.
+        self.slots = threading.BoundedSemaphore(max_queued or workers * 4)
+        self.slug_locks = {}
+        self.slug_locks_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+
+    def acquire_slug(self, key: tuple) -> threading.Lock:
+        with self.slug_locks_lock:
+            lock, users = self.slug_locks.get(key, (threading.Lock(), 0))
+            self.slug_locks[key] = (lock, users + 1)
+        lock.acquire()
+        return lock
+
+    def release_slug(self, key: tuple):
+        with self.slug_locks_lock:
+            lock, users = self.slug_locks[key]
+            if users == 1:
+                del self.slug_locks[key]
+            else:
+                self.slug_locks[key] = (lock, users - 1)
+        lock.release()
+
+    def count(self, written: int = 0, failed: int = 0):
+        with self.slug_locks_lock:
+            self.written += written
+            self.failed += failed
+
+    def write(self, record: Film):
+        key = (record.post_type, record.slug)
+        self.acquire_slug(key)
+        try:
+            film, episodes = record.to_data()
+            res = self.write_film(film, episodes)
+            self.count(written=1)
+            return res
+        except Exception as e:
+            self.count(failed=1)
+            helper.error_log(
+                msg=f"Failed to write film {key} to {self.name}\n{e}",
+                log_file="writer_pool.write.log",
+            )
+            raise
+        finally:
+            self.release_slug(key)
+            self.slots.release()
+
+    def submit(self, film: dict, episodes: dict):
+        # Queued films are kept as compact records, which also drops the
+        # reference to the parsed page held by lazy crawl results.
+        return self.submit_record(Film.from_data(film, episodes))
+
+    def write_and_wait(self, film: dict, episodes: dict):
+        return self.submit(film, episodes).result()
+
+    def submit_record(self, record: Film, timeout: float = None):
+        if not self.slots.acquire(timeout=timeout):
+            raise queue.Full(f"{self.name} queue is full")
+        try:
+            return self.executor.submit(self.write, record)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def shutdown(self, wait: bool = True):
+        logging.info(f"Draining {self.name} pool...")
+        self.executor.shutdown(wait=wait)
+        logging.info(
+            f"{self.name} pool done: {self.written} written, {self.failed} failed"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+
+
+class AsyncFilmWriter:
+    # asyncio front for a FilmWriterPool: coroutines on one loop await whole
+    # film writes, at most `workers` in flight. Each film is a single hop
+    # into the pool's executor, where the blocking insert_film runs on a
+    # pooled connection, so the loop never waits on MySQL and per-slug
+    # ordering is kept by the pool.
+    def __init__(self, workers: int = 4, write_film=None, name: str = "async-writer"):
+        self.workers = workers
+        self.pool = FilmWriterPool(
+            workers=workers, max_queued=workers, write_film=write_film, name=name
+        )
+        self.in_flight = asyncio.Semaphore(workers)
+
+    async def write(self, film: dict, episodes: dict):
+        record = Film.from_data(film, episodes)
+        async with self.in_flight:
+            return await asyncio.wrap_future(self.pool.submit_record(record))
+
+    async def write_many(self, films: list) -> list:
+        # films: [(film, episodes)], results in the same order
+        return await asyncio.gather(
+            *(self.write(film, episodes) for film, episodes in films)
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.shutdown)
+
+
+class FanOutWriter:
+    # Hands every crawled film to several writer targets (sites), each with
+    # its own database connections, thread pool and bounded queue. A target
+    # whose queue stays full skips the film instead of holding up the crawl
+    # for the others; skipped films are logged to be replayed later.
+    def __init__(
+        self, targets: list, submit_timeout: float = 5, result_timeout: float = 60
+    ):
+        self.targets = targets
+        self.submit_timeout = submit_timeout
+        self.result_timeout = result_timeout
+        self.skipped = {target.name: 0 for target in targets}
+
+    def submit(self, film: dict, episodes: dict) -> list:
+        record = Film.from_data(film, episodes)
+        futures = []
+        for target in self.targets:
+            try:
+                futures.append(
+                    target.submit_record(record, timeout=self.submit_timeout)
+                )
+            except queue.Full:
+                self.skipped[target.name] += 1
+                helper.error_log(
+                    msg=f"{target.name} skipped {record.post_type}\t{record.slug}",
+                    log_file=f"writer_pool.{target.name}.skipped.log",
+                )
+        return futures
+
+    def write_and_wait(self, film: dict, episodes: dict):
+        # Highest new episode count among the targets. Raises unless every
+        # target wrote the film within result_timeout, so a skipped or
+        # still running write is never taken for a finished one; slower
+        # targets keep writing in the background.
+        futures = self.submit(film, episodes)
+        key = (film["post_type"], film["slug"])
+        if len(futures) < len(self.targets):
+            raise queue.Full(
+                f"{len(self.targets) - len(futures)} of {len(self.targets)} "
+                f"targets skipped {key}"
+            )
+
+        done, not_done = wait(futures, timeout=self.result_timeout)
+        if not_done:
+            raise TimeoutError(
+                f"{len(not_done)} of {len(self.targets)} targets still writing "
+                f"{key} after {self.result_timeout}s"
+            )
+
+        results = [future.result() for future in futures]
+        return max((res for res in results if res is not None), default=None)
+
+    def shutdown(self, wait: bool = True):
+        for target in self.targets:
+            target.shutdown(wait=wait)
+            if self.skipped[target.name]:
+                logging.info(f"{target.name} skipped {self.skipped[target.name]} films")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+
+
+def get_target_post_types(target: dict) -> dict:
+    # Crawled post type -> the target's; Toronites targets share the
+    # crawler's types
+    if target.get("theme", "toronites") == "dooplay":
+        return {**POST_TYPES, **target.get("post_types", {})}
+    return {}
+
+
+def get_target_writer(target: dict, throttle: bool = True):
+    db = get_target_database(target, pool_size=target.get("workers", 4))
+    if target.get("theme", "toronites") == "dooplay":
+        dooplay_helper = Helper(db=db)
+        post_types = get_target_post_types(target)
+        return lambda film, episodes: DooPlay(
+            film=film,
+            episodes=episodes,
+            dooplay_helper=dooplay_helper,
+            post_types=post_types,
+        ).insert_film(throttle=throttle)
+
+    toronites_helper = ToronitesHelper(db=db)
+    return lambda film, episodes: Toronites(
+        film=film, episodes=episodes, toronites_helper=toronites_helper
+    ).insert_film(throttle=throttle)
+
+
+def get_fan_out_writer(throttle: bool = True) -> FanOutWriter:
+    targets = getattr(CONFIG, "WRITER_TARGETS", [])
+    if not targets:
+        return None
+
+    return FanOutWriter(
+        [
+            FilmWriterPool(
+                workers=target.get("workers", 4),
+                max_queued=target.get("max_queued", 0),
+                write_film=get_target_writer(target, throttle),
+                name=target["name"],
+            )
+            for target in targets
+        ],
+        submit_timeout=getattr(CONFIG, "WRITER_SUBMIT_TIMEOUT", 5),
+        result_timeout=getattr(CONFIG, "WRITER_RESULT_TIMEOUT", 60),
+    )
+
+
+def get_writer_pool(throttle: bool = True):
+    fan_out_writer = get_fan_out_writer(throttle)
+    if fan_out_writer:
+        return fan_out_writer
+
+    workers = getattr(CONFIG, "WRITER_THREADS", 0)
+    if not workers:
+        return None
+
+    return FilmWriterPool(
+        workers=workers,
+        max_queued=getattr(CONFIG, "WRITER_MAX_QUEUED", 0),
+        write_film=lambda film, episodes: write_toronites(film, episodes, throttle),
+    )
+
+
+def get_async_writer(throttle: bool = True) -> AsyncFilmWriter:
+    # More writers than pooled connections would only queue up in get_conn
+    return AsyncFilmWriter(
+        workers=getattr(
+            CONFIG, "ASYNC_WRITER_WORKERS", getattr(CONFIG, "DB_POOL_SIZE", 0) or 4
+        ),
+        write_film=lambda film, episodes: write_toronites(film, episodes, throttle),
+    )
+
+
+def exit_on_sigterm():
+    # SIGTERM becomes SystemExit so `with` blocks get to drain their writers
+    def handler(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handler)